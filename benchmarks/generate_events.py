@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+"""
+Write synthetic NOMAD-like or POLARIS-like event NeXus files of any size.
+
+The pixels and flight paths come from the instrument definition loaded by
+`LoadEmptyInstrument`, so the files load with `LoadEventNexus` (and so with
+`load` and `TotalScatteringReduction`) like measured runs. Events are
+spread over the pixels by solid angle and over the pulses of the run
+uniformly. Their times of flight follow the wavelength spectrum of a room
+temperature moderator (a Maxwellian plus an epithermal 1/E tail) with a
+fraction scattered into the Bragg peaks of silicon, so focusing, binning
+and fitting see realistic data. Each file also holds a histogram monitor
+and the proton charge logs used for normalization.
+
+Events are written a chunk of pulses at a time, so files with hundreds of
+millions of events can be generated without holding them in memory. The
+same seed always gives the same files.
+
+Usage:
+    python benchmarks/generate_events.py [--instrument NOMAD|POLARIS]
+                                         [--events N] [--pixels N]
+                                         [--runs N] [--first-run N]
+                                         [--output-dir DIR] [--seed S]
+"""
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import os
+import re
+import time
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+from mantid.simpleapi import DeleteWorkspace, LoadEmptyInstrument
+
+# Time of flight in microseconds per meter of flight path and Angstrom
+TOF_PER_METER_ANGSTROM = 252.7784
+
+# Facility conventions of each instrument
+INSTRUMENTS = {
+    'NOMAD': {'short_name': 'NOM', 'file_format': '{}_{}.nxs',
+              'frequency': 60., 'first_run': 900000},
+    'POLARIS': {'short_name': 'POLARIS', 'file_format': '{}{:08d}.nxs',
+                'frequency': 50., 'first_run': 900000},
+}
+
+# Moderator spectrum: Maxwellian of characteristic wavelength
+# `MODERATOR_WAVELENGTH` (Angstrom, 300 K) plus a 1/E epithermal tail
+MODERATOR_WAVELENGTH = 1.78
+EPITHERMAL_FRACTION = 0.15
+
+# Silicon reflections, Angstrom
+SILICON_LATTICE = 5.431
+BRAGG_RESOLUTION = 0.005  # delta d / d
+
+# Proton charge per pulse, picoCoulomb
+PULSE_CHARGE = 1.0e7
+
+
+def instrument_pixels(instrument, pixels=None):
+    """ Detector IDs, flight paths and banks of the pixels of an instrument
+
+    :param instrument: Instrument name (ie `NOMAD`)
+    :type instrument: str
+    :param pixels: Number of pixels to keep, evenly spread over the
+                   instrument, all of them if None
+    :type pixels: int
+
+    :return: Pixel geometry (`ids`, `l1`, `l2`, `two_theta`, `banks`) and
+             monitors (`monitor_ids`, `monitor_distances`)
+    :rtype: dict
+    """
+    ws = LoadEmptyInstrument(InstrumentName=instrument,
+                             OutputWorkspace='__generate_events_instrument')
+    spectrum_info = ws.spectrumInfo()
+    detector_info = ws.detectorInfo()
+    component_info = ws.componentInfo()
+    source = spectrum_info.sourcePosition()
+
+    ids, l2, two_theta, banks = list(), list(), list(), list()
+    monitor_ids, monitor_distances = list(), list()
+    bank_of_parent = dict()
+    for index in range(ws.getNumberHistograms()):
+        detector_id = ws.getSpectrum(index).getDetectorIDs()[0]
+        if spectrum_info.isMonitor(index):
+            monitor_ids.append(detector_id)
+            monitor_distances.append(
+                spectrum_info.position(index).distance(source))
+            continue
+        ids.append(detector_id)
+        l2.append(spectrum_info.l2(index))
+        two_theta.append(spectrum_info.twoTheta(index))
+
+        # Pixels are written in the events of the bank they belong to
+        parent = component_info.parent(detector_info.indexOf(detector_id))
+        if parent not in bank_of_parent:
+            component = parent
+            bank = 'bank1'
+            while component_info.hasParent(component):
+                match = re.match(r'bank\d+$', component_info.name(component))
+                if match:
+                    bank = match.group(0)
+                    break
+                component = component_info.parent(component)
+            bank_of_parent[parent] = bank
+        banks.append(bank_of_parent[parent])
+    l1 = spectrum_info.l1()
+    DeleteWorkspace(ws)
+
+    keep = np.arange(len(ids))
+    if pixels is not None and pixels < len(ids):
+        keep = np.unique(np.linspace(0, len(ids) - 1, pixels).astype(int))
+    return {'ids': np.array(ids, dtype=np.uint32)[keep],
+            'l1': l1,
+            'l2': np.array(l2)[keep],
+            'two_theta': np.array(two_theta)[keep],
+            'banks': np.array(banks)[keep],
+            'monitor_ids': monitor_ids,
+            'monitor_distances': monitor_distances}
+
+
+def silicon_reflections(d_min=0.3):
+    """ d-spacings and multiplicities of the reflections of silicon
+
+    :param d_min: Smallest d-spacing, Angstrom
+    :type d_min: float
+
+    :return: d-spacings and multiplicities
+    :rtype: tuple
+    """
+    h_max = int(np.ceil(SILICON_LATTICE / d_min))
+    counts = OrderedDict()
+    for h in range(-h_max, h_max + 1):
+        for k in range(-h_max, h_max + 1):
+            for m in range(-h_max, h_max + 1):
+                # Diamond structure: all odd, or all even summing to 4n
+                odd = h % 2 and k % 2 and m % 2
+                even = not (h % 2 or k % 2 or m % 2) and (h + k + m) % 4 == 0
+                squared = h * h + k * k + m * m
+                if squared and (odd or even):
+                    counts[squared] = counts.get(squared, 0) + 1
+    d = SILICON_LATTICE / np.sqrt(np.array(list(counts.keys()), dtype=float))
+    multiplicity = np.array(list(counts.values()), dtype=float)
+    keep = d >= d_min
+    return d[keep], multiplicity[keep]
+
+
+def moderator_wavelengths(rng, size, wavelength_min, wavelength_max):
+    """ Sample wavelengths of the incident spectrum
+
+    :param rng: Random generator
+    :type rng: numpy.random.Generator
+    :param size: Number of wavelengths
+    :type size: int
+    :param wavelength_min: Shortest wavelength, Angstrom
+    :type wavelength_min: float
+    :param wavelength_max: Longest wavelength, Angstrom
+    :type wavelength_max: float
+
+    :return: Wavelengths, Angstrom
+    :rtype: numpy.ndarray
+    """
+    # A Maxwellian flux per unit wavelength, lambda^-5 exp(-(lambda_T /
+    # lambda)^2), is Gamma(2) distributed in (lambda_T / lambda)^2
+    wavelengths = MODERATOR_WAVELENGTH / np.sqrt(rng.gamma(2., size=size))
+    epithermal = rng.random(size) < EPITHERMAL_FRACTION
+    wavelengths[epithermal] = np.exp(rng.uniform(
+        np.log(wavelength_min), np.log(wavelength_max),
+        size=np.count_nonzero(epithermal)))
+    return np.clip(wavelengths, wavelength_min, wavelength_max)
+
+
+def moderator_flux(wavelengths):
+    """ Flux of the incident spectrum relative to the Maxwellian peak,
+    capped at 1 """
+    ratio = (MODERATOR_WAVELENGTH / wavelengths) ** 2
+    maxwellian = ratio ** 2.5 * np.exp(-ratio) / (2.5 ** 2.5 * np.exp(-2.5))
+    return np.minimum((1. - EPITHERMAL_FRACTION) * maxwellian
+                      + EPITHERMAL_FRACTION * MODERATOR_WAVELENGTH
+                      / wavelengths, 1.)
+
+
+class EventGenerator(object):
+    """ Generates the events of the pixels of one bank
+
+    :param geometry: Pixel geometry from `instrument_pixels`
+    :type geometry: dict
+    :param pixels: Indices of the bank pixels in `geometry`
+    :type pixels: numpy.ndarray
+    :param frame: Length of a frame, microseconds
+    :type frame: float
+    :param bragg_fraction: Fraction of the events in the Bragg peaks
+    :type bragg_fraction: float
+    """
+
+    def __init__(self, geometry, pixels, frame, bragg_fraction):
+        self.ids = geometry['ids'][pixels]
+        self.path = geometry['l1'] + geometry['l2'][pixels]
+        self.sin_theta = np.sin(geometry['two_theta'][pixels] / 2.)
+        self.frame = frame
+        self.bragg_fraction = bragg_fraction
+        self.d, multiplicity = silicon_reflections()
+        self.reflection_weights = multiplicity / multiplicity.sum()
+
+        # Wavelengths reaching each pixel within one frame
+        self.wavelength_max = frame / (TOF_PER_METER_ANGSTROM * self.path)
+        self.wavelength_min = 0.1
+
+        # Solid angle of each pixel
+        weights = 1. / geometry['l2'][pixels] ** 2
+        self.pixel_weights = weights / weights.sum()
+
+    def events(self, rng, size):
+        """ Pixel IDs and times of flight of `size` events
+
+        :param rng: Random generator
+        :type rng: numpy.random.Generator
+        :param size: Number of events
+        :type size: int
+
+        :return: Detector IDs and times of flight (microseconds)
+        :rtype: tuple
+        """
+        pixel = rng.choice(len(self.ids), size=size, p=self.pixel_weights)
+        wavelengths = moderator_wavelengths(
+            rng, size, self.wavelength_min, self.wavelength_max.max())
+
+        # Bragg scattering at 2 d sin(theta), kept in proportion to the
+        # incident flux at that wavelength
+        bragg = np.flatnonzero(rng.random(size) < self.bragg_fraction)
+        d = rng.choice(self.d, size=len(bragg), p=self.reflection_weights)
+        d *= 1. + BRAGG_RESOLUTION * rng.standard_normal(len(bragg))
+        bragg_wavelengths = 2. * d * self.sin_theta[pixel[bragg]]
+        accepted = rng.random(len(bragg)) < moderator_flux(bragg_wavelengths)
+        accepted &= bragg_wavelengths > self.wavelength_min
+        wavelengths[bragg[accepted]] = bragg_wavelengths[accepted]
+
+        tof = TOF_PER_METER_ANGSTROM * self.path[pixel] * wavelengths
+        return self.ids[pixel], np.mod(tof, self.frame).astype(np.float32)
+
+
+def write_logs(entry, pulse_times, start):
+    """ Write the proton charge logs used to normalize by current """
+    charge = np.full(len(pulse_times), PULSE_CHARGE)
+    logs = entry.create_group('DASlogs')
+    logs.attrs['NX_class'] = 'NXcollection'
+    log = logs.create_group('proton_charge')
+    log.attrs['NX_class'] = 'NXlog'
+    dataset = log.create_dataset('time', data=pulse_times)
+    dataset.attrs['units'] = 'second'
+    dataset.attrs['start'] = start
+    dataset = log.create_dataset('value', data=charge)
+    dataset.attrs['units'] = 'picoCoulomb'
+    dataset = entry.create_dataset('proton_charge', data=charge.sum())
+    dataset.attrs['units'] = 'picoCoulomb'
+
+
+def write_monitors(entry, geometry, frame, events, rng):
+    """ Write histogram monitors seeing the incident spectrum """
+    edges = np.arange(0., frame + 10., 10.)
+    for number, (monitor_id, distance) in enumerate(zip(
+            geometry['monitor_ids'], geometry['monitor_distances']), 1):
+        size = max(int(events * 1e-3), 1000)
+        wavelengths = moderator_wavelengths(
+            rng, size, 0.1, frame / (TOF_PER_METER_ANGSTROM * distance))
+        counts, _ = np.histogram(
+            TOF_PER_METER_ANGSTROM * distance * wavelengths, edges)
+        monitor = entry.create_group('monitor{}'.format(number))
+        monitor.attrs['NX_class'] = 'NXmonitor'
+        monitor.create_dataset('data', data=counts.astype(np.uint32))
+        monitor['data'].attrs['signal'] = 1
+        monitor['data'].attrs['axes'] = 'time_of_flight'
+        monitor.create_dataset('time_of_flight', data=edges)
+        monitor['time_of_flight'].attrs['units'] = 'microsecond'
+        monitor.create_dataset('distance', data=distance)
+        monitor.create_dataset('monitor_number', data=abs(monitor_id))
+        monitor.create_dataset('mode', data=np.bytes_('monitor'))
+
+
+def write_run(filename, instrument, run_number, geometry, events,
+              duration=600., bragg_fraction=0.3, chunk_pulses=10000,
+              seed=None):
+    """ Write one synthetic run
+
+    :param filename: Path of the NeXus file
+    :type filename: str
+    :param instrument: Instrument name (ie `NOMAD`)
+    :type instrument: str
+    :param run_number: Run number written in the file
+    :type run_number: int
+    :param geometry: Pixel geometry from `instrument_pixels`
+    :type geometry: dict
+    :param events: Number of events in the run
+    :type events: int
+    :param duration: Length of the run, seconds
+    :type duration: float
+    :param bragg_fraction: Fraction of the events in the Bragg peaks
+    :type bragg_fraction: float
+    :param chunk_pulses: Number of pulses generated at once, which bounds
+                         the memory used
+    :type chunk_pulses: int
+    :param seed: Seed of the random generator
+    :type seed: int
+    """
+    rng = np.random.default_rng(seed)
+    frequency = INSTRUMENTS[instrument]['frequency']
+    frame = 1.e6 / frequency
+    pulses = int(duration * frequency)
+    pulse_times = np.arange(pulses) / frequency
+    start = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(
+        1.5e9 + run_number * duration))
+
+    bank_names = np.unique(geometry['banks'])
+    bank_pixels = [np.flatnonzero(geometry['banks'] == name)
+                   for name in bank_names]
+    weights = np.array([np.sum(1. / geometry['l2'][pixels] ** 2)
+                        for pixels in bank_pixels])
+    bank_events = rng.multinomial(events, weights / weights.sum())
+
+    with h5py.File(filename, 'w') as handle:
+        entry = handle.create_group('entry')
+        entry.attrs['NX_class'] = 'NXentry'
+        entry.create_dataset('run_number', data=np.bytes_(str(run_number)))
+        entry.create_dataset('title', data=np.bytes_(
+            'Synthetic {} run {}'.format(instrument, run_number)))
+        entry.create_dataset('start_time', data=np.bytes_(start))
+        entry.create_dataset('end_time', data=np.bytes_(time.strftime(
+            '%Y-%m-%dT%H:%M:%S', time.gmtime(
+                1.5e9 + (run_number + 1) * duration))))
+        entry.create_dataset('duration', data=duration)
+        entry.create_dataset('total_counts', data=events)
+        instrument_group = entry.create_group('instrument')
+        instrument_group.attrs['NX_class'] = 'NXinstrument'
+        instrument_group.create_dataset('name', data=np.bytes_(instrument))
+        write_logs(entry, pulse_times, start)
+        write_monitors(entry, geometry, frame, events, rng)
+
+        for name, pixels, count in zip(bank_names, bank_pixels, bank_events):
+            generator = EventGenerator(geometry, pixels, frame,
+                                       bragg_fraction)
+            per_pulse = rng.multinomial(count, np.full(pulses, 1. / pulses))
+            group = entry.create_group('{}_events'.format(name))
+            group.attrs['NX_class'] = 'NXevent_data'
+            event_ids = group.create_dataset(
+                'event_id', shape=(count,), dtype=np.uint32,
+                chunks=True if count else None)
+            offsets = group.create_dataset(
+                'event_time_offset', shape=(count,), dtype=np.float32,
+                chunks=True if count else None)
+            offsets.attrs['units'] = 'microsecond'
+            index = np.concatenate([[0], np.cumsum(per_pulse)[:-1]])
+            group.create_dataset('event_index', data=index.astype(np.uint64))
+            zero = group.create_dataset('event_time_zero', data=pulse_times)
+            zero.attrs['units'] = 'second'
+            zero.attrs['offset'] = start
+            group.create_dataset('total_counts', data=count)
+
+            written = 0
+            for first in range(0, pulses, chunk_pulses):
+                size = int(per_pulse[first:first + chunk_pulses].sum())
+                if not size:
+                    continue
+                ids, tof = generator.events(rng, size)
+                event_ids[written:written + size] = ids
+                offsets[written:written + size] = tof
+                written += size
+
+
+def generate_runs(output_dir, instrument='NOMAD', events=10000000,
+                  pixels=None, runs=1, first_run=None, seed=0, **kwargs):
+    """ Write synthetic runs of an instrument
+
+    :param output_dir: Directory of the NeXus files
+    :type output_dir: str
+    :param instrument: `NOMAD` or `POLARIS`
+    :type instrument: str
+    :param events: Number of events per run
+    :type events: int
+    :param pixels: Number of pixels with events, all of them if None
+    :type pixels: int
+    :param runs: Number of runs
+    :type runs: int
+    :param first_run: Run number of the first run
+    :type first_run: int
+    :param seed: Seed of the first run, the next runs use the next seeds
+    :type seed: int
+
+    :return: Paths of the files
+    :rtype: list
+    """
+    if instrument not in INSTRUMENTS:
+        msg = "Unknown instrument '{}', expected one of {}"
+        raise RuntimeError(msg.format(instrument, sorted(INSTRUMENTS)))
+    conventions = INSTRUMENTS[instrument]
+    if first_run is None:
+        first_run = conventions['first_run']
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    geometry = instrument_pixels(instrument, pixels)
+    filenames = list()
+    for run in range(runs):
+        run_number = first_run + run
+        filename = os.path.join(output_dir, conventions['file_format'].format(
+            conventions['short_name'], run_number))
+        write_run(filename, instrument, run_number, geometry, events,
+                  seed=seed + run, **kwargs)
+        filenames.append(filename)
+    return filenames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--instrument', choices=sorted(INSTRUMENTS),
+                        default='NOMAD')
+    parser.add_argument('--events', type=float, default=1e7,
+                        help='Events per run (ie 2e8)')
+    parser.add_argument('--pixels', type=int,
+                        help='Pixels with events (default: all)')
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--first-run', type=int)
+    parser.add_argument('--duration', type=float, default=600.,
+                        help='Length of each run in seconds')
+    parser.add_argument('--bragg-fraction', type=float, default=0.3)
+    parser.add_argument('--output-dir', default='synthetic_data')
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    start = time.time()
+    filenames = generate_runs(
+        options.output_dir,
+        instrument=options.instrument,
+        events=int(options.events),
+        pixels=options.pixels,
+        runs=options.runs,
+        first_run=options.first_run,
+        seed=options.seed,
+        duration=options.duration,
+        bragg_fraction=options.bragg_fraction)
+    for filename in filenames:
+        print("{} ({:.1f} MB)".format(
+            filename, os.path.getsize(filename) / 1e6))
+    print("{} runs of {} events in {:.1f} s".format(
+        len(filenames), int(options.events), time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
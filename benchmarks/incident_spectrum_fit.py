@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Compare the speed and accuracy of the incident spectrum fits.
+
+A Howells function with the shape of a water moderator spectrum, peaking
+at 1 A, is sampled on the `LambdaBinningForFit` of the NOMAD examples (or
+a finer one) with Poisson noise. Each `FitSpectrumWith` method of
+`FitIncidentSpectrum` is then evaluated on the `LambdaBinningForCalc` of
+the examples. Accuracy is the RMS relative error of the fit and the RMS
+error of lambda * f'(lambda) / f(lambda), the term of the Placzek
+correction taken from the fit, against the noiseless function. Both are
+taken within the fitted wavelengths, as the methods differ most where
+they extrapolate.
+
+Usage:
+    python benchmarks/incident_spectrum_fit.py [--steps S [S ...]]
+                                               [--methods M [M ...]]
+                                               [--repeat R]
+"""
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import time
+
+import numpy as np
+from mantid.simpleapi import CreateWorkspace
+
+from total_scattering.inelastic.incident_spectrum import \
+    fitCubicSpline, \
+    fitCubicSplineViaMantidSplineSmoothing, \
+    fitCubicSplineWithGaussConv, \
+    fitHowellsFunction, \
+    fitLSQSplineWithGaussConv
+
+# `LambdaBinningForFit` and `LambdaBinningForCalc` of the NOMAD examples
+FIT_RANGE = (0.16, 2.8)
+FIT_STEP = 0.04
+CALC_BINNING = (0.16, 0.0001, 2.9)
+
+# Howells function parameters (phi_max, phi_epi, lam_t, lam_1, lam_2, a)
+HOWELLS = (1., 0.05, 1.58, 0.3, 0.1, 0.1)
+PEAK_COUNTS = 1e5
+
+
+def howells(lambdas, phi_max, phi_epi, lam_t, lam_1, lam_2, a):
+    return phi_max * (lam_t ** 4. / lambdas ** 5.) \
+        * np.exp(-(lam_t / lambdas) ** 2.) \
+        + phi_epi / lambdas ** (1. + 2. * a) \
+        / (1. + np.exp((lambdas - lam_1) / lam_2))
+
+
+def via_mantid(x_fit, y_fit, x):
+    """ SplineSmoothing evaluates the spline on the fitted wavelengths only,
+    it is interpolated onto the calculated ones """
+    CreateWorkspace(OutputWorkspace='incident', DataX=x_fit, DataY=y_fit,
+                    UnitX='Wavelength')
+    step = x_fit[1] - x_fit[0]
+    fit, fit_prime = fitCubicSplineViaMantidSplineSmoothing(
+        'incident', Params='{},{},{}'.format(
+            x_fit[0] - 0.5 * step, step, x_fit[-1] + 0.5 * step),
+        MaxNumberOfBreaks=8)
+    return np.interp(x, x_fit, fit), np.interp(x, x_fit, fit_prime)
+
+
+# The `FitSpectrumWith` methods, called as in `FitIncidentSpectrum`
+METHODS = {
+    'CubicSpline': lambda x_fit, y_fit, x: fitCubicSpline(
+        x_fit, y_fit, x, s=1e7),
+    'CubicSplineViaMantid': via_mantid,
+    'HowellsFunction': fitHowellsFunction,
+    'GaussConvCubicSpline': lambda x_fit, y_fit, x:
+        fitCubicSplineWithGaussConv(x_fit, y_fit, x, sigma=2),
+    'GaussConvLSQSpline': lambda x_fit, y_fit, x:
+        fitLSQSplineWithGaussConv(x_fit, y_fit, x, sigma=2),
+}
+
+
+def spectrum(step, rng):
+    """ Noisy incident spectrum with PEAK_COUNTS at 1 A per FIT_STEP """
+    x_fit = np.arange(FIT_RANGE[0], FIT_RANGE[1], step)
+    scale = PEAK_COUNTS * step / FIT_STEP / howells(1., *HOWELLS)
+    y_fit = rng.poisson(scale * howells(x_fit, *HOWELLS)) / scale
+    return x_fit, y_fit
+
+
+def errors(x, fit, fit_prime, inside):
+    """ RMS relative error of the fit and RMS error of lambda f' / f """
+    x, fit, fit_prime = x[inside], fit[inside], fit_prime[inside]
+    truth = howells(x, *HOWELLS)
+    step = 1e-6
+    truth_prime = (howells(x + step, *HOWELLS)
+                   - howells(x - step, *HOWELLS)) / (2. * step)
+    fit_error = np.sqrt(np.mean((fit / truth - 1.) ** 2))
+    phi_error = np.sqrt(np.mean((x * fit_prime / fit
+                                 - x * truth_prime / truth) ** 2))
+    return fit_error, phi_error
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--steps', type=float, nargs='+',
+                        default=[FIT_STEP, 0.01, 0.002],
+                        help='Wavelength steps of the fitted data')
+    parser.add_argument('--methods', nargs='+', default=sorted(METHODS),
+                        choices=sorted(METHODS))
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+
+    start, step, stop = CALC_BINNING
+    x = np.arange(start, stop, step)
+    rng = np.random.RandomState(0)
+    print("{} wavelengths calculated".format(len(x)))
+    print("{:>8} {:>22} {:>10} {:>10} {:>10}".format(
+        'step', 'method', 'time (s)', 'fit rms', 'phi rms'))
+    for fit_step in options.steps:
+        x_fit, y_fit = spectrum(fit_step, rng)
+        for method in options.methods:
+            times = list()
+            try:
+                for _ in range(options.repeat):
+                    start = time.time()
+                    fit, fit_prime = METHODS[method](x_fit, y_fit, x)
+                    times.append(time.time() - start)
+            except (RuntimeError, ValueError) as error:
+                print("{:>8} {:>22} failed: {}".format(
+                    fit_step, method, error))
+                continue
+            inside = (x >= x_fit[0]) & (x <= x_fit[-1])
+            fit_error, phi_error = errors(x, fit, fit_prime, inside)
+            print("{:>8} {:>22} {:>10.4f} {:>10.4f} {:>10.4f}".format(
+                fit_step, method, min(times), fit_error, phi_error))
+
+
+if __name__ == '__main__':
+    main()
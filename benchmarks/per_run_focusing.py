@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Measure how focusing a multi-run load scales with the number of processes.
+
+The bundled NOMAD test files are loaded as a single run set with `load`,
+first serially (one AlignAndFocusPowderFromFiles call over all the files)
+and then with each run focused in its own worker process, for 2 to N
+processes. The summed spectra are compared to the serial ones before the
+timings are reported.
+
+Usage:
+    python benchmarks/per_run_focusing.py [--max-workers N] [--repeat R]
+                                          [files ...]
+"""
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import os
+import time
+
+import numpy as np
+from mantid import mtd
+
+from total_scattering.file_handling.load import load
+from total_scattering.utils import ROOT_DIR
+
+TEST_DATA_DIR = os.path.join(ROOT_DIR, 'tests', 'data')
+EXAMPLE_DIR = os.path.join(ROOT_DIR, 'examples')
+
+RUNS = ['NOM_144975.nxs', 'NOM_144976.nxs', 'NOM_144977.nxs',
+        'NOM_144992.nxs']
+
+ALIGN_AND_FOCUS_ARGS = {
+    'CalFilename': os.path.join(EXAMPLE_DIR, 'sns', 'nomad_cal.h5'),
+    'ResampleX': -6000,
+    'DSpacing': False,
+    'PreserveEvents': False,
+    'MaxChunkSize': 8,
+    'TMin': 300.0,
+    'TMax': 16667.0,
+}
+
+
+def time_load(ws_name, filenames, run_workers, repeat):
+    times = list()
+    for _ in range(repeat):
+        start = time.time()
+        load(ws_name, ','.join(filenames), run_workers=run_workers,
+             **ALIGN_AND_FOCUS_ARGS)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('files', nargs='*',
+                        help='Runs to sum (default: bundled NOMAD files)')
+    parser.add_argument('--max-workers', type=int,
+                        default=min(len(RUNS), os.cpu_count() or 1))
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+    filenames = options.files or [
+        os.path.join(TEST_DATA_DIR, name) for name in RUNS]
+
+    serial_time = time_load('serial', filenames, 1, options.repeat)
+    print("runs:        {}".format(len(filenames)))
+    print("{:>9} {:>10} {:>8}".format('processes', 'time (s)', 'speedup'))
+    print("{:>9} {:>10.2f} {:>8.2f}".format(1, serial_time, 1.))
+    for processes in range(2, options.max_workers + 1):
+        ws_name = 'parallel_{}'.format(processes)
+        parallel_time = time_load(
+            ws_name, filenames, processes, options.repeat)
+        if not np.allclose(mtd['serial'].extractY(),
+                           mtd[ws_name].extractY(), rtol=1e-10, atol=0.):
+            raise RuntimeError("{} processes differ from serial".format(
+                processes))
+        print("{:>9} {:>10.2f} {:>8.2f}".format(
+            processes, parallel_time, serial_time / parallel_time))
+
+
+if __name__ == '__main__':
+    main()
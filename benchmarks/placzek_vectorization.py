@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Compare the vectorized Placzek self-scattering correction with the loop it
+replaced.
+
+The former `CalculatePlaczekSelfScattering` computed one bank at a time and
+grew the output arrays with `np.append`, copying them for every bank. Both
+are run on the same synthetic incident spectrum, with the wavelength
+binning of `LambdaBinningForCalc` in the NOMAD examples (0.0001 A steps),
+for an increasing number of banks or detectors. The results are compared
+before the timings are reported.
+
+Usage:
+    python benchmarks/placzek_vectorization.py [--spectra N [N ...]]
+                                               [--repeat R]
+"""
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import time
+
+import numpy as np
+
+from total_scattering.inelastic.placzek import PlaczekSelfCorrection
+
+# NOMAD primary flight path and `LambdaBinningForCalc` of the examples
+L1 = 19.5
+LAMBDA_BINNING = (0.1, 0.0001, 3.0)
+SUMMATION_TERM = 0.0215
+
+
+def loop_correction(phi_1, eps_1, summation_term, L1, L2, Polar):
+    """ The former implementation, one bank at a time with `np.append` """
+    x_lambdas = np.array([])
+    placzek_correction = np.array([])
+    for l2, theta in zip(L2, Polar):
+        L_total = L1 + l2
+        f = L1 / L_total
+
+        angle_conv = np.pi / 180.
+        sin_theta_by_2 = np.sin(theta * angle_conv / 2.)
+
+        term1 = (f - 1.) * phi_1
+        term2 = f * eps_1
+        term3 = f - 3.
+
+        inelastic_placzek_self_correction = 2. * \
+            (term1 - term2 + term3) \
+            * sin_theta_by_2 * sin_theta_by_2 * summation_term
+        x_lambdas = np.append(x_lambdas, phi_1)
+        placzek_correction = np.append(
+            placzek_correction,
+            inelastic_placzek_self_correction)
+    return placzek_correction.reshape(len(L2), len(phi_1))
+
+
+def incident_terms():
+    """ phi_1 and eps_1 for a Maxwellian-like incident spectrum """
+    start, step, stop = LAMBDA_BINNING
+    x_lambda = np.arange(start, stop, step)
+    incident = x_lambda ** -5 * np.exp(-(1.78 / x_lambda) ** 2)
+    incident_prime = np.gradient(incident, x_lambda)
+    phi_1 = x_lambda * incident_prime / incident
+    c = -1. / 1.44
+    eps_1 = c * x_lambda * np.exp(c * x_lambda) / (1. - np.exp(c * x_lambda))
+    return phi_1, eps_1
+
+
+def best_time(func, repeat, *args):
+    times = list()
+    for _ in range(repeat):
+        start = time.time()
+        result = func(*args)
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--spectra', type=int, nargs='+',
+                        default=[6, 50, 200, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+
+    phi_1, eps_1 = incident_terms()
+    rng = np.random.RandomState(0)
+    print("{} wavelengths".format(len(phi_1)))
+    print("{:>8} {:>12} {:>12} {:>8}".format(
+        'spectra', 'loop (s)', 'vector (s)', 'speedup'))
+    for spectra in options.spectra:
+        L2 = rng.uniform(0.7, 2.1, spectra)
+        Polar = rng.uniform(5., 155., spectra)
+        args = (phi_1, eps_1, SUMMATION_TERM, L1, L2, Polar)
+        loop_time, expected = best_time(loop_correction, options.repeat,
+                                        *args)
+        vector_time, result = best_time(PlaczekSelfCorrection,
+                                        options.repeat, *args)
+        if not np.allclose(result, expected, rtol=1e-12, atol=1e-15):
+            raise RuntimeError("Corrections differ for {} spectra".format(
+                spectra))
+        print("{:>8} {:>12.4f} {:>12.4f} {:>7.1f}x".format(
+            spectra, loop_time, vector_time, loop_time / vector_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+"""
+Time the hot paths of the reduction on the bundled NOMAD and POLARIS data.
+
+Each benchmark times one call (`load`, `create_absorption_wksp`,
+`save_banks`, `FitIncidentSpectrum`, `CalculatePlaczekSelfScattering` or a
+full `TotalScatteringReduction`) over several repeats, after an untimed
+setup, and clears the Analysis Data Service in between. The results are
+written to a JSON file along with the versions and the machine they ran
+on. Given the JSON file of an earlier run as a baseline, the best times are
+compared and the script exits with an error if any benchmark got slower
+than the tolerance allows.
+
+Usage:
+    python benchmarks/suite.py [--repeat R] [--output results.json]
+                               [--baseline baseline.json] [--tolerance T]
+                               [--list] [names ...]
+"""
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from collections import OrderedDict
+
+import numpy as np
+import mantid
+from mantid import mtd
+from mantid.kernel import ConfigService
+from mantid.simpleapi import SetSample
+
+from total_scattering import __version__
+from total_scattering.file_handling.load import create_absorption_wksp, load
+from total_scattering.file_handling.save import save_banks
+from total_scattering.inelastic.incident_spectrum import \
+    FitIncidentSpectrum, \
+    GetIncidentSpectrumFromMonitor
+from total_scattering.inelastic.placzek import CalculatePlaczekSelfScattering
+from total_scattering.profiling import peak_rss
+from total_scattering.reduction import TotalScatteringReduction
+from total_scattering.utils import ROOT_DIR
+
+TEST_DATA_DIR = os.path.join(ROOT_DIR, 'tests', 'data')
+EXAMPLE_DIR = os.path.join(ROOT_DIR, 'examples')
+
+NOMAD_ALIGN_AND_FOCUS_ARGS = {
+    'CalFilename': os.path.join(EXAMPLE_DIR, 'sns', 'nomad_cal.h5'),
+    'ResampleX': -6000,
+    'DSpacing': False,
+    'PreserveEvents': False,
+    'MaxChunkSize': 8,
+    'TMin': 300.0,
+    'TMax': 16667.0,
+}
+
+POLARIS_ALIGN_AND_FOCUS_ARGS = {
+    'CalFilename': os.path.join(EXAMPLE_DIR, 'isis', 'polaris_grouping.cal'),
+    'ResampleX': -6000,
+    'DSpacing': False,
+    'PreserveEvents': False,
+    'MaxChunkSize': 8,
+}
+
+NOMAD_RUNS = ['NOM_144975.nxs', 'NOM_144976.nxs', 'NOM_144977.nxs']
+
+LAB6_GEOMETRY = {'Shape': 'Cylinder', 'Radius': 0.3, 'Height': 1.8}
+LAB6_MATERIAL = {'ChemicalFormula': 'La1 B6', 'SampleMassDensity': 4.72}
+
+# NOMAD banks for the Placzek correction, as in `placzek.py`
+NOMAD_L2 = [2.01, 1.68, 1.14, 1.11, 0.79, 2.06]
+NOMAD_POLAR = [15.10, 31.00, 65.00, 120.40, 150.10, 8.60]
+
+# Relative slowdown of the best time reported as a regression
+DEFAULT_TOLERANCE = 0.2
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name, setup=None, teardown=None):
+    """ Register a benchmark
+
+    :param name: Name of the benchmark, its key in the results
+    :type name: str
+    :param setup: Untimed function run before each repeat, its return value
+                  is passed to the benchmark
+    :type setup: callable
+    :param teardown: Untimed function run after each repeat with the value
+                     returned by `setup`
+    :type teardown: callable
+    """
+    def decorator(func):
+        BENCHMARKS[name] = (func, setup, teardown)
+        return func
+    return decorator
+
+
+def nomad_file(name):
+    return os.path.join(TEST_DATA_DIR, name)
+
+
+@benchmark('load_nomad')
+def bench_load_nomad(_):
+    load('nomad', nomad_file('NOM_144992.nxs'), **NOMAD_ALIGN_AND_FOCUS_ARGS)
+
+
+@benchmark('load_nomad_3_runs')
+def bench_load_nomad_runs(_):
+    load('nomad_runs', ','.join(nomad_file(name) for name in NOMAD_RUNS),
+         **NOMAD_ALIGN_AND_FOCUS_ARGS)
+
+
+@benchmark('load_polaris')
+def bench_load_polaris(_):
+    load('polaris', os.path.join(TEST_DATA_DIR, 'POLARIS00097947-min.nxs'),
+         **POLARIS_ALIGN_AND_FOCUS_ARGS)
+
+
+@benchmark('create_absorption_wksp')
+def bench_create_absorption_wksp(_):
+    create_absorption_wksp(
+        nomad_file('NOM_144992.nxs'), "SampleOnly",
+        geometry=LAB6_GEOMETRY,
+        material=LAB6_MATERIAL,
+        environment={'Name': 'InAir', 'Container': 'PAC06'},
+        AlignAndFocusArgs={'TMin': 300.0, 'TMax': 16667.0})
+
+
+def focused_polaris():
+    load('polaris', os.path.join(TEST_DATA_DIR, 'POLARIS00097947-min.nxs'),
+         **POLARIS_ALIGN_AND_FOCUS_ARGS)
+    return tempfile.mkdtemp(prefix='benchmark_save_banks')
+
+
+@benchmark('save_banks', setup=focused_polaris, teardown=shutil.rmtree)
+def bench_save_banks(output_dir):
+    save_banks(mtd['polaris'], 'polaris.nxs', 'polaris', output_dir)
+
+
+def incident_spectrum():
+    GetIncidentSpectrumFromMonitor(
+        nomad_file('NOM_144992.nxs'), OutputWorkspace='incident')
+
+
+@benchmark('fit_incident_spectrum', setup=incident_spectrum)
+def bench_fit_incident_spectrum(_):
+    FitIncidentSpectrum(
+        InputWorkspace='incident',
+        OutputWorkspace='incident_fit',
+        FitSpectrumWith='GaussConvCubicSpline',
+        BinningForFit='0.16,0.04,2.8',
+        BinningForCalc='0.16,0.0001,2.9')
+
+
+@benchmark('fit_incident_spectrum_lsq', setup=incident_spectrum)
+def bench_fit_incident_spectrum_lsq(_):
+    FitIncidentSpectrum(
+        InputWorkspace='incident',
+        OutputWorkspace='incident_fit',
+        FitSpectrumWith='GaussConvLSQSpline',
+        BinningForFit='0.16,0.04,2.8',
+        BinningForCalc='0.16,0.0001,2.9')
+
+
+def fitted_incident_spectrum():
+    incident_spectrum()
+    bench_fit_incident_spectrum(None)
+    SetSample(
+        InputWorkspace='incident_fit',
+        Material={'ChemicalFormula': 'Si', 'SampleMassDensity': 2.33})
+
+
+@benchmark('calculate_placzek_self_scattering',
+           setup=fitted_incident_spectrum)
+def bench_placzek(_):
+    CalculatePlaczekSelfScattering(
+        IncidentWorkspace='incident_fit',
+        OutputWorkspace='placzek',
+        L1=19.5,
+        L2=NOMAD_L2,
+        Polar=NOMAD_POLAR)
+
+
+def reduction_config():
+    """ `examples/sns/nomad_simple.json` with the bundled runs and a
+    `SampleOnly` absorption correction. The inelastic correction is left out
+    as it needs the positions of the banks. """
+    with open(os.path.join(EXAMPLE_DIR, 'sns', 'nomad_simple.json')) as f:
+        config = json.load(f)
+    config['Title'] = 'benchmark'
+    config['Sample']['Runs'] = '144992'
+    config['Sample']['Material'] = 'La1 B6'
+    config['Sample']['MassDensity'] = 4.72
+    config['Sample']['Background']['Runs'] = '144975'
+    config['Sample']['Background']['Background']['Runs'] = '144976'
+    config['Normalization']['Runs'] = '144977'
+    config['Normalization']['Background']['Runs'] = '144976'
+    for role in ['Sample', 'Normalization']:
+        config[role]['AbsorptionCorrection'] = {'Type': 'SampleOnly'}
+        config[role].pop('MultipleScatteringCorrection')
+        config[role].pop('InelasticCorrection')
+    config['Calibration']['Filename'] = NOMAD_ALIGN_AND_FOCUS_ARGS[
+        'CalFilename']
+    output_dir = tempfile.mkdtemp(prefix='benchmark_reduction')
+    config['CacheDir'] = os.path.join(output_dir, 'cache')
+    config['OutputDir'] = os.path.join(output_dir, 'output')
+    return config
+
+
+def remove_reduction_output(config):
+    shutil.rmtree(os.path.dirname(config['OutputDir']))
+
+
+@benchmark('total_scattering_reduction', setup=reduction_config,
+           teardown=remove_reduction_output)
+def bench_reduction(config):
+    TotalScatteringReduction(config)
+
+
+def run_benchmark(name, repeat):
+    """ Time a benchmark
+
+    :param name: Name of the registered benchmark
+    :type name: str
+    :param repeat: Number of timed calls
+    :type repeat: int
+
+    :return: The times of the calls and their statistics
+    :rtype: dict
+    """
+    func, setup, teardown = BENCHMARKS[name]
+    times = list()
+    try:
+        for _ in range(repeat):
+            argument = setup() if setup else None
+            try:
+                start = time.time()
+                func(argument)
+                times.append(time.time() - start)
+            finally:
+                if teardown:
+                    teardown(argument)
+                mtd.clear()
+    except Exception:
+        return {'times': times, 'error': traceback.format_exc()}
+    return {'times': times,
+            'min': min(times),
+            'median': float(np.median(times)),
+            'mean': float(np.mean(times)),
+            'peak_rss': peak_rss(),
+            'error': None}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR,
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(repeat):
+    """ What the results depend on besides the code being timed """
+    return {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'version': __version__,
+            'git_revision': git_revision(),
+            'mantid_version': mantid.__version__,
+            'python_version': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.node(),
+            'cpu_count': os.cpu_count(),
+            'repeat': repeat}
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Compare the best times of two runs of the suite
+
+    :param results: Results of this run
+    :type results: dict
+    :param baseline: Results of the reference run
+    :type baseline: dict
+    :param tolerance: Relative slowdown of the best time above which a
+                      benchmark is a regression (ie 0.2 for 20%)
+    :type tolerance: float
+
+    :return: Name -> (baseline time, time, ratio) of the benchmarks in both,
+             and the names of the regressions
+    :rtype: tuple
+    """
+    comparison = OrderedDict()
+    regressions = list()
+    for name, result in results['benchmarks'].items():
+        reference = baseline['benchmarks'].get(name)
+        if not reference or reference.get('error') or result.get('error'):
+            continue
+        ratio = result['min'] / reference['min']
+        comparison[name] = (reference['min'], result['min'], ratio)
+        if ratio > 1. + tolerance:
+            regressions.append(name)
+    return comparison, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('names', nargs='*',
+                        help='Benchmarks to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='JSON file for the results')
+    parser.add_argument('--baseline',
+                        help='JSON results of an earlier run to compare to')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Relative slowdown reported as a regression')
+    parser.add_argument('--list', action='store_true',
+                        help='List the benchmarks and exit')
+    options = parser.parse_args()
+
+    if options.list:
+        print('\n'.join(BENCHMARKS))
+        return 0
+    unknown = [name for name in options.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error("Unknown benchmarks {}".format(unknown))
+
+    # The full reduction finds the bundled runs by run number
+    ConfigService.appendDataSearchDir(TEST_DATA_DIR)
+
+    results = {'metadata': metadata(options.repeat),
+               'benchmarks': OrderedDict()}
+    failed = list()
+    print("{:<36} {:>10} {:>10}".format('benchmark', 'min (s)', 'mean (s)'))
+    for name in options.names or list(BENCHMARKS):
+        result = run_benchmark(name, options.repeat)
+        results['benchmarks'][name] = result
+        if result['error']:
+            failed.append(name)
+            print("{:<36} {:>21}".format(name, 'FAILED'))
+            print(result['error'])
+        else:
+            print("{:<36} {:>10.3f} {:>10.3f}".format(
+                name, result['min'], result['mean']))
+
+    with open(options.output, 'w') as handle:
+        json.dump(results, handle, indent=2)
+    print("Results written to {}".format(options.output))
+
+    regressions = list()
+    if options.baseline:
+        with open(options.baseline, 'r') as handle:
+            baseline = json.load(handle)
+        comparison, regressions = compare(
+            results, baseline, options.tolerance)
+        print("\n{:<36} {:>10} {:>10} {:>8}".format(
+            'compared to baseline', 'base (s)', 'min (s)', 'ratio'))
+        for name, (reference, best, ratio) in comparison.items():
+            flag = ' REGRESSION' if name in regressions else ''
+            print("{:<36} {:>10.3f} {:>10.3f} {:>8.2f}{}".format(
+                name, reference, best, ratio, flag))
+    return 1 if failed or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
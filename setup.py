@@ -9,7 +9,7 @@ THIS_DIR = os.path.dirname(__file__)
 with open("README.md", "r") as fh:
     readme = fh.read()
 
-requirements = []
+requirements = ['h5py', ]
 
 setup_requirements = ['pytest-runner', ]
 
@@ -40,6 +40,7 @@ setup(
       ]
     },
     packages=find_packages(),
+    install_requires=requirements,
     include_package_data=True,
     setup_requires=setup_requirements,
     tests_require=test_requirements,
@@ -1,8 +1,22 @@
+import functools
 import os
 import unittest
 import numpy as np
 
-from total_scattering.file_handling.load import load, create_absorption_wksp
+from collections import OrderedDict
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+from total_scattering.file_handling import load as load_module
+from total_scattering.file_handling.load import \
+    chain_jobs_sharing_files, \
+    create_absorption_wksp, \
+    load, \
+    reduction_properties_name
+from total_scattering.reduction.stage_graph import StageGraph
 from tests import EXAMPLE_DIR, TEST_DATA_DIR
 
 from mantid.simpleapi import mtd
@@ -222,6 +236,104 @@ class TestLoad(unittest.TestCase):
         assert material.packingFraction == LAB6_PACKING_FRACTION
         mtd.clear()
 
+    def test_chain_jobs_sharing_files(self):
+        jobs = OrderedDict()
+        jobs['sample'] = {'input_files': 'NOM_1,NOM_2'}
+        jobs['container'] = {'input_files': 'NOM_3'}
+        jobs['container_background'] = {'input_files': 'NOM_4'}
+        jobs['vanadium_background'] = {'input_files': ['NOM_4']}
+        chains = chain_jobs_sharing_files(jobs)
+        self.assertEqual(len(chains), 3)
+        self.assertIn(['sample'], chains)
+        self.assertIn(['container'], chains)
+        self.assertIn(['container_background', 'vanadium_background'],
+                      chains)
+
+    def test_concurrent_loads_match_serial(self):
+        nomad_files = [
+            os.path.join(TEST_DATA_DIR, 'NOM_{}.nxs'.format(run))
+            for run in [144975, 144976, 144977, 144992]]
+
+        def load_stage(ws_name, filename):
+            return {ws_name: load(ws_name, filename,
+                                  **self.nomad_align_and_focus_args)}
+
+        names = dict()
+        for suffix, max_workers in [('_serial', 1), ('_concurrent', 4)]:
+            graph = StageGraph()
+            for filename in nomad_files:
+                name = os.path.basename(filename).split('.')[0] + suffix
+                graph.add_stage(
+                    name, functools.partial(load_stage, name, filename),
+                    outputs=[name])
+            values = graph.run(max_workers=max_workers)
+            names[suffix] = [values[name] for name in graph.stages]
+
+        for serial, concurrent in zip(names['_serial'],
+                                      names['_concurrent']):
+            self.assertTrue(np.array_equal(mtd[serial].extractY(),
+                                           mtd[concurrent].extractY()))
+        mtd.clear()
+
+    def test_load_has_own_reduction_properties(self):
+        patches = [mock.patch.object(load_module, name)
+                   for name in ['AlignAndFocusPowderFromFiles',
+                                'NormaliseByCurrent', 'ConvertUnits']]
+        focus = patches[0].start()
+        for patch in patches[1:]:
+            patch.start()
+        for patch in patches:
+            self.addCleanup(patch.stop)
+
+        load('sample', 'NOM_1', Characterizations='characterizations')
+        self.assertEqual(focus.call_args[1]['ReductionProperties'],
+                         reduction_properties_name('sample'))
+        load('container', 'NOM_2', Characterizations='characterizations',
+             ReductionProperties='__powderreduction')
+        self.assertEqual(focus.call_args[1]['ReductionProperties'],
+                         '__powderreduction')
+        load('vanadium', 'NOM_3')
+        self.assertNotIn('ReductionProperties', focus.call_args[1])
+
+    def test_workers_get_the_characterizations(self):
+        patches = [mock.patch.object(load_module, name)
+                   for name in ['AlignAndFocusPowderFromFiles', 'mtd',
+                                'LoadNexusProcessed', 'SaveNexusProcessed']]
+        focus, workspaces, loaded, saved = [patch.start()
+                                            for patch in patches]
+        for patch in patches:
+            self.addCleanup(patch.stop)
+        workspaces.doesExist.side_effect = \
+            lambda name: name == 'characterizations'
+
+        args = {'Characterizations': 'characterizations',
+                'AbsorptionWorkspace': ''}
+        files = load_module.export_workspace_args('/tmp', args)
+        self.assertEqual(files, {'Characterizations': os.path.join(
+            '/tmp', 'characterizations.nxs')})
+        self.assertEqual(saved.call_args[1]['InputWorkspace'],
+                         'characterizations')
+
+        load_module.focus_run(('NOM_1', 'run', 'run.nxs', files, args))
+        self.assertEqual(loaded.call_args[1],
+                         {'Filename': files['Characterizations'],
+                          'OutputWorkspace': 'characterizations'})
+        self.assertEqual(focus.call_args[1]['Characterizations'],
+                         'characterizations')
+
+    def test_load_runs_in_parallel_matches_serial(self):
+        nomad_files = ','.join(
+            os.path.join(TEST_DATA_DIR, 'NOM_{}.nxs'.format(run))
+            for run in [144975, 144976])
+        load('serial', nomad_files, **self.nomad_align_and_focus_args)
+        load('parallel', nomad_files, run_workers=2,
+             **self.nomad_align_and_focus_args)
+        self.assertTrue(np.allclose(mtd['serial'].extractY(),
+                                    mtd['parallel'].extractY()))
+        self.assertAlmostEqual(mtd['serial'].run().getProtonCharge(),
+                               mtd['parallel'].run().getProtonCharge())
+        mtd.clear()
+
 
 if __name__ == '__main__':
     unittest.main()  # pragma: no cover
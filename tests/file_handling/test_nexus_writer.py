@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from total_scattering.file_handling.nexus_writer import \
+    ProcessedNexusFiles, ProcessedNexusWriter, nexus_writer_settings
+
+from mantid.simpleapi import mtd, \
+    AddSampleLog, CreateWorkspace, DeleteWorkspace, LoadNexusProcessed
+
+
+class TestProcessedNexusWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'diagnostics.nxs')
+        x = np.tile(np.linspace(0.5, 40., 101), 3)
+        y = np.arange(300, dtype=float)
+        CreateWorkspace(OutputWorkspace='__nexus_writer',
+                        DataX=x, DataY=y, DataE=np.sqrt(y), NSpec=3,
+                        UnitX='MomentumTransfer', YUnitLabel='Counts')
+        AddSampleLog(Workspace='__nexus_writer', LogName='run_title',
+                     LogText='sample', LogType='String')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        DeleteWorkspace('__nexus_writer')
+        if mtd.doesExist('__nexus_loaded'):
+            DeleteWorkspace('__nexus_loaded')
+
+    def test_entries_are_appended(self):
+        writer = ProcessedNexusWriter(self.filename)
+        self.assertEqual(writer.write(mtd['__nexus_writer'], 'first'),
+                         'mantid_workspace_1')
+        writer.close()
+
+        with ProcessedNexusWriter(self.filename) as writer:
+            self.assertEqual(writer.write(mtd['__nexus_writer'], 'second'),
+                             'mantid_workspace_2')
+
+        with h5py.File(self.filename, 'r') as handle:
+            self.assertEqual(handle['mantid_workspace_2/title'][()],
+                             b'second')
+            values = handle['mantid_workspace_1/workspace/values']
+            self.assertEqual(values.shape, (3, 100))
+            self.assertEqual(values.attrs['signal'], 1)
+
+    def test_loads_back(self):
+        files = ProcessedNexusFiles(compression='gzip', compression_level=4,
+                                    chunks=16)
+        files.write(self.filename, mtd['__nexus_writer'], 'compressed')
+        files.close()
+
+        with h5py.File(self.filename, 'r') as handle:
+            values = handle['mantid_workspace_1/workspace/values']
+            self.assertEqual(values.compression, 'gzip')
+            self.assertEqual(values.chunks, (1, 16))
+
+        loaded = LoadNexusProcessed(Filename=self.filename,
+                                    OutputWorkspace='__nexus_loaded')
+        original = mtd['__nexus_writer']
+        self.assertEqual(loaded.getTitle(), 'compressed')
+        self.assertEqual(loaded.getAxis(0).getUnit().unitID(),
+                         'MomentumTransfer')
+        np.testing.assert_allclose(loaded.extractX(), original.extractX())
+        np.testing.assert_allclose(loaded.extractY(), original.extractY())
+        np.testing.assert_allclose(loaded.extractE(), original.extractE())
+        self.assertEqual(loaded.getSpectrum(2).getSpectrumNo(),
+                         original.getSpectrum(2).getSpectrumNo())
+        # the logs, like the sample and instrument geometry, are left out
+        self.assertFalse(loaded.run().hasProperty('run_title'))
+
+    def test_settings(self):
+        self.assertIsNone(nexus_writer_settings(dict()))
+        config = {'DiagnosticsFile': {'Writer': 'h5py'}}
+        self.assertEqual(nexus_writer_settings(config),
+                         {'compression': None,
+                          'compression_level': None,
+                          'chunks': None})
+        with self.assertRaises(RuntimeError):
+            nexus_writer_settings({'DiagnosticsFile': {'Compression': 'gzip'}})
+        with self.assertRaises(RuntimeError):
+            nexus_writer_settings({'DiagnosticsFile': {'Writer': 'h5py',
+                                                       'Compression': 'lzf'}})
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
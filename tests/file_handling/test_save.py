@@ -1,9 +1,13 @@
 import os
+import time
 import unittest
 import numpy as np
+from unittest import mock
 
+from total_scattering.file_handling import save
 from total_scattering.file_handling.load import load
-from total_scattering.file_handling.save import save_banks, save_file
+from total_scattering.file_handling.save import \
+    BankWriter, save_banks, save_file
 from tests import EXAMPLE_DIR, TEST_DATA_DIR
 
 from mantid.simpleapi import mtd, \
@@ -70,6 +74,15 @@ class TestSave(unittest.TestCase):
                             self.wksp.blocksize())
         self.assertEqual(out_wksp.blocksize(), 100)
 
+    def test_save_banks_does_not_clone(self):
+        with mock.patch.object(save, 'CloneWorkspace') as clone:
+            save_banks(self.wksp, self.out_nxs, 'wksp', '.',
+                       Binning='0,100,10000')
+        clone.assert_not_called()
+        self.assertTrue(mtd.doesExist(self.wksp.name()))
+        self.assertEqual(len([name for name in mtd.getObjectNames()
+                              if name.startswith('__tmp_')]), 0)
+
     def test_save_file_exists(self):
         save_file(self.wksp, self.out_ascii)
         self.assertTrue(os.path.isfile(self.out_ascii))
@@ -88,5 +101,45 @@ class TestSave(unittest.TestCase):
                         )
 
 
+class TestBankWriter(unittest.TestCase):
+
+    def test_writes_in_order(self):
+        written = list()
+
+        def write_banks(wksp, **kwargs):
+            time.sleep(0.01)  # slower than the saves
+            written.append((wksp, kwargs['Title']))
+
+        titles = ['entry{}'.format(index) for index in range(10)]
+
+        def prepare_banks(ws, binning, grouping, Snapshot):
+            return '__' + ws, True
+
+        with mock.patch.object(save, 'prepare_banks',
+                               side_effect=prepare_banks), \
+                mock.patch.object(save, 'write_banks',
+                                  side_effect=write_banks):
+            writer = BankWriter(max_pending=2)
+            for title in titles:
+                writer.save_banks(title, 'out.nxs', title, '.')
+            writer.close()
+        self.assertEqual(written, [('__' + title, title) for title in titles])
+
+    def test_error_is_raised(self):
+        with mock.patch.object(save, 'prepare_banks',
+                               return_value=('__ws', True)), \
+                mock.patch.object(save, 'write_banks',
+                                  side_effect=RuntimeError('disk full')), \
+                mock.patch.object(save, 'DeleteWorkspace'):
+            writer = BankWriter()
+            writer.save_banks('ws', 'out.nxs', 'ws', '.')
+            with self.assertRaises(RuntimeError):
+                writer.flush()
+            with self.assertRaises(RuntimeError):
+                writer.save_banks('ws', 'out.nxs', 'ws', '.')
+            with self.assertRaises(RuntimeError):
+                writer.close()
+
+
 if __name__ == '__main__':
     unittest.main()  # pragma: no cover
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from total_scattering.inelastic.howells import \
+    DEFAULT_GUESS, \
+    HowellsWarmStarts, \
+    fitHowells, \
+    fitHowellsBatch, \
+    howellsDerivative, \
+    howellsFunction, \
+    howellsJacobian
+
+# Water moderator-like spectrum, peaking at 1 A
+PARAMS = np.array([1., 0.05, 1.58, 0.3, 0.1, 0.1])
+
+
+def noisy_spectra(x, spectra, seed=0):
+    rng = np.random.RandomState(seed)
+    scale = 1e5 / howellsFunction(1., *PARAMS)
+    return rng.poisson(scale * howellsFunction(x, *PARAMS),
+                       size=(spectra, len(x))) / scale
+
+
+class TestHowells(unittest.TestCase):
+
+    def setUp(self):
+        self.x = np.arange(0.16, 2.8, 0.04)
+
+    def test_jacobian(self):
+        step = 1e-7
+        expected = np.stack([
+            (howellsFunction(self.x, *(PARAMS + step * direction))
+             - howellsFunction(self.x, *(PARAMS - step * direction)))
+            / (2. * step) for direction in np.eye(6)], axis=-1)
+        np.testing.assert_allclose(howellsJacobian(self.x, *PARAMS),
+                                   expected, rtol=1e-6, atol=1e-8)
+
+    def test_derivative(self):
+        step = 1e-7
+        expected = (howellsFunction(self.x + step, *PARAMS)
+                    - howellsFunction(self.x - step, *PARAMS)) / (2. * step)
+        np.testing.assert_allclose(howellsDerivative(self.x, *PARAMS),
+                                   expected, rtol=1e-6, atol=1e-8)
+
+    def test_fit(self):
+        y = howellsFunction(self.x, *PARAMS)
+        np.testing.assert_allclose(fitHowells(self.x, y), PARAMS, rtol=1e-6)
+        np.testing.assert_allclose(fitHowells(self.x, y, p0=PARAMS * 1.1),
+                                   PARAMS, rtol=1e-6)
+
+    def test_batch(self):
+        y_fits = noisy_spectra(self.x, 20)
+        params, converged = fitHowellsBatch(self.x, y_fits)
+        self.assertTrue(np.all(converged))
+        for row, y in zip(params, y_fits):
+            cost = np.sum((howellsFunction(self.x, *row) - y) ** 2)
+            expected = fitHowells(self.x, y)
+            expected_cost = np.sum(
+                (howellsFunction(self.x, *expected) - y) ** 2)
+            self.assertLessEqual(cost, expected_cost * (1. + 1e-6))
+
+        # Started from the parameters of each spectrum, nothing moves
+        warm, converged = fitHowellsBatch(self.x, y_fits, p0=params)
+        self.assertTrue(np.all(converged))
+        np.testing.assert_allclose(warm, params, rtol=1e-4)
+
+    def test_batch_failures(self):
+        y_fits = noisy_spectra(self.x, 3)
+        y_fits[1, 5] = np.nan
+        params, converged = fitHowellsBatch(self.x, y_fits, maxfev=5)
+        self.assertFalse(np.any(converged))
+        np.testing.assert_allclose(params[1], DEFAULT_GUESS)
+
+        params, converged = fitHowellsBatch(self.x, y_fits)
+        self.assertEqual(converged.tolist(), [True, False, True])
+
+    def test_warm_starts(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp_dir, 'cache', 'howells.json')
+            warm_starts = HowellsWarmStarts(filename)
+            self.assertIsNone(warm_starts.get('NOM'))
+            warm_starts.update('NOM', None, PARAMS)
+            warm_starts.update('NOM', 'poisoned', PARAMS * 2.)
+            warm_starts.update('NOM', 'failed', PARAMS * np.nan)
+
+            warm_starts = HowellsWarmStarts(filename)
+            self.assertEqual(warm_starts.get('NOM'), PARAMS.tolist())
+            self.assertEqual(warm_starts.get('NOM', 'poisoned'),
+                             (PARAMS * 2.).tolist())
+            self.assertIsNone(warm_starts.get('NOM', 'failed'))
+            self.assertIsNone(warm_starts.get('PG3'))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
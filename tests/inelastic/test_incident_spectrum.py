@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+from scipy import interpolate, ndimage
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+from total_scattering.inelastic import incident_spectrum
+from total_scattering.inelastic.incident_spectrum import \
+    GetIncidentSpectrumFromMonitor, \
+    NEUTRON_WAVELENGTH_TOF, \
+    evaluateCubicSpline, \
+    fitLSQSplineWithGaussConv, \
+    gaussianSmooth, \
+    getWavelengthEdges, \
+    readMonitorSpectrum
+
+L1 = 19.5
+MONITOR_DISTANCE = -0.9
+
+
+class TestIncidentSpectrum(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'NOM_1.nxs.h5')
+        rng = np.random.RandomState(0)
+        self.tof = rng.uniform(500., 16000., 100000).astype(np.float32)
+        self.tof_edges = np.linspace(0., 20000., 2001)
+        self.counts = rng.poisson(10., 2000).astype(np.float64)
+        with h5py.File(self.filename, 'w') as handle:
+            entry = handle.create_group('entry')
+            entry.attrs['NX_class'] = 'NXentry'
+            entry['instrument/moderator/distance'] = -L1
+
+            events = entry.create_group('monitor1')
+            events.attrs['NX_class'] = 'NXmonitor'
+            events['distance'] = MONITOR_DISTANCE
+            events['event_time_offset'] = self.tof
+            events['event_time_offset'].attrs['units'] = 'microsecond'
+
+            histogram = entry.create_group('monitor2')
+            histogram.attrs['NX_class'] = 'NXmonitor'
+            histogram['distance'] = MONITOR_DISTANCE
+            histogram['data'] = self.counts.reshape(1, -1)
+            histogram['time_of_flight'] = self.tof_edges
+            histogram['time_of_flight'].attrs['units'] = 'microsecond'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def wavelength(self, tof):
+        return NEUTRON_WAVELENGTH_TOF * np.asarray(tof, dtype=np.float64) \
+            / (L1 + MONITOR_DISTANCE)
+
+    def test_wavelength_edges(self):
+        edges = getWavelengthEdges("0.1,4,0.5")
+        np.testing.assert_allclose(edges, [0.1, 0.2, 0.3, 0.4, 0.5])
+        edges = getWavelengthEdges("0.1,-2,0.4")
+        np.testing.assert_allclose(edges, [0.1, 0.2, 0.4])
+
+        edges = getWavelengthEdges("0.1,0.1,0.52", BinType='Rebin')
+        np.testing.assert_allclose(edges, [0.1, 0.2, 0.3, 0.4, 0.52])
+        edges = getWavelengthEdges("0.1,0.1,0.45", BinType='Rebin')
+        np.testing.assert_allclose(edges, [0.1, 0.2, 0.3, 0.4, 0.45])
+        edges = getWavelengthEdges("0.1,-1,0.42", BinType='Rebin')
+        np.testing.assert_allclose(edges, [0.1, 0.2, 0.42])
+
+        with self.assertRaises(RuntimeError):
+            getWavelengthEdges("0.1,0.1,0.5", BinType='Unknown')
+
+    def test_events(self):
+        for binning in ["0.1,6000,2.9", "0.1,-500,2.9"]:
+            edges = getWavelengthEdges(binning)
+            counts = readMonitorSpectrum(self.filename, edges)
+            expected, _ = np.histogram(self.wavelength(self.tof), edges)
+            np.testing.assert_array_equal(counts, expected)
+
+    def test_histogram(self):
+        edges = getWavelengthEdges("0.1,0.01,2.9", BinType='Rebin')
+        counts = readMonitorSpectrum(self.filename, edges, MonitorIndex=1)
+        inside = (self.tof_edges[:-1] >= edges[0] * (L1 + MONITOR_DISTANCE)
+                  / NEUTRON_WAVELENGTH_TOF) \
+            & (self.tof_edges[1:] <= edges[-1] * (L1 + MONITOR_DISTANCE)
+               / NEUTRON_WAVELENGTH_TOF)
+        self.assertGreaterEqual(counts.sum(), self.counts[inside].sum())
+
+        # Bins made of whole monitor bins keep their counts
+        lam_edges = self.wavelength(self.tof_edges[100:201:10])
+        counts = readMonitorSpectrum(self.filename, lam_edges,
+                                     MonitorIndex=1, L1=L1)
+        np.testing.assert_allclose(
+            counts, self.counts[100:200].reshape(10, 10).sum(axis=1))
+
+    @mock.patch.object(incident_spectrum, 'mtd')
+    @mock.patch.object(incident_spectrum, 'LoadNexusMonitors')
+    @mock.patch.object(incident_spectrum, 'CreateWorkspace')
+    def test_read_directly(self, create, load, mtd):
+        GetIncidentSpectrumFromMonitor(self.filename, OutputWorkspace='inc')
+        self.assertFalse(load.called)
+        self.assertEqual(create.call_count, 1)
+        kwargs = create.call_args[1]
+        self.assertEqual(len(kwargs['DataX']), 6000)
+        self.assertTrue(np.all(kwargs['DataY'] >= 0.))
+
+    @mock.patch.object(incident_spectrum, 'mtd')
+    @mock.patch.object(incident_spectrum, '_loadMonitorSpectrum')
+    @mock.patch.object(incident_spectrum, 'CreateWorkspace')
+    def test_fall_back_to_mantid(self, create, load, mtd):
+        load.return_value = (np.ones(3), np.ones(3))
+        with h5py.File(self.filename, 'a') as handle:
+            del handle['entry/monitor1/distance']
+        GetIncidentSpectrumFromMonitor(self.filename, OutputWorkspace='inc')
+        self.assertTrue(load.called)
+        self.assertEqual(create.call_count, 1)
+
+    def test_gaussian_smooth(self):
+        y = np.random.RandomState(1).poisson(100., 200).astype(np.float64)
+        for sigma in [1., 2., 5.]:
+            np.testing.assert_allclose(
+                gaussianSmooth(y, sigma),
+                ndimage.gaussian_filter1d(y, sigma, truncate=10.),
+                rtol=1e-5)
+
+    def test_evaluate_cubic_spline(self):
+        x_fit = np.linspace(0., 1., 50)
+        t = np.concatenate([[0.] * 4, [0.2, 0.5, 0.7], [1.] * 4])
+        spline = interpolate.make_lsq_spline(x_fit, np.exp(x_fit), t)
+        x = np.linspace(-0.1, 1.1, 1000)
+        fit, fit_prime = evaluateCubicSpline(spline, x)
+        np.testing.assert_allclose(fit, spline(x))
+        np.testing.assert_allclose(fit_prime, spline(x, 1))
+
+    def test_lsq_spline_fit(self):
+        x_fit = np.arange(0.15, 3.2, 0.01)
+        expected = 1e6 * x_fit ** -5 * np.exp(-(1.5 / x_fit) ** 2)
+        y_fit = np.random.RandomState(2).poisson(expected) * 1.
+        x = np.arange(0.6, 3., 0.0001)
+        fit, fit_prime = fitLSQSplineWithGaussConv(x_fit, y_fit, x)
+        truth = 1e6 * x ** -5 * np.exp(-(1.5 / x) ** 2)
+        self.assertLess(np.sqrt(np.mean((fit / truth - 1.) ** 2)), 0.01)
+        np.testing.assert_allclose(fit_prime, np.gradient(fit, x),
+                                   rtol=1e-3, atol=1e-3 * np.abs(fit).max())
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,183 @@
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+import numpy as np
+
+from total_scattering.inelastic import placzek
+from total_scattering.inelastic.howells import \
+    howellsDerivative, \
+    howellsFunction
+from total_scattering.inelastic.placzek import \
+    CalculateElasticSelfScattering, \
+    CalculatePlaczekSelfScattering, \
+    ClearMaterialProperties, \
+    GetDetectorGeometry, \
+    GetMaterialProperties, \
+    GetSampleSpeciesInfo, \
+    PlaczekSelfCorrection, \
+    PlaczekSelfCorrectionChunks
+
+
+class TestPlaczekSelfCorrection(unittest.TestCase):
+
+    def test_matches_per_bank_formula(self):
+        x_lambda = np.linspace(0.1, 3., 500)
+        phi_1 = -2. + 0.3 * x_lambda
+        eps_1 = -0.5 * np.exp(-x_lambda)
+        L1 = 19.5
+        L2 = [2.01, 1.68, 1.14, 1.11, 0.79, 2.06]
+        Polar = [15.10, 31.00, 65.00, 120.40, 150.10, 8.60]
+        correction = PlaczekSelfCorrection(phi_1, eps_1, 0.02, L1, L2, Polar)
+        self.assertEqual(correction.shape, (6, 500))
+        for bank, (l2, theta) in enumerate(zip(L2, Polar)):
+            f = L1 / (L1 + l2)
+            sin_theta_by_2 = np.sin(theta * np.pi / 180. / 2.)
+            expected = 2. * ((f - 1.) * phi_1 - f * eps_1 + f - 3.) \
+                * sin_theta_by_2 * sin_theta_by_2 * 0.02
+            np.testing.assert_allclose(correction[bank], expected)
+
+    def test_chunks(self):
+        rng = np.random.RandomState(0)
+        phi_1 = rng.normal(size=300)
+        eps_1 = rng.normal(size=300)
+        L2 = rng.uniform(0.7, 2.1, 1001)
+        Polar = rng.uniform(5., 155., 1001)
+        expected = PlaczekSelfCorrection(phi_1, eps_1, 0.02, 19.5, L2, Polar)
+        starts = list()
+        for start, chunk in PlaczekSelfCorrectionChunks(
+                phi_1, eps_1, 0.02, 19.5, L2, Polar, ChunkSize=100):
+            self.assertLessEqual(len(chunk), 100)
+            np.testing.assert_allclose(chunk,
+                                       expected[start:start + len(chunk)])
+            starts.append(start)
+        self.assertEqual(starts, list(range(0, 1001, 100)))
+
+    def test_detector_geometry(self):
+        table = mock.Mock()
+        table.column.side_effect = {
+            'R': [2.0, 0.0, 1.5, 1.1],
+            'Theta': [90.0, 0.0, 30.0, 150.0],
+            'Monitor': ['no', 'n/a', 'yes', 'no']}.get
+        wksp = mock.Mock()
+        wksp.spectrumInfo().l1.return_value = 19.5
+        with mock.patch.object(placzek, 'mtd', {'ws': wksp}), \
+                mock.patch.object(placzek, 'CreateDetectorTable',
+                                  return_value=table):
+            geometry = GetDetectorGeometry('ws')
+        self.assertEqual(geometry['L1'], 19.5)
+        np.testing.assert_allclose(geometry['L2'], [2.0, 0.0, 0.0, 1.1])
+        np.testing.assert_allclose(geometry['Polar'], [90., 0., 0., 150.])
+
+
+class TestPlaczekWithHowellsFit(unittest.TestCase):
+
+    def setUp(self):
+        ClearMaterialProperties()
+        self.addCleanup(ClearMaterialProperties)
+
+    def test_known_good_correction(self):
+        """ Placzek correction of vanadium, from a Howells function fit of a
+        water moderator, against values from the finite difference
+        derivative of the fit """
+        x = np.array([0.2, 0.5, 1.0, 1.5, 2.5])
+        params = [1., 0.05, 1.58, 0.3, 0.1, 0.1]
+        incident = mock.Mock()
+        incident.readX.return_value = x
+        incident.readY.side_effect = [howellsFunction(x, *params),
+                                      howellsDerivative(x, *params)]
+        material = incident.sample().getMaterial()
+        material.name.return_value = 'V'
+        material.numberDensity = 0.0721
+        material.totalScatterXSection.return_value = 5.1
+        material.chemicalFormula.return_value = (
+            [mock.Mock(symbol='V', mass=50.9415)], [1.])
+        workspaces = {'incident': incident}
+
+        def create_workspace(**kwargs):
+            workspaces[kwargs['OutputWorkspace']] = mock.Mock()
+        with mock.patch.object(placzek, 'mtd', workspaces), \
+                mock.patch.object(placzek, 'CreateWorkspace',
+                                  side_effect=create_workspace) as create:
+            CalculatePlaczekSelfScattering(
+                'incident', 'placzek', L1=19.5, L2=[2.01, 0.79],
+                Polar=[31., 150.1])
+        correction = create.call_args[1]['DataY'].reshape(2, len(x))
+        np.testing.assert_allclose(correction, [
+            [-1.24649267e-03, -1.81745717e-03, -1.68123670e-03,
+             -1.51354384e-03, -1.56584786e-03],
+            [-1.61334246e-02, -2.00808375e-02, -2.05971421e-02,
+             -2.07747362e-02, -2.27805512e-02]], rtol=1e-6)
+
+
+class TestMaterialProperties(unittest.TestCase):
+
+    def setUp(self):
+        ClearMaterialProperties()
+        self.addCleanup(ClearMaterialProperties)
+        self.workspaces = dict()
+        patch = mock.patch.object(placzek, 'mtd', self.workspaces)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def set_material(self, workspace, name, atoms, stoich, density,
+                     xsection=4. * np.pi):
+        """ Workspace with a mocked sample material, counting its lookups """
+        material = mock.Mock()
+        material.name.return_value = name
+        material.numberDensity = density
+        material.totalScatterXSection.return_value = xsection
+        material.cohScatterXSection.return_value = xsection / 2.
+        material.incohScatterXSection.return_value = xsection / 2.
+        material.chemicalFormula.return_value = (
+            [mock.Mock(symbol=symbol, mass=mass) for symbol, mass in atoms],
+            stoich)
+        self.workspaces[workspace] = mock.Mock()
+        self.workspaces[workspace].sample().getMaterial.return_value = \
+            material
+        return material
+
+    def test_species(self):
+        self.set_material('sample', 'Si O2', [('Si', 28.), ('O', 16.)],
+                          [1., 2.], 0.07)
+        properties = GetMaterialProperties('sample')
+        self.assertEqual(properties.symbols, ['Si', 'O'])
+        np.testing.assert_allclose(properties.concentrations,
+                                   [1. / 3., 2. / 3.])
+        np.testing.assert_allclose(properties.masses, [28., 16.])
+        np.testing.assert_allclose(properties.b_sqrd_bar, [1., 1.])
+        self.assertAlmostEqual(properties.placzek_summation_term(1.),
+                               (1. / 28. + 2. / 16.) / 3.)
+        self.assertAlmostEqual(CalculateElasticSelfScattering('sample'), 1.)
+
+        species = GetSampleSpeciesInfo('sample')
+        self.assertEqual(list(species), ['Si', 'O'])
+        self.assertAlmostEqual(species['O']['concentration'], 2. / 3.)
+        self.assertEqual(species['O']['stoich'], 2.)
+
+    def test_shared_by_formula_and_density(self):
+        sample = self.set_material('sample', 'V', [('V', 50.94)], [1.], 0.072)
+        vanadium = self.set_material('vanadium', 'V', [('V', 50.94)], [1.],
+                                     0.072)
+        denser = self.set_material('denser', 'V', [('V', 50.94)], [1.], 0.08)
+        properties = GetMaterialProperties('sample')
+        self.assertIs(GetMaterialProperties('sample'), properties)
+        self.assertIs(GetMaterialProperties('vanadium'), properties)
+        self.assertIsNot(GetMaterialProperties('denser'), properties)
+        self.assertEqual(sample.chemicalFormula.call_count, 1)
+        self.assertFalse(vanadium.chemicalFormula.called)
+        self.assertEqual(denser.chemicalFormula.call_count, 1)
+
+        # Same formula with other scattering lengths, ie set in SetSample
+        self.set_material('custom', 'V', [('V', 50.94)], [1.], 0.072,
+                          xsection=2. * np.pi)
+        custom = GetMaterialProperties('custom')
+        self.assertIsNot(custom, properties)
+        np.testing.assert_allclose(custom.b_sqrd_bar, [0.5])
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
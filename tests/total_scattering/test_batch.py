@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+from total_scattering.reduction import batch
+from total_scattering.reduction.batch import \
+    read_batch_configs, \
+    shared_graph, \
+    with_stage_cache, \
+    with_worker_budget
+from tests import EXAMPLE_DIR
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir)
+
+    def write(self, filename, text):
+        filename = os.path.join(self.input_dir, filename)
+        with open(filename, 'w') as handle:
+            handle.write(text)
+        return filename
+
+    def test_read_batch_configs(self):
+        single = self.write('single.json', json.dumps({'Title': 'a'}))
+        many = self.write('many.json', json.dumps(
+            [{'Title': 'b'}, {'Title': 'c'}]))
+        lines = self.write('lines.jsonl', '{"Title": "d"}\n\n{"Title": "e"}\n')
+        configs = read_batch_configs([single, many, lines])
+        self.assertEqual([config['Title'] for config in configs],
+                         ['a', 'b', 'c', 'd', 'e'])
+
+    def test_with_stage_cache(self):
+        with open(os.path.join(EXAMPLE_DIR, 'sns', 'nomad_simple.json')) as f:
+            config = json.load(f)
+        stages = with_stage_cache(config)['StageCache']['Stages']
+        self.assertNotIn('StageCache', config)
+        self.assertIn('prepare_vanadium', stages)
+        self.assertNotIn('load_sample', stages)
+        self.assertNotIn('output_spectrum', stages)
+
+        config['StageCache'] = {'MaxSizeGB': 5}
+        self.assertEqual(with_stage_cache(config)['StageCache'],
+                         {'MaxSizeGB': 5})
+
+    def test_shared_graph_does_not_save(self):
+        with open(os.path.join(EXAMPLE_DIR, 'sns', 'nomad_simple.json')) as f:
+            config = json.load(f)
+        for level in ['key', 'full']:
+            config['DiagnosticsLevel'] = level
+            _, graph, _ = shared_graph(config)
+            self.assertIn('prepare_vanadium', graph.stages)
+            self.assertEqual([name for name in graph.stages
+                              if name.startswith('save_')], [])
+
+    def test_with_worker_budget(self):
+        config = {'Title': 'a', 'MaxWorkers': 4, 'RunWorkers': 8}
+        with mock.patch.object(batch.multiprocessing, 'cpu_count',
+                               return_value=16):
+            budget = with_worker_budget(config, 8)
+            self.assertEqual((budget['MaxWorkers'], budget['RunWorkers']),
+                             (2, 1))
+            budget = with_worker_budget(config, 2)
+            self.assertEqual((budget['MaxWorkers'], budget['RunWorkers']),
+                             (4, 2))
+            budget = with_worker_budget({'Title': 'a'}, 32)
+            self.assertEqual((budget['MaxWorkers'], budget['RunWorkers']),
+                             (1, 1))
+        self.assertEqual(config['MaxWorkers'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+
+from total_scattering.reduction import fourier_transform
+from total_scattering.reduction.fourier_transform import \
+    fourier_transform_settings, \
+    lorch_window, \
+    r_grid, \
+    sofq_to_gofr
+
+
+def loop_sofq_to_gofr(q, sq, r, qmin, qmax, lorch):
+    """ One spectrum and one r at a time, as a reference """
+    centers = 0.5 * (q[:-1] + q[1:])
+    widths = np.diff(q)
+    gr = np.zeros((len(sq), len(r)))
+    for spectrum in range(len(sq)):
+        for index, value in enumerate(r):
+            total = 0.
+            for qi, dq, si in zip(centers, widths, sq[spectrum]):
+                if qmin[spectrum] <= qi <= qmax[spectrum]:
+                    window = 1.
+                    if lorch:
+                        x = np.pi * qi / qmax[spectrum]
+                        window = np.sin(x) / x
+                    total += qi * (si - 1.) * np.sin(qi * value) * dq * window
+            gr[spectrum, index] = 2. / np.pi * total
+    return gr
+
+
+class TestFourierTransform(unittest.TestCase):
+
+    def test_gaussian(self):
+        # S(Q) - 1 = exp(-Q^2) transforms analytically
+        q = np.linspace(0., 20., 20001)
+        sq = 1. + np.exp(-q ** 2)
+        r = r_grid(5., 0.05)
+        gr, _ = sofq_to_gofr(q, sq, r)
+        expected = 2. / np.pi * np.sqrt(np.pi) * r / 4. * np.exp(-r ** 2 / 4.)
+        np.testing.assert_allclose(gr[0], expected, atol=1e-6)
+
+    def test_matches_loop(self):
+        rng = np.random.RandomState(42)
+        q = np.linspace(0.1, 10., 51)
+        sq = 1. + rng.normal(scale=0.1, size=(3, 50))
+        r = r_grid(3., 0.5)
+        qmin = [0.5, 1., 2.]
+        qmax = [9., 8., 7.5]
+        for lorch in [False, True]:
+            gr, _ = sofq_to_gofr(q, sq, r, qmin=qmin, qmax=qmax, lorch=lorch)
+            expected = loop_sofq_to_gofr(q, sq, r, qmin, qmax, lorch)
+            np.testing.assert_allclose(gr, expected, atol=1e-12)
+
+    def test_blocks(self):
+        q = np.linspace(0.1, 10., 101)
+        sq = 1. + np.sin(q[1:])[np.newaxis, :] * np.ones((2, 1))
+        r = r_grid(10., 0.01)
+        gr, errors = sofq_to_gofr(q, sq, r, errors=0.1 * np.ones((2, 100)))
+        block_size = fourier_transform.BLOCK_SIZE
+        fourier_transform.BLOCK_SIZE = 1000
+        try:
+            gr_blocks, errors_blocks = sofq_to_gofr(
+                q, sq, r, errors=0.1 * np.ones((2, 100)))
+        finally:
+            fourier_transform.BLOCK_SIZE = block_size
+        np.testing.assert_allclose(gr_blocks, gr)
+        np.testing.assert_allclose(errors_blocks, errors)
+
+    def test_invalid_values_left_out(self):
+        q = np.linspace(0.1, 10., 100)
+        sq = np.ones((2, 100))
+        sq[0, 10] = np.nan
+        sq[1, 20] = np.inf
+        gr, errors = sofq_to_gofr(q, sq, r_grid(2., 0.1),
+                                  errors=np.ones((2, 100)))
+        np.testing.assert_array_equal(gr, 0.)
+        self.assertTrue(np.all(np.isfinite(errors)))
+
+    def test_lorch_window(self):
+        window = lorch_window(np.array([0., 5., 10.]), 10.)
+        np.testing.assert_allclose(window, [1., 2. / np.pi, 0.], atol=1e-15)
+
+    def test_r_grid(self):
+        r = r_grid(1., 0.1)
+        self.assertEqual(len(r), 10)
+        self.assertAlmostEqual(r[0], 0.1)
+        self.assertAlmostEqual(r[-1], 1.)
+
+    def test_settings(self):
+        self.assertIsNone(fourier_transform_settings(dict()))
+        settings = fourier_transform_settings(
+            {'FourierTransform': {'Qmax': 30., 'Lorch': True}})
+        self.assertEqual(settings, {'qmin': None, 'qmax': 30., 'rmax': 50.,
+                                    'dr': 0.01, 'lorch': True})
+        with self.assertRaises(RuntimeError):
+            fourier_transform_settings({'FourierTransform': {'DeltaR': 0.}})
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+from total_scattering.reduction import incident_cache
+from total_scattering.reduction.incident_cache import \
+    IncidentSpectrumCache, \
+    fitted_incident_spectrum, \
+    incident_cache_settings, \
+    warm_starts_file
+
+
+class TestIncidentSpectrumCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = IncidentSpectrumCache(self.cache_dir)
+        self.runs = list()
+        for index in range(3):
+            filename = os.path.join(self.cache_dir, 'run{}.nxs'.format(index))
+            with open(filename, 'w') as handle:
+                handle.write(str(index))
+            self.runs.append(filename)
+
+        # Loading and fitting need real monitors, only check what is done
+        patches = [mock.patch.object(incident_cache, name)
+                   for name in ['GetIncidentSpectrumFromMonitor',
+                                'FitIncidentSpectrum', 'Plus',
+                                'DeleteWorkspace']]
+        self.get_incident = patches[0].start()
+        self.fit_incident = patches[1].start()
+        for patch in patches[2:]:
+            patch.start()
+        for patch in patches:
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def fit(self, runs, **fit_args):
+        self.get_incident.reset_mock()
+        self.fit_incident.reset_mock()
+        fitted_incident_spectrum('incident', ','.join(runs),
+                                 cache=self.cache, **fit_args)
+
+    def test_incident_cache_settings(self):
+        self.assertIsNone(incident_cache_settings({}))
+        self.assertEqual(
+            incident_cache_settings({'IncidentSpectrumCache': {'MaxSizeGB': 1},
+                                     'CacheDir': '/tmp'}),
+            {'cache_dir': '/tmp', 'max_size_gb': 1})
+
+    def test_warm_starts_file(self):
+        self.assertIsNone(warm_starts_file({}))
+        self.assertEqual(
+            warm_starts_file({'HowellsWarmStarts': True, 'CacheDir': '/tmp'}),
+            os.path.join('/tmp', 'howells.json'))
+        self.assertEqual(
+            warm_starts_file({'HowellsWarmStarts': '/data/howells.json'}),
+            '/data/howells.json')
+
+    def test_runs_are_summed_and_fitted_once(self):
+        self.fit(self.runs)
+        loaded = [call[1]['Filename']
+                  for call in self.get_incident.call_args_list]
+        self.assertEqual(loaded, self.runs)
+        self.assertEqual(self.fit_incident.call_count, 1)
+
+    def test_fit_is_reused(self):
+        self.fit(self.runs)
+        self.fit(self.runs)
+        self.assertFalse(self.get_incident.called)
+        self.assertFalse(self.fit_incident.called)
+
+        # A new cache on the same directory, as in a later reduction
+        self.cache = IncidentSpectrumCache(self.cache_dir)
+        self.fit(self.runs)
+        self.assertFalse(self.fit_incident.called)
+
+    def test_fit_is_redone(self):
+        self.fit(self.runs)
+        self.fit(self.runs[:2])
+        self.assertEqual(self.fit_incident.call_count, 1)
+        self.fit(self.runs, FitSpectrumWith='HowellsFunction')
+        self.assertEqual(self.fit_incident.call_count, 1)
+        self.fit(self.runs, BinningForCalc='0.1,0.01,3.0')
+        self.assertEqual(self.fit_incident.call_count, 1)
+
+        with open(self.runs[0], 'w') as handle:
+            handle.write('changed')
+        self.fit(self.runs)
+        self.assertEqual(self.fit_incident.call_count, 1)
+
+    def test_without_cache(self):
+        for _ in range(2):
+            self.fit_incident.reset_mock()
+            fitted_incident_spectrum('incident', self.runs[:1])
+            self.assertEqual(self.fit_incident.call_count, 1)
+
+    def test_warm_starts_only_without_cache(self):
+        warm_starts = mock.Mock()
+        self.fit(self.runs, FitSpectrumWith='HowellsFunction',
+                 warm_starts=warm_starts)
+        self.assertIsNone(self.fit_incident.call_args[1]['WarmStarts'])
+
+        self.fit_incident.reset_mock()
+        fitted_incident_spectrum('incident', self.runs,
+                                 FitSpectrumWith='HowellsFunction',
+                                 warm_starts=warm_starts)
+        self.assertIs(self.fit_incident.call_args[1]['WarmStarts'],
+                      warm_starts)
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,126 @@
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+import numpy as np
+
+from total_scattering.reduction.merging import \
+    merge_spectra, \
+    sum_bank_indices
+
+
+class TestMerging(unittest.TestCase):
+
+    def test_inverse_variance_weights(self):
+        x = np.arange(5.)
+        y = np.array([[1., 1., 1., 1.],
+                      [3., 3., 3., 3.]])
+        e = np.array([[1., 1., 1., 1.],
+                      [1., 1., 2., 2.]])
+        merged_y, merged_e = merge_spectra(x, y, e)
+        np.testing.assert_allclose(merged_y, [2., 2., 1.4, 1.4])
+        np.testing.assert_allclose(merged_e, [np.sqrt(0.5), np.sqrt(0.5),
+                                              np.sqrt(0.8), np.sqrt(0.8)])
+
+    def test_crop_to_q_ranges(self):
+        x = np.arange(5.)
+        y = np.array([[1., 1., 1., 1.],
+                      [3., 3., 3., 3.]])
+        e = np.ones((2, 4))
+        merged_y, _ = merge_spectra(x, y, e, qmin=[0., 1.], qmax=[2., 4.])
+        np.testing.assert_allclose(merged_y, [1., 2., 3., 3.])
+
+        # bins partially inside of the range are left out
+        merged_y, _ = merge_spectra(x, y, e, qmin=[0.5, 0.], qmax=[4., 2.5])
+        np.testing.assert_allclose(merged_y, [3., 2., 1., 1.])
+
+        # a single limit applies to every spectrum
+        merged_y, _ = merge_spectra(x, y, e, qmin=[1.], qmax=3.)
+        np.testing.assert_allclose(merged_y[1:3], [2., 2.])
+        self.assertTrue(np.all(np.isnan(merged_y[[0, 3]])))
+
+    def test_mismatched_q_ranges_are_ignored(self):
+        x = np.arange(5.)
+        y = np.array([[1., 1., 1., 1.],
+                      [3., 3., 3., 3.]])
+        e = np.ones((2, 4))
+        log = mock.Mock()
+        for qmin in [[], [0., 1., 2.]]:
+            log.reset_mock()
+            merged_y, _ = merge_spectra(x, y, e, qmin=qmin, qmax=[2., 4.],
+                                        log=log)
+            np.testing.assert_allclose(merged_y, [2., 2., 3., 3.])
+            self.assertTrue(log.warning.called)
+
+    def test_points(self):
+        x = np.arange(4.)
+        y = np.array([[1., 1., 1., 1.],
+                      [3., 3., 3., 3.]])
+        merged_y, _ = merge_spectra(x, y, np.ones((2, 4)), qmin=[0., 2.],
+                                    qmax=[1., 3.])
+        np.testing.assert_allclose(merged_y, [1., 1., 3., 3.])
+
+    def test_selected_banks(self):
+        y = np.array([[1., 1.], [2., 2.], [3., 3.]])
+        merged_y, _ = merge_spectra(np.arange(3.), y, np.ones((3, 2)),
+                                    indices=[0, 2])
+        np.testing.assert_allclose(merged_y, [2., 2.])
+
+    def test_invalid_bins(self):
+        y = np.array([[1., np.nan, 1., np.nan], [3., 3., 3., 3.]])
+        e = np.array([[1., 1., 1., 1.], [1., 1., np.inf, np.nan]])
+        merged_y, merged_e = merge_spectra(np.arange(5.), y, e)
+        np.testing.assert_allclose(merged_y[:3], [2., 3., 1.])
+        self.assertTrue(np.isnan(merged_y[3]))
+        self.assertTrue(np.isnan(merged_e[3]))
+
+    def test_zero_error_bins(self):
+        # zero errors get the smallest variance of their spectrum
+        y = np.array([[0., 2., 2.], [4., 4., 4.]])
+        e = np.array([[0., 1., 2.], [1., 1., 1.]])
+        merged_y, merged_e = merge_spectra(np.arange(4.), y, e)
+        np.testing.assert_allclose(merged_y, [2., 3., 3.6])
+        np.testing.assert_allclose(merged_e[0], np.sqrt(0.5))
+
+        # spectra without any error are left out
+        e[0] = 0.
+        merged_y, _ = merge_spectra(np.arange(4.), y, e)
+        np.testing.assert_allclose(merged_y, [4., 4., 4.])
+
+    def test_many_banks(self):
+        rng = np.random.RandomState(0)
+        y = rng.normal(loc=1., size=(500, 1000))
+        e = rng.uniform(0.5, 1.5, size=(500, 1000))
+        qmin = rng.uniform(0., 10., size=500)
+        qmax = qmin + 20.
+        x = np.linspace(0., 40., 1001)
+        merged_y, merged_e = merge_spectra(x, y, e, qmin=qmin, qmax=qmax)
+
+        # Reference: one bank at a time
+        numerator = np.zeros(1000)
+        total = np.zeros(1000)
+        for bank in range(500):
+            inside = (x[:-1] >= qmin[bank]) & (x[1:] <= qmax[bank])
+            weights = np.where(inside, 1. / e[bank] ** 2, 0.)
+            numerator += weights * y[bank]
+            total += weights
+        covered = total > 0.
+        np.testing.assert_allclose(merged_y[covered],
+                                   numerator[covered] / total[covered])
+        np.testing.assert_allclose(merged_e[covered],
+                                   1. / np.sqrt(total[covered]))
+        self.assertTrue(np.all(np.isnan(merged_y[~covered])))
+
+    def test_sum_bank_indices(self):
+        self.assertEqual(sum_bank_indices(None, 3), [0, 1, 2])
+        self.assertEqual(sum_bank_indices([2, 0, 2], 3), [0, 2])
+        self.assertEqual(sum_bank_indices('1-3, 5', 6), [1, 2, 3, 5])
+        self.assertEqual(sum_bank_indices([1, 7], 3), [1])
+        self.assertEqual(sum_bank_indices([7], 3), [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from total_scattering import profiling
+from total_scattering.profiling import \
+    profile, \
+    profiled, \
+    start_profiling, \
+    stop_profiling
+
+
+@profiled('save', name_arg='Title')
+def save(Title):
+    return Title
+
+
+class TestProfiling(unittest.TestCase):
+
+    def tearDown(self):
+        stop_profiling()
+
+    def test_off_by_default(self):
+        self.assertIsNone(profiling._profiler)
+        self.assertEqual(save(Title='a'), 'a')
+        with profile('stage', 'b'):
+            pass
+
+    def test_records(self):
+        profiler = start_profiling('test')
+        save(Title='a')
+        with profile('stage', 'b'):
+            sum(range(1000))
+        with self.assertRaises(ValueError):
+            with profile('stage', 'c'):
+                raise ValueError("failed")
+        self.assertIs(stop_profiling(), profiler)
+        save(Title='ignored')
+
+        records = profiler.report()['records']
+        self.assertEqual([(record['kind'], record['name'])
+                          for record in records],
+                         [('save', 'a'), ('stage', 'b'), ('stage', 'c')])
+        self.assertIsNone(records[0]['error'])
+        self.assertIn('ValueError', records[2]['error'])
+        for key in ['wall_time', 'cpu_time_thread', 'peak_rss', 'ads_size']:
+            self.assertGreaterEqual(records[1][key], 0)
+        # only the stages walk the Analysis Data Service
+        self.assertNotIn('ads_size', records[0])
+        self.assertEqual(profiler.report()['totals']['stage']['count'], 2)
+
+    def test_write(self):
+        output_dir = tempfile.mkdtemp()
+        try:
+            profiler = start_profiling('test')
+            save(Title='a')
+            filename = os.path.join(output_dir, 'test_profile.json')
+            profiler.write(filename)
+            with open(filename, 'r') as handle:
+                report = json.load(handle)
+            self.assertEqual(report['name'], 'test')
+            self.assertEqual(len(report['records']), 1)
+        finally:
+            shutil.rmtree(output_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,155 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+import total_scattering.reduction.total_scattering_reduction as ts
+from total_scattering.reduction import stage_cache
+from tests import EXAMPLE_DIR
+
+# Algorithms and helpers the stages call, replaced so that the reduction
+# runs without data
+PATCHED = ['CarpenterSampleCorrection', 'CloneWorkspace', 'CompressEvents',
+           'ConvertToDistribution', 'ConvertToHistogram', 'ConvertUnits',
+           'CreateGroupingWorkspace', 'CropWorkspaceRagged',
+           'DeleteWorkspace', 'Divide', 'FFTSmooth', 'LoadDiffCal',
+           'MayersSampleCorrection', 'Minus', 'Rebin', 'RebinToWorkspace',
+           'SaveGSS', 'SetSample', 'SetUncertainties', 'StripVanadiumPeaks',
+           'create_absorption_wksp', 'load', 'merge_workspace', 'save_file']
+
+
+class TestReductionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        def touch(name):
+            filename = os.path.join(self.dir, name)
+            with open(filename, 'w') as handle:
+                handle.write(name)
+            return filename
+
+        with open(os.path.join(EXAMPLE_DIR, 'sns', 'nomad_simple.json')) as f:
+            self.config = json.load(f)
+        sample = self.config['Sample']
+        sample['Filenames'] = [touch('sample.nxs')]
+        sample['Background']['Filenames'] = [touch('container.nxs')]
+        sample['Background']['Background']['Filenames'] = [
+            touch('background.nxs')]
+        normalization = self.config['Normalization']
+        normalization['Filenames'] = [touch('vanadium.nxs')]
+        normalization['Background']['Filenames'] = [
+            os.path.join(self.dir, 'background.nxs')]
+        for section in [sample, normalization]:
+            section['InelasticCorrection'] = {'Type': None}
+        self.config['Calibration']['Filename'] = touch('calibration.h5')
+        self.config.update({'CacheDir': os.path.join(self.dir, 'cache'),
+                            'OutputDir': os.path.join(self.dir, 'output'),
+                            'StageCache': True,
+                            'AsyncSave': False,
+                            'DiagnosticsLevel': 'full'})
+
+        patches = [mock.patch.object(ts, name) for name in PATCHED]
+        patches.append(mock.patch.object(ts, 'save_banks', self.save_banks))
+        patches.append(mock.patch.object(
+            ts, 'get_each_spectra_xmin_xmax',
+            return_value=([1000.], [16000.])))
+        self.mtd = mock.MagicMock()
+        self.mtd.__getitem__.return_value.sample.return_value \
+            .getMaterial.return_value.name.return_value = 'Si'
+        patches.append(mock.patch.object(ts, 'mtd', self.mtd))
+        # Outputs are kept in the cache manifests, not as NeXus files
+        patches.append(mock.patch.object(stage_cache, 'mtd'))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.loads = ts.load
+        stage_cache.mtd.doesExist.return_value = False
+        ts.create_absorption_wksp.return_value = ('abs_sample', 'abs_container')
+        self.loads.side_effect = lambda ws_name, *args, **kwargs: ws_name
+
+    def save_banks(self, InputWorkspace, Filename, Title, OutputDir,
+                   **kwargs):
+        filename = os.path.join(OutputDir, Filename)
+        if not os.path.isdir(OutputDir):
+            os.makedirs(OutputDir)
+        with open(filename, 'a') as handle:
+            handle.write(Title + '\n')
+
+    def reduce(self, title):
+        self.loads.reset_mock()
+        config = json.loads(json.dumps(self.config))
+        config['Title'] = title
+        ts.TotalScatteringReduction(config)
+
+    def written(self, title):
+        output_dir = self.config['OutputDir']
+        written = dict()
+        for filename in sorted(os.listdir(output_dir)):
+            if filename.startswith(title + '_') or filename == title + '.nxs':
+                with open(os.path.join(output_dir, filename)) as handle:
+                    written[filename.replace(title, '<Title>', 1)] = \
+                        handle.read().splitlines()
+        return written
+
+    def test_cached_reduction_writes_all_files(self):
+        self.reduce('first')
+        self.assertTrue(self.loads.called)
+        first = self.written('first')
+        self.assertIn('sample_and_container', first['<Title>.nxs'])
+        self.assertIn('vanadium_minus_back', first['<Title>.nxs'])
+        self.assertEqual(first['<Title>_initial_iofq_banks.nxs'],
+                         ['IQ_banks'])
+        self.assertIn('<Title>_sofq_banks_corrected.nxs', first)
+
+        # All the stages are taken from the cache, the files are the same
+        self.reduce('second')
+        self.assertFalse(self.loads.called)
+        second = self.written('second')
+        self.assertEqual(sorted(second), sorted(first))
+        for filename, titles in first.items():
+            self.assertEqual(sorted(second[filename]), sorted(titles))
+
+    def test_clone_keys_do_not_depend_on_diagnostics_level(self):
+        keys = dict()
+        for level in ['key', 'full']:
+            config = json.loads(json.dumps(self.config))
+            config['DiagnosticsLevel'] = level
+            settings = ts.configure_reduction(config)
+            initial = ts.initial_values(settings)
+            graph = ts.build_reduction_graph(settings)
+            keys[level] = graph.keys(
+                stage_cache.StageCache(self.config['CacheDir']), initial)
+        # The vanadium background is cloned from the container background
+        # with full diagnostics
+        self.assertNotIn('clone_vanadium_background', keys['key'])
+        self.assertEqual(keys['full']['clone_vanadium_background'],
+                         keys['key']['load_vanadium_background'])
+        self.assertEqual(keys['full']['prepare_vanadium'],
+                         keys['key']['prepare_vanadium'])
+
+    def test_prepared_vanadium_writes_background_diagnostic(self):
+        self.config['StageCache'] = False
+        self.config['VanadiumLibrary'] = os.path.join(self.dir, 'library')
+        self.reduce('first')
+        first = self.written('first')
+        self.assertIn('vanadium_background_normalized',
+                      first['<Title>.nxs'])
+
+        # The vanadium is taken from the library, with its background
+        self.reduce('second')
+        second = self.written('second')
+        self.assertNotIn('vanadium_minus_back', second['<Title>.nxs'])
+        self.assertIn('vanadium_background_normalized',
+                      second['<Title>.nxs'])
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+from total_scattering.reduction import run_cache
+from total_scattering.reduction.run_cache import RunCache, run_cache_settings
+
+
+class TestRunCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = RunCache(self.cache_dir)
+        self.runs = list()
+        for index in range(3):
+            filename = os.path.join(self.cache_dir, 'run{}.nxs'.format(index))
+            with open(filename, 'w') as handle:
+                handle.write(str(index))
+            self.runs.append(filename)
+        self.cal_file = os.path.join(self.cache_dir, 'cal.h5')
+        with open(self.cal_file, 'w') as handle:
+            handle.write('calibration')
+
+        # Focusing and summing need real data, only check what is focused
+        patches = [mock.patch.object(run_cache, name)
+                   for name in ['focus_runs', 'sum_runs', 'DeleteWorkspace']]
+        self.focus_runs = patches[0].start()
+        for patch in patches:
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def focused(self, runs):
+        self.focus_runs.reset_mock()
+        self.cache.focus('sample', ','.join(runs), CalFilename=self.cal_file)
+        if not self.focus_runs.called:
+            return []
+        return self.focus_runs.call_args[0][1]
+
+    def test_run_cache_settings(self):
+        self.assertIsNone(run_cache_settings({}))
+        self.assertEqual(
+            run_cache_settings({'RunCache': True, 'CacheDir': '/tmp'}),
+            {'cache_dir': '/tmp', 'max_size_gb': None})
+
+    def test_only_new_runs_are_focused(self):
+        self.assertEqual(self.focused(self.runs[:2]), self.runs[:2])
+        self.assertEqual(self.focused(self.runs), self.runs[2:])
+        self.assertEqual(self.focused(self.runs), [])
+        self.assertEqual(self.focused(self.runs[1:]), [])
+
+    def test_runs_are_refocused_with_other_arguments(self):
+        self.focused(self.runs)
+        self.focus_runs.reset_mock()
+        self.cache.focus('sample', ','.join(self.runs),
+                         CalFilename=self.cal_file, ResampleX=-3000)
+        self.assertEqual(self.focus_runs.call_args[0][1], self.runs)
+
+    def test_runs_are_refocused_with_a_changed_calibration(self):
+        self.focused(self.runs)
+        with open(self.cal_file, 'w') as handle:
+            handle.write('new calibration')
+        os.utime(self.cal_file, (0, 0))
+        self.assertEqual(self.focused(self.runs), self.runs)
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
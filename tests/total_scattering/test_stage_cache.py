@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+from total_scattering.file_handling.save import nexus_write_lock
+from total_scattering.reduction import stage_cache
+from total_scattering.reduction.stage_cache import \
+    StageCache, \
+    cache_settings, \
+    hash_json
+from total_scattering.reduction.stage_graph import StageGraph
+from total_scattering.reduction.vanadium_library import \
+    VanadiumLibrary, \
+    library_dir
+
+
+class TestStageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = StageCache(self.cache_dir)
+        self.calls = list()
+        self.input_file = os.path.join(self.cache_dir, 'input.dat')
+        with open(self.input_file, 'w') as handle:
+            handle.write('1 2 3')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def build_graph(self, scale=2, checkpoint=False):
+        def double(x):
+            self.calls.append('double')
+            return {'y': scale * x}
+
+        def add(x, y):
+            self.calls.append('add')
+            return {'total': x + y}
+
+        graph = StageGraph()
+        graph.add_stage('double', double, inputs=['x'], outputs=['y'],
+                        params={'scale': scale}, files=[self.input_file],
+                        checkpoint=checkpoint)
+        graph.add_stage('add', add, inputs=['x', 'y'], outputs=['total'])
+        return graph
+
+    def test_hash_json_ignores_key_order(self):
+        self.assertEqual(hash_json({'a': 1, 'b': 2}),
+                         hash_json({'b': 2, 'a': 1}))
+        self.assertNotEqual(hash_json({'a': 1}), hash_json({'a': 2}))
+
+    def test_cache_settings(self):
+        self.assertIsNone(cache_settings({}))
+        self.assertEqual(
+            cache_settings({'StageCache': True, 'CacheDir': '/tmp'}),
+            {'cache_dir': '/tmp', 'max_size_gb': None, 'stages': None})
+        self.assertEqual(
+            cache_settings({'StageCache': {'MaxSizeGB': 5,
+                                           'Stages': ['double']},
+                            'CacheDir': '/tmp'}),
+            {'cache_dir': '/tmp', 'max_size_gb': 5, 'stages': ['double']})
+
+    def test_keys_change_downstream_of_a_change(self):
+        keys = self.build_graph().keys(self.cache, {'x': 3})
+        self.assertEqual(keys, self.build_graph().keys(self.cache, {'x': 3}))
+
+        changed = self.build_graph(scale=3).keys(self.cache, {'x': 3})
+        self.assertNotEqual(keys['double'], changed['double'])
+        self.assertNotEqual(keys['add'], changed['add'])
+
+    def test_keys_change_with_input_file(self):
+        keys = self.build_graph().keys(self.cache, {'x': 3})
+        with open(self.input_file, 'w') as handle:
+            handle.write('4 5 6 7')
+        changed = self.build_graph().keys(self.cache, {'x': 3})
+        self.assertNotEqual(keys['double'], changed['double'])
+
+    def test_missing_input_file_disables_caching(self):
+        os.remove(self.input_file)
+        keys = self.build_graph().keys(self.cache, {'x': 3})
+        self.assertIsNone(keys['double'])
+        self.assertIsNone(keys['add'])
+
+    def test_run_reuses_cached_stages(self):
+        values = self.build_graph().run({'x': 3}, cache=self.cache)
+        self.assertEqual(values['total'], 9)
+        self.assertEqual(self.calls, ['double', 'add'])
+
+        self.calls = list()
+        values = self.build_graph().run({'x': 3}, cache=self.cache)
+        self.assertEqual(values['total'], 9)
+        self.assertEqual(self.calls, [])
+
+        values = self.build_graph().run({'x': 4}, cache=self.cache)
+        self.assertEqual(values['total'], 12)
+        self.assertEqual(self.calls, ['double', 'add'])
+
+    def test_run_only_caches_named_stages(self):
+        cache = StageCache(self.cache_dir, stages=['double'])
+        self.build_graph().run({'x': 3}, cache=cache)
+        self.assertEqual([entry['stage'] for entry in cache.entries()],
+                         ['double'])
+
+        self.calls = list()
+        values = self.build_graph().run({'x': 3}, cache=cache)
+        self.assertEqual(values['total'], 9)
+        self.assertEqual(self.calls, ['add'])
+
+    def test_run_resumes_from_checkpoints(self):
+        def fail(total):
+            raise RuntimeError("out of memory")
+
+        graph = self.build_graph(checkpoint=True)
+        graph.add_stage('fail', fail, inputs=['total'])
+        with self.assertRaises(RuntimeError):
+            graph.run({'x': 3}, checkpoints=self.cache)
+        self.assertEqual(self.calls, ['double', 'add'])
+        self.assertEqual([entry['stage'] for entry in self.cache.entries()],
+                         ['double'])
+
+        self.calls = list()
+        graph = self.build_graph(checkpoint=True)
+        values = graph.run({'x': 3}, checkpoints=self.cache)
+        self.assertEqual(values['total'], 9)
+        self.assertEqual(self.calls, ['add'])
+
+    def test_prune(self):
+        self.build_graph().run({'x': 3}, cache=self.cache)
+        self.assertEqual(len(self.cache.entries()), 2)
+        self.assertGreater(self.cache.size(), 0)
+
+        self.assertEqual(self.cache.prune(max_size_gb=1.), [])
+        evicted = self.cache.prune()
+        self.assertEqual(len(evicted), 2)
+        self.assertEqual(self.cache.entries(), [])
+
+    def test_restore_holds_the_nexus_lock(self):
+        locked = list()
+        patches = [mock.patch.object(stage_cache, name)
+                   for name in ['mtd', 'SaveNexusProcessed',
+                                'LoadNexusProcessed']]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        stage_cache.LoadNexusProcessed.side_effect = \
+            lambda **kwargs: locked.append(nexus_write_lock.locked())
+
+        self.cache.store('key', 'stage', {'y': 'y_wksp'})
+        self.cache.restore('key')
+        self.assertEqual(locked, [True])
+        self.assertFalse(nexus_write_lock.locked())
+
+    def test_vanadium_library_is_kept_apart(self):
+        self.build_graph().run({'x': 3}, cache=self.cache)
+        library = VanadiumLibrary(self.cache_dir)
+        self.assertEqual(library.entries(), [])
+        self.assertIsNone(library_dir({}))
+        self.assertEqual(library_dir({'VanadiumLibrary': '/tmp'}), '/tmp')
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,117 @@
+import threading
+import time
+import unittest
+
+from total_scattering.reduction.stage_graph import Stage, StageGraph
+
+
+class TestStageGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = StageGraph()
+        self.graph.add_stage(
+            'double', lambda x: {'y': 2 * x},
+            inputs=['x'], outputs=['y'])
+        self.graph.add_stage(
+            'square', lambda x: {'z': x * x},
+            inputs=['x'], outputs=['z'])
+        self.graph.add_stage(
+            'add', lambda y, z: {'total': y + z},
+            inputs=['y', 'z'], outputs=['total'])
+
+    def test_stage_run_selects_inputs_and_outputs(self):
+        stage = Stage('sum', lambda a, b: {'c': a + b, 'ignored': 0},
+                      inputs=['a', 'b'], outputs=['c'])
+        self.assertEqual(stage.run({'a': 1, 'b': 2, 'other': 3}), {'c': 3})
+
+    def test_stage_missing_output_raises(self):
+        stage = Stage('bad', lambda: {}, outputs=['c'])
+        with self.assertRaises(RuntimeError):
+            stage.run({})
+
+    def test_dependencies(self):
+        dependencies = self.graph.dependencies(initial={'x': 1})
+        self.assertEqual(dependencies['double'], set())
+        self.assertEqual(dependencies['add'], {'double', 'square'})
+
+    def test_order_keeps_insertion_order_of_independent_stages(self):
+        order = self.graph.order(initial={'x': 1})
+        self.assertEqual(order, ['double', 'square', 'add'])
+
+    def test_missing_input_raises(self):
+        with self.assertRaises(RuntimeError):
+            self.graph.dependencies()
+
+    def test_duplicate_producer_raises(self):
+        self.graph.add_stage('other', lambda: {'y': 0}, outputs=['y'])
+        with self.assertRaises(RuntimeError):
+            self.graph.producers()
+
+    def test_duplicate_stage_name_raises(self):
+        with self.assertRaises(RuntimeError):
+            self.graph.add_stage('add', lambda: None)
+
+    def test_subgraph_keeps_upstream_stages(self):
+        self.graph.add_stage('other', lambda x: {'w': x}, inputs=['x'],
+                             outputs=['w'])
+        subgraph = self.graph.subgraph(['total'], initial={'x': 1})
+        self.assertEqual(list(subgraph.stages), ['double', 'square', 'add'])
+        subgraph = self.graph.subgraph(['y', 'w'], initial={'x': 1})
+        self.assertEqual(list(subgraph.stages), ['double', 'other'])
+
+    def test_cycle_raises(self):
+        graph = StageGraph()
+        graph.add_stage('a', lambda b: {'a': b}, inputs=['b'], outputs=['a'])
+        graph.add_stage('b', lambda a: {'b': a}, inputs=['a'], outputs=['b'])
+        with self.assertRaises(RuntimeError):
+            graph.order()
+
+    def test_after_adds_ordering_dependency(self):
+        calls = list()
+        graph = StageGraph()
+        graph.add_stage('first', lambda: calls.append('first'),
+                        after=['second'])
+        graph.add_stage('second', lambda: calls.append('second'))
+        graph.run()
+        self.assertEqual(calls, ['second', 'first'])
+
+    def test_run_serial(self):
+        values = self.graph.run(initial={'x': 3})
+        self.assertEqual(values['total'], 15)
+        self.assertEqual(list(self.graph.timings.keys()),
+                         ['double', 'square', 'add'])
+
+    def test_run_parallel_matches_serial(self):
+        values = self.graph.run(initial={'x': 3}, max_workers=4)
+        self.assertEqual(values['total'], 15)
+        self.assertEqual(set(self.graph.timings.keys()),
+                         {'double', 'square', 'add'})
+
+    def test_run_parallel_runs_independent_branches_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def branch(x):
+            barrier.wait()
+            return {'branch_{}'.format(x): x}
+
+        graph = StageGraph()
+        graph.add_stage('left', lambda: branch(0), outputs=['branch_0'])
+        graph.add_stage('right', lambda: branch(1), outputs=['branch_1'])
+        values = graph.run(max_workers=2)
+        self.assertEqual(values['branch_0'], 0)
+        self.assertEqual(values['branch_1'], 1)
+
+    def test_run_parallel_propagates_errors(self):
+        def fail():
+            time.sleep(0.01)
+            raise ValueError("stage failed")
+
+        graph = StageGraph()
+        graph.add_stage('fail', fail, outputs=['a'])
+        graph.add_stage('next', lambda a: None, inputs=['a'])
+        with self.assertRaises(ValueError):
+            graph.run(max_workers=2)
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
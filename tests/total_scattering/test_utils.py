@@ -1,5 +1,16 @@
+import json
+import os
 import unittest
+
+import numpy as np
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
 import total_scattering.reduction.total_scattering_reduction as ts
+from tests import EXAMPLE_DIR
 
 
 class TestUtilsForReduction(unittest.TestCase):
@@ -81,3 +92,122 @@ class TestUtilsForReduction(unittest.TestCase):
         config = {"BadKey": {"Runs": "10-20"}}
         with self.assertRaises(Exception):
             ts.get_normalization(config)
+
+    def test_diagnostics_enabled(self):
+        """ Test which steps are written for each diagnostics level
+        """
+        for level, written in [('none', ['none']),
+                               ('key', ['none', 'key']),
+                               ('full', ['none', 'key', 'full'])]:
+            settings = {'diagnostics_level': level}
+            for step in ts.DIAGNOSTICS_LEVELS:
+                self.assertEqual(ts.diagnostics_enabled(settings, step),
+                                 step in written)
+
+    def test_diagnostics_level_skips_stages(self):
+        """ Test that steps only needed for full diagnostics are left out
+        of the reduction graph
+        """
+        with open(os.path.join(EXAMPLE_DIR, 'sns', 'nomad_simple.json')) as f:
+            example = json.load(f)
+        diagnostics_only = ['load_container_background',
+                            'copy_raw_workspaces',
+                            'subtract_container_background',
+                            'normalize_raw_workspaces',
+                            'normalize_backgrounds']
+        for level in ts.DIAGNOSTICS_LEVELS:
+            config = json.loads(json.dumps(example))
+            config['DiagnosticsLevel'] = level
+            config['Checkpoints'] = False
+            settings = ts.configure_reduction(config)
+            graph = ts.build_reduction_graph(settings)
+            graph.order(ts.initial_values(settings))
+            for name in diagnostics_only:
+                self.assertEqual(name in graph.stages, level == 'full')
+            self.assertIn('output_spectrum', graph.stages)
+
+        config = json.loads(json.dumps(example))
+        config['DiagnosticsLevel'] = 'some'
+        with self.assertRaises(RuntimeError):
+            ts.configure_reduction(config)
+
+    def test_banks_are_merged_when_asked_for(self):
+        """ Test that the banks are only merged for `SumBanks` or the
+        Fourier transform
+        """
+        with open(os.path.join(EXAMPLE_DIR, 'sns', 'nomad_simple.json')) as f:
+            example = json.load(f)
+        graph = ts.build_reduction_graph(ts.configure_reduction(
+            json.loads(json.dumps(example))))
+        self.assertIn('merge_banks', graph.stages)
+
+        del example['Merging']['SumBanks']
+        graph = ts.build_reduction_graph(ts.configure_reduction(
+            json.loads(json.dumps(example))))
+        self.assertNotIn('merge_banks', graph.stages)
+
+        example['FourierTransform'] = {'Rmax': 20.}
+        graph = ts.build_reduction_graph(ts.configure_reduction(example))
+        self.assertIn('merge_banks', graph.stages)
+        self.assertIn('transform_to_gofr', graph.stages)
+
+    def test_run_workers_share_the_cpus(self):
+        """ Test that the run workers of the concurrent stages are kept
+        within the number of CPUs
+        """
+        with open(os.path.join(EXAMPLE_DIR, 'sns', 'nomad_simple.json')) as f:
+            example = json.load(f)
+        example.update({'MaxWorkers': 4, 'RunWorkers': 8})
+        with mock.patch.object(ts.multiprocessing, 'cpu_count',
+                               return_value=16):
+            settings = ts.configure_reduction(json.loads(json.dumps(example)))
+            self.assertEqual(settings['run_workers'], 4)
+            example['RunWorkers'] = 2
+            settings = ts.configure_reduction(example)
+            self.assertEqual(settings['run_workers'], 2)
+
+    def test_normalize_to_sofq(self):
+        """ Test that S(Q) tends to 1 where the cross section is the
+        total scattering length squared
+        """
+        class Workspace(object):
+            def __init__(self, values):
+                self.values = values
+
+            def __rmul__(self, factor):
+                return Workspace(factor * self.values)
+
+            def __sub__(self, value):
+                return Workspace(self.values - value)
+
+            def __add__(self, value):
+                return Workspace(self.values + value)
+
+        # <b>^2 = 1 barn and <b^2> = 1.5 barn
+        material = mock.Mock()
+        material.cohScatterLength.return_value = 10.
+        material.totalScatterLengthSqrd.return_value = 150.
+        workspace = Workspace(np.array([1.5, 2.5, 0.5]))
+        workspace.sample = mock.Mock()
+        workspace.sample.return_value.getMaterial.return_value = material
+        ads = {'dcs': workspace}
+        with mock.patch.object(ts, 'mtd', ads):
+            ts.normalize_to_sofq('dcs', 'sofq')
+            np.testing.assert_allclose(ads['sofq'].values, [1., 2., 0.])
+
+            material.cohScatterLength.return_value = 0.
+            with self.assertRaises(RuntimeError):
+                ts.normalize_to_sofq('dcs', 'sofq')
+
+    def test_checkpoints_are_opt_in(self):
+        """ Test that checkpoints are only written when asked for
+        """
+        with open(os.path.join(EXAMPLE_DIR, 'sns', 'nomad_simple.json')) as f:
+            example = json.load(f)
+        settings = ts.configure_reduction(json.loads(json.dumps(example)))
+        self.assertIsNone(settings['checkpoint_dir'])
+
+        example['Checkpoints'] = True
+        settings = ts.configure_reduction(example)
+        self.assertTrue(settings['checkpoint_dir'].endswith(
+            os.path.join('.checkpoints', example['Title'])))
@@ -1,21 +1,195 @@
 from __future__ import (absolute_import, division, print_function)
 
 import json
+import sys
 from total_scattering.reduction import TotalScatteringReduction
 
 
+def cache_main(args):
+    """ Inspect or prune the stage cache
+
+    :param args: Command line arguments after `cache`
+    :type args: list
+    """
+    import argparse
+    import time
+    from total_scattering.reduction.stage_cache import GIGABYTE, StageCache
+
+    parser = argparse.ArgumentParser(
+        prog='mantidtotalscattering cache',
+        description="Inspect or prune the stage cache")
+    parser.add_argument('action', choices=['list', 'prune'])
+    location = parser.add_mutually_exclusive_group(required=True)
+    location.add_argument('--cache-dir', help='Cache directory')
+    location.add_argument(
+        '--json', help='Input json file to take "CacheDir" from')
+    parser.add_argument(
+        '--max-size', type=float, default=0.,
+        help='Size in GB to prune the cache down to (default clears it)')
+    options = parser.parse_args(args)
+
+    cache_dir = options.cache_dir
+    if options.json:
+        with open(options.json, 'r') as handle:
+            cache_dir = json.load(handle).get('CacheDir', '.')
+    cache = StageCache(cache_dir)
+
+    if options.action == 'list':
+        entries = cache.entries()
+        for entry in entries:
+            print("{}  {:<40} {:>10.1f} MB  {}".format(
+                entry['key'][:16], entry['stage'], entry['size'] / 1024. ** 2,
+                time.strftime('%Y-%m-%d %H:%M',
+                              time.localtime(entry['last_access']))))
+        print("{} entries, {:.2f} GB in {}".format(
+            len(entries), cache.size() / GIGABYTE, cache.root))
+    else:
+        evicted = cache.prune(options.max_size)
+        print("Evicted {} entries, {:.2f} GB left in {}".format(
+            len(evicted), cache.size() / GIGABYTE, cache.root))
+
+
+def batch_main(args):
+    """ Reduce a batch of samples sharing normalization and backgrounds
+
+    :param args: Command line arguments after `batch`
+    :type args: list
+    """
+    import argparse
+    from total_scattering.reduction.batch import \
+        read_batch_configs, \
+        reduce_batch
+
+    parser = argparse.ArgumentParser(
+        prog='mantidtotalscattering batch',
+        description="Reduce many samples, computing the vanadium, "
+                    "backgrounds and container they share only once")
+    parser.add_argument(
+        'inputs', nargs='+',
+        help='Input json files (one input or a list of them each) or json '
+             'lines files (.jsonl, one input per line)')
+    parser.add_argument(
+        '-n', '--processes', type=int, default=1,
+        help='Number of samples reduced at once')
+    options = parser.parse_args(args)
+
+    results = reduce_batch(
+        read_batch_configs(options.inputs), processes=options.processes)
+    failed = [(title, error) for title, error in results if error]
+    for title, error in failed:
+        print("Reduction of '{}' failed:\n{}".format(title, error))
+    print("{} of {} reductions succeeded".format(
+        len(results) - len(failed), len(results)))
+    if failed:
+        sys.exit(1)
+
+
+def vanadium_main(args):
+    """ Pre-build or list the prepared vanadium library
+
+    :param args: Command line arguments after `vanadium`
+    :type args: list
+    """
+    import argparse
+    import time
+    from total_scattering.reduction.batch import read_batch_configs
+    from total_scattering.reduction.total_scattering_reduction import \
+        build_prepared_vanadium
+    from total_scattering.reduction.vanadium_library import \
+        VanadiumLibrary, \
+        library_dir
+
+    parser = argparse.ArgumentParser(
+        prog='mantidtotalscattering vanadium',
+        description="Pre-build or list the prepared vanadium library")
+    parser.add_argument('action', choices=['build', 'list'])
+    parser.add_argument(
+        'inputs', nargs='*',
+        help='Input json or json lines files whose vanadium to build (list '
+             'takes the library from the first one)')
+    parser.add_argument(
+        '--library-dir',
+        help='Library directory (overrides "VanadiumLibrary" in the json)')
+    options = parser.parse_args(args)
+
+    configs = read_batch_configs(options.inputs)
+    if options.library_dir:
+        for config in configs:
+            config['VanadiumLibrary'] = options.library_dir
+
+    if options.action == 'build':
+        for config in configs:
+            key, existed = build_prepared_vanadium(config)
+            print("{} vanadium of '{}' as {}".format(
+                'Found' if existed else 'Prepared', config.get('Title'), key))
+        return
+
+    if options.library_dir:
+        library = VanadiumLibrary(options.library_dir)
+    elif configs and library_dir(configs[0]):
+        library = VanadiumLibrary(library_dir(configs[0]))
+    else:
+        parser.error("give --library-dir or an input with VanadiumLibrary")
+    for entry in library.entries():
+        print("{}  {:<50} {:>10.1f} MB  {}".format(
+            entry['key'][:16], entry['stage'], entry['size'] / 1024. ** 2,
+            time.strftime('%Y-%m-%d %H:%M',
+                          time.localtime(entry['last_access']))))
+
+
 def main(config=None):
 
     # Read in JSON if not provided to main()
     if not config:
+        if sys.argv[1:2] == ['cache']:
+            cache_main(sys.argv[2:])
+            return
+        if sys.argv[1:2] == ['batch']:
+            batch_main(sys.argv[2:])
+            return
+        if sys.argv[1:2] == ['vanadium']:
+            vanadium_main(sys.argv[2:])
+            return
+
         import argparse
         parser = argparse.ArgumentParser(
             description="Absolute normalization PDF generation")
         parser.add_argument('json', help='Input json file')
+        parser.add_argument(
+            '-j', '--max-workers', type=int, default=None,
+            help='Number of workers for steps that can run concurrently, '
+                 'such as loading (overrides "MaxWorkers" in the json)')
+        parser.add_argument(
+            '--run-workers', type=int, default=None,
+            help='Number of processes focusing the runs of a multi-run '
+                 'sample, container or vanadium (overrides "RunWorkers")')
+        parser.add_argument(
+            '--profile', action='store_true',
+            help='Write the time and memory used by each stage to '
+                 '<Title>_profile.json in the output directory')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Restart from the checkpoints of an interrupted reduction '
+                 '(run with "Checkpoints": true)')
+        parser.add_argument(
+            '--diagnostics-level', choices=['none', 'key', 'full'],
+            default=None,
+            help='Intermediate steps written to <Title>.nxs (overrides '
+                 '"DiagnosticsLevel")')
         options = parser.parse_args()
         print("loading config from '%s'" % options.json)
         with open(options.json, 'r') as handle:
             config = json.load(handle)
+        if options.max_workers is not None:
+            config['MaxWorkers'] = options.max_workers
+        if options.run_workers is not None:
+            config['RunWorkers'] = options.run_workers
+        if options.profile:
+            config['Profile'] = True
+        if options.resume:
+            config['Resume'] = True
+        if options.diagnostics_level is not None:
+            config['DiagnosticsLevel'] = options.diagnostics_level
 
     # Run total scattering reduction
     TotalScatteringReduction(config)
@@ -1,11 +1,26 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from mantid import mtd
 from mantid.simpleapi import \
     AlignAndFocusPowderFromFiles, \
+    CloneWorkspace, \
     ConvertUnits, \
+    DeleteWorkspace, \
     Load, \
+    LoadDetectorsGroupingFile, \
+    LoadNexusProcessed, \
     NormaliseByCurrent, \
     PDDetermineCharacterizations, \
     PDLoadCharacterizations, \
+    Plus, \
     PropertyManagerDataService, \
+    RebinToWorkspace, \
+    SaveDetectorsGrouping, \
+    SaveNexusProcessed, \
     SetSample
 from mantid.utils import absorptioncorrutils
 
@@ -19,13 +34,38 @@ required_shape_keys = {
 
 def load(ws_name, input_files,
          geometry=None, chemical_formula=None, mass_density=None,
-         absorption_wksp='', **align_and_focus_args):
-    '''Load workspace'''
-    AlignAndFocusPowderFromFiles(
-        OutputWorkspace=ws_name,
-        Filename=input_files,
-        AbsorptionWorkspace=absorption_wksp,
-        **align_and_focus_args)
+         absorption_wksp='', run_workers=1, run_cache=None,
+         **align_and_focus_args):
+    '''Load workspace
+
+    With `run_workers` above 1, each run of `input_files` is focused in its
+    own worker process (see `focus_runs_in_parallel`). With a `run_cache`
+    (see `total_scattering.reduction.run_cache.RunCache`), runs focused by
+    an earlier load are taken from it and only new runs are focused.
+
+    With `Characterizations`, each load writes them into its own reduction
+    property manager (unless `ReductionProperties` is given), so that loads
+    running at the same time do not overwrite each other's.
+    '''
+    if 'Characterizations' in align_and_focus_args \
+            and 'ReductionProperties' not in align_and_focus_args:
+        align_and_focus_args['ReductionProperties'] = \
+            reduction_properties_name(ws_name)
+    if run_cache is not None and not absorption_wksp:
+        run_cache.focus(ws_name, input_files, run_workers,
+                        **align_and_focus_args)
+    elif run_workers is not None and run_workers > 1 \
+            and len(split_filenames(input_files)) > 1:
+        focus_runs_in_parallel(
+            ws_name, input_files, run_workers,
+            AbsorptionWorkspace=absorption_wksp,
+            **align_and_focus_args)
+    else:
+        AlignAndFocusPowderFromFiles(
+            OutputWorkspace=ws_name,
+            Filename=input_files,
+            AbsorptionWorkspace=absorption_wksp,
+            **align_and_focus_args)
     NormaliseByCurrent(
         InputWorkspace=ws_name,
         OutputWorkspace=ws_name,
@@ -41,6 +81,207 @@ def load(ws_name, input_files,
     return ws_name
 
 
+def reduction_properties_name(ws_name):
+    '''Name of the reduction property manager of a load'''
+    return '__{}_reductionprops'.format(ws_name)
+
+
+def focus_runs_in_parallel(ws_name, input_files, processes,
+                           **align_and_focus_args):
+    '''Focus each run in a worker process, then sum the focused runs
+
+    The runs are summed before normalizing by the proton charge, like
+    AlignAndFocusPowderFromFiles does, so the sum of the counts is the
+    proton charge weighted sum of the normalized runs.
+
+    :param ws_name: Name of the summed workspace
+    :type ws_name: str
+    :param input_files: Comma separated string or list of runs/filenames
+    :type input_files: str or list
+    :param processes: Maximum number of worker processes
+    :type processes: int
+
+    :return: Name of the summed workspace
+    :rtype: str
+    '''
+    filenames = split_filenames(input_files)
+    run_names = ['__{}_run{}'.format(ws_name, index)
+                 for index in range(len(filenames))]
+    focus_runs(run_names, filenames, processes, **align_and_focus_args)
+    if mtd.doesExist(ws_name):
+        DeleteWorkspace(ws_name)
+    sum_runs(ws_name, run_names)
+    for run_name in run_names:
+        DeleteWorkspace(run_name)
+    return ws_name
+
+
+def focus_runs(run_names, filenames, processes=1, **align_and_focus_args):
+    '''Focus runs one by one, each into its own workspace
+
+    With more than one process, each run is focused in a worker process.
+    Workspaces the arguments refer to (absorption, grouping,
+    characterizations) are passed to the workers through files.
+
+    :param run_names: Names of the focused workspaces
+    :type run_names: list
+    :param filenames: Run or filename of each workspace
+    :type filenames: list
+    :param processes: Maximum number of worker processes
+    :type processes: int
+
+    :return: Names of the focused workspaces
+    :rtype: list
+    '''
+    if processes is None or processes <= 1 or len(filenames) <= 1:
+        for run_name, filename in zip(run_names, filenames):
+            AlignAndFocusPowderFromFiles(
+                OutputWorkspace=run_name,
+                Filename=filename,
+                **align_and_focus_args)
+        return run_names
+
+    tmp_dir = tempfile.mkdtemp(prefix='focus_')
+    try:
+        workspace_files = export_workspace_args(
+            tmp_dir, align_and_focus_args)
+        jobs = [(filename, run_name,
+                 os.path.join(tmp_dir, 'run{}.nxs'.format(index)),
+                 workspace_files, align_and_focus_args)
+                for index, (run_name, filename)
+                in enumerate(zip(run_names, filenames))]
+
+        # Mantid does not survive a fork, so workers start from scratch
+        pool = multiprocessing.get_context('spawn').Pool(
+            min(processes, len(jobs)))
+        try:
+            focused_files = pool.map(focus_run, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        for run_name, focused_file in zip(run_names, focused_files):
+            LoadNexusProcessed(Filename=focused_file,
+                               OutputWorkspace=run_name)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return run_names
+
+
+def sum_runs(ws_name, run_names):
+    '''Add focused runs to a workspace, in order, as
+    AlignAndFocusPowderFromFiles does
+
+    :param ws_name: Workspace to add to, created from the first run if it
+                    does not exist
+    :type ws_name: str
+    :param run_names: Focused workspaces to add
+    :type run_names: list
+
+    :return: Name of the summed workspace
+    :rtype: str
+    '''
+    part = '__{}_part'.format(ws_name)
+    for run_name in run_names:
+        if not mtd.doesExist(ws_name):
+            CloneWorkspace(InputWorkspace=run_name, OutputWorkspace=ws_name)
+            continue
+        RebinToWorkspace(WorkspaceToRebin=run_name, WorkspaceToMatch=ws_name,
+                         OutputWorkspace=part)
+        Plus(LHSWorkspace=ws_name, RHSWorkspace=part,
+             OutputWorkspace=ws_name)
+    if mtd.doesExist(part):
+        DeleteWorkspace(part)
+    return ws_name
+
+
+def export_workspace_args(directory, align_and_focus_args):
+    '''Save the workspaces named in align and focus arguments to files
+
+    :param directory: Directory to save the workspaces in
+    :type directory: str
+    :param align_and_focus_args: Arguments for AlignAndFocusPowderFromFiles
+    :type align_and_focus_args: dict
+
+    :return: Argument name -> file holding the workspace
+    :rtype: dict
+    '''
+    workspace_files = dict()
+    grouping = align_and_focus_args.get('GroupingWorkspace')
+    if grouping and mtd.doesExist(grouping):
+        filename = os.path.join(directory, 'grouping.xml')
+        SaveDetectorsGrouping(InputWorkspace=grouping, OutputFile=filename)
+        workspace_files['GroupingWorkspace'] = filename
+    for key, basename in [('AbsorptionWorkspace', 'absorption.nxs'),
+                          ('Characterizations', 'characterizations.nxs')]:
+        workspace = align_and_focus_args.get(key)
+        if workspace and mtd.doesExist(str(workspace)):
+            filename = os.path.join(directory, basename)
+            SaveNexusProcessed(InputWorkspace=str(workspace),
+                               Filename=filename)
+            workspace_files[key] = filename
+    return workspace_files
+
+
+def focus_run(job):
+    '''Focus a single run in a worker process of `focus_runs_in_parallel`
+
+    :param job: Run filename, workspace name, output filename, workspace
+                files from `export_workspace_args` and align and focus
+                arguments
+    :type job: tuple
+
+    :return: Filename of the focused run
+    :rtype: str
+    '''
+    filename, ws_name, output_file, workspace_files, kwargs = job
+    if 'GroupingWorkspace' in workspace_files:
+        LoadDetectorsGroupingFile(
+            InputFile=workspace_files['GroupingWorkspace'],
+            OutputWorkspace=kwargs['GroupingWorkspace'])
+    for key in ['AbsorptionWorkspace', 'Characterizations']:
+        if key in workspace_files:
+            LoadNexusProcessed(
+                Filename=workspace_files[key],
+                OutputWorkspace=str(kwargs[key]))
+    AlignAndFocusPowderFromFiles(
+        OutputWorkspace=ws_name,
+        Filename=filename,
+        **kwargs)
+    SaveNexusProcessed(InputWorkspace=ws_name, Filename=output_file)
+    return output_file
+
+
+def chain_jobs_sharing_files(jobs):
+    '''Group load jobs so that jobs reading the same file end up together
+
+    :param jobs: Output workspace name mapped to the keyword arguments
+                 for `load`, which must include `input_files`
+    :type jobs: OrderedDict
+
+    :return: Lists of workspace names, each to be loaded in order
+    :rtype: list
+    '''
+    chains = OrderedDict()
+    for ws_name, job in jobs.items():
+        files = set(split_filenames(job['input_files']))
+        shared = [key for key, chain in chains.items() if chain[0] & files]
+        names = [ws_name]
+        for key in shared:
+            other_files, other_names = chains.pop(key)
+            files |= other_files
+            names = other_names + names
+        chains[ws_name] = (files, names)
+    return [names for files, names in chains.values()]
+
+
+def split_filenames(input_files):
+    '''Split a comma separated string (or list) of files into a list'''
+    if isinstance(input_files, str):
+        input_files = input_files.split(',')
+    return [filename.strip() for filename in input_files if filename.strip()]
+
+
 def set_sample(ws_name, geometry=None, chemical_formula=None,
                mass_density=None):
     '''Sets sample'''
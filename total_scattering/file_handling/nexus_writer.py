@@ -0,0 +1,295 @@
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import re
+import time
+
+import h5py
+import numpy as np
+
+# Compression filters Mantid can read back (h5py's `lzf` is not one)
+COMPRESSIONS = [None, 'gzip']
+
+# Header of the entries, as written by SaveNexusProcessed
+DEFINITION = "Mantid Processed Workspace"
+DEFINITION_URL = "http://www.nexusformat.org/instruments/xml/NXprocessed.xml"
+DEFINITION_LOCAL_URL = "http://www.isis.rl.ac.uk/xml/IXmantid.xml"
+
+# Number of values copied from the workspace per write, so that spectra
+# go to the file in blocks instead of through a copy of the whole workspace
+BLOCK_SIZE = 2 ** 20
+
+
+def nexus_writer_settings(config):
+    """ Get the settings of the diagnostics file writer from the JSON input
+
+    `"DiagnosticsFile": {"Writer": "h5py", "Compression": "gzip",
+    "CompressionLevel": 4, "Chunks": true}`. `SaveNexusProcessed` (default)
+    reopens the file for every entry, the `h5py` writer keeps it open for
+    the whole reduction and is the only one compressing or chunking the
+    datasets, but leaves out the sample, logs and instrument geometry (see
+    `ProcessedNexusWriter`). `Chunks` is true for automatic chunking or the
+    number of bins of a chunk.
+
+    :param config: JSON input for reduction
+    :type config: dict
+
+    :return: Arguments for `ProcessedNexusFiles`, or None to write with
+             SaveNexusProcessed
+    :rtype: dict or None
+    """
+    options = config.get('DiagnosticsFile', dict())
+    writer = options.get('Writer', 'SaveNexusProcessed')
+    if writer == 'SaveNexusProcessed':
+        h5py_options = [key for key in ['Compression', 'CompressionLevel',
+                                        'Chunks'] if key in options]
+        if h5py_options:
+            msg = "DiagnosticsFile {} need \"Writer\": \"h5py\""
+            raise RuntimeError(msg.format(h5py_options))
+        return None
+    if writer != 'h5py':
+        msg = "Unknown DiagnosticsFile Writer '{}', expected h5py or " \
+              "SaveNexusProcessed"
+        raise RuntimeError(msg.format(writer))
+    compression = options.get('Compression', None)
+    if compression not in COMPRESSIONS:
+        msg = "Unsupported DiagnosticsFile Compression '{}', expected one of {}"
+        raise RuntimeError(msg.format(compression, COMPRESSIONS))
+    return {'compression': compression,
+            'compression_level': options.get('CompressionLevel', None),
+            'chunks': options.get('Chunks', None)}
+
+
+class ProcessedNexusWriter(object):
+    """ Writes workspaces as entries of a processed NeXus file kept open
+    until `close`
+
+    Only the data, errors, axes, spectrum numbers, detector IDs and
+    instrument name are written, laid out like those of SaveNexusProcessed,
+    so the file reads back with LoadNexusProcessed. The sample (material,
+    shape), the run logs, the instrument geometry, the masking and the
+    workspace history are not written: workspaces loaded back have none of
+    them. Entries are appended after those already in the file.
+
+    :param filename: Path of the NeXus file
+    :type filename: str
+    :param compression: None or `gzip`
+    :type compression: str
+    :param compression_level: Level of the gzip compression (1 to 9)
+    :type compression_level: int
+    :param chunks: True for chunks chosen by HDF5, or the number of bins of
+                   a chunk (one spectrum per chunk), None for no chunking
+                   unless compressed
+    :type chunks: bool or int
+    """
+
+    def __init__(self, filename, compression=None, compression_level=None,
+                 chunks=None):
+        if compression not in COMPRESSIONS:
+            msg = "Unsupported compression '{}', expected one of {}"
+            raise RuntimeError(msg.format(compression, COMPRESSIONS))
+        self.filename = filename
+        self.compression = compression
+        self.compression_level = compression_level
+        self.chunks = chunks
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._file = h5py.File(filename, 'a')
+        if not self._file.attrs.get('file_name'):
+            self._file.attrs['NeXus_version'] = np.bytes_('4.3.0')
+            self._file.attrs['file_name'] = np.bytes_(
+                os.path.abspath(filename))
+            self._file.attrs['HDF5_Version'] = np.bytes_(
+                h5py.version.hdf5_version)
+            self._file.attrs['file_time'] = np.bytes_(
+                time.strftime('%Y-%m-%dT%H:%M:%S'))
+        numbers = [int(match.group(1)) for match in (
+            re.match(r'mantid_workspace_(\d+)$', name)
+            for name in self._file) if match]
+        self.entries = max(numbers) if numbers else 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _dataset_options(self, shape):
+        options = dict()
+        if self.compression:
+            options['compression'] = self.compression
+            if self.compression_level is not None:
+                options['compression_opts'] = self.compression_level
+        if self.chunks is True or (self.compression and not self.chunks):
+            options['chunks'] = True
+        elif self.chunks:
+            options['chunks'] = tuple(
+                [1] * (len(shape) - 1) + [min(int(self.chunks), shape[-1])])
+        if 0 in shape:
+            options = dict()  # empty datasets cannot be chunked
+        return options
+
+    def _write_data(self, group, name, data, **attributes):
+        dataset = group.create_dataset(
+            name, data=data, **self._dataset_options(data.shape))
+        for key, value in attributes.items():
+            dataset.attrs[key] = value
+        return dataset
+
+    def _write_spectra(self, group, name, read, shape, **attributes):
+        """ Write a 2D dataset one block of spectra at a time from the
+        read-only views returned by `read(index)` (ie `readY`) """
+        dataset = group.create_dataset(
+            name, shape=shape, dtype=np.float64,
+            **self._dataset_options(shape))
+        for key, value in attributes.items():
+            dataset.attrs[key] = value
+        block = max(1, BLOCK_SIZE // max(1, shape[1]))
+        for start in range(0, shape[0], block):
+            stop = min(start + block, shape[0])
+            dataset[start:stop] = [read(index) for index in range(start, stop)]
+        return dataset
+
+    def write(self, workspace, title):
+        """ Append a workspace as a new entry
+
+        :param workspace: Workspace to write
+        :type workspace: MatrixWorkspace
+        :param title: Title of the entry
+        :type title: str
+
+        :return: Name of the entry (ie `mantid_workspace_3`)
+        :rtype: str
+        """
+        if self._file is None:
+            raise RuntimeError("{} is closed".format(self.filename))
+        name = 'mantid_workspace_{}'.format(self.entries + 1)
+        entry = self._file.create_group(name)
+        entry.attrs['NX_class'] = np.bytes_('NXentry')
+        string_datasets = [
+            ('title', title, {}),
+            ('workspace_name', title, {}),
+            ('definition', DEFINITION,
+             {'URL': DEFINITION_URL, 'Version': '1.0'}),
+            ('definition_local', DEFINITION,
+             {'URL': DEFINITION_LOCAL_URL, 'Version': '1.0'})]
+        for key, value, attributes in string_datasets:
+            dataset = entry.create_dataset(key, data=np.bytes_(value))
+            for attribute, text in attributes.items():
+                dataset.attrs[attribute] = np.bytes_(text)
+
+        histograms = workspace.getNumberHistograms()
+        spectra = [workspace.getSpectrum(index) for index in range(histograms)]
+
+        # Data, errors and axes
+        data = entry.create_group('workspace')
+        data.attrs['NX_class'] = np.bytes_('NXdata')
+        shape = (histograms, workspace.blocksize())
+        self._write_spectra(
+            data, 'values', workspace.readY, shape,
+            signal=np.int32(1),
+            axes=np.bytes_('axis2,axis1'),
+            units=np.bytes_(workspace.YUnit()),
+            unit_label=np.bytes_(workspace.YUnitLabel()))
+        self._write_spectra(data, 'errors', workspace.readE, shape)
+
+        unit = workspace.getAxis(0).getUnit()
+        x_attributes = {'units': np.bytes_(unit.unitID()),
+                        'caption': np.bytes_(unit.caption()),
+                        'label': np.bytes_(str(unit.symbol()))}
+        if workspace.isDistribution():
+            x_attributes['distribution'] = np.bytes_('1')
+        if workspace.isCommonBins():
+            self._write_data(data, 'axis1', np.asarray(
+                workspace.readX(0), dtype=np.float64), **x_attributes)
+        else:
+            self._write_spectra(
+                data, 'axis1', workspace.readX,
+                (histograms, len(workspace.readX(0))), **x_attributes)
+
+        spectrum_numbers = np.array(
+            [spectrum.getSpectrumNo() for spectrum in spectra],
+            dtype=np.int32)
+        axis = workspace.getAxis(1)
+        if axis.isSpectra():
+            data.create_dataset('axis2', data=spectrum_numbers)
+            data['axis2'].attrs['units'] = np.bytes_('spectraNumber')
+        else:
+            data.create_dataset(
+                'axis2', data=np.asarray(axis.extractValues(),
+                                         dtype=np.float64))
+            data['axis2'].attrs['units'] = np.bytes_(
+                axis.getUnit().unitID())
+
+        # Instrument name and spectra to detectors mapping
+        instrument = entry.create_group('instrument')
+        instrument.attrs['NX_class'] = np.bytes_('NXinstrument')
+        instrument.create_dataset('name', data=np.bytes_(
+            workspace.getInstrument().getName()))
+        detector_ids = [sorted(spectrum.getDetectorIDs())
+                        for spectrum in spectra]
+        counts = np.array([len(ids) for ids in detector_ids], dtype=np.int32)
+        detector = instrument.create_group('detector')
+        detector.attrs['NX_class'] = np.bytes_('NXdetector')
+        detector.create_dataset('detector_index', data=np.concatenate(
+            [[0], np.cumsum(counts)[:-1]]).astype(np.int32))
+        detector.create_dataset('detector_count', data=counts)
+        detector.create_dataset('detector_list', data=np.array(
+            [i for ids in detector_ids for i in ids], dtype=np.int32))
+        detector.create_dataset('spectra', data=spectrum_numbers)
+
+        process = entry.create_group('process')
+        process.attrs['NX_class'] = np.bytes_('NXprocess')
+
+        self._file.flush()
+        self.entries += 1
+        return name
+
+    def close(self):
+        """ Close the file, entries can not be written anymore """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ProcessedNexusFiles(object):
+    """ Open `ProcessedNexusWriter` of each file written by a reduction
+
+    :param compression: None or `gzip`
+    :type compression: str
+    :param compression_level: Level of the gzip compression (1 to 9)
+    :type compression_level: int
+    :param chunks: Chunking of the datasets, see `ProcessedNexusWriter`
+    :type chunks: bool or int
+    """
+
+    def __init__(self, compression=None, compression_level=None,
+                 chunks=None):
+        self.options = {'compression': compression,
+                        'compression_level': compression_level,
+                        'chunks': chunks}
+        self.writers = dict()
+
+    def write(self, filename, workspace, title):
+        """ Append a workspace to a file, opening it on the first write
+
+        :param filename: Path of the NeXus file
+        :type filename: str
+        :param workspace: Workspace to write
+        :type workspace: MatrixWorkspace
+        :param title: Title of the entry
+        :type title: str
+        """
+        filename = os.path.abspath(filename)
+        if filename not in self.writers:
+            self.writers[filename] = ProcessedNexusWriter(
+                filename, **self.options)
+        return self.writers[filename].write(workspace, title)
+
+    def close(self):
+        """ Close all the files """
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = dict()
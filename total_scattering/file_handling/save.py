@@ -1,18 +1,29 @@
 import os
+import queue
+import threading
+import uuid
 from mantid import mtd
 from mantid.api import IEventWorkspace
 from mantid.simpleapi import \
     CloneWorkspace, Rebin, ConvertToDistribution, DiffractionFocussing, \
     SaveNexusProcessed, SaveAscii, DeleteWorkspace
 
+from total_scattering.profiling import profile, profiled
 
+# Serializes the NeXus writes of concurrent saves, and the reads of the
+# caches, since HDF5 is not thread-safe
+nexus_write_lock = threading.Lock()
+
+
+@profiled('save_banks', name_arg='Title')
 def save_banks(InputWorkspace, Filename, Title, OutputDir,
-               Binning=None, GroupingWorkspace=None):
+               Binning=None, GroupingWorkspace=None, NexusFiles=None):
     """
     Saves input workspace to processed NeXus file in specified
     output directory with optional rebinning and grouping
     (to coarsen) the output in a bank-by-bank manner. Mainly
-    wraps Mantid `SaveNexusProcessed` algorithm.
+    wraps Mantid `SaveNexusProcessed` algorithm, or appends to a file
+    kept open by `NexusFiles`.
 
     :param InputWorkspace: Mantid workspace to save out
     :type InputWorkspace: MatrixWorkspace
@@ -28,44 +39,197 @@ def save_banks(InputWorkspace, Filename, Title, OutputDir,
     :param GroupingWorkspace: A workspace with grouping
                               information for the output spectra
     :type GroupWorkspace: GroupWorkspace
+    :param NexusFiles: Open files to write to instead of SaveNexusProcessed
+    :type NexusFiles: ProcessedNexusFiles
+    """
+    wksp, temporary = prepare_banks(InputWorkspace, Binning, GroupingWorkspace,
+                                    Snapshot=False)
+    write_banks(wksp, Filename, Title, OutputDir, NexusFiles, temporary)
+
+
+def prepare_banks(InputWorkspace, Binning=None, GroupingWorkspace=None,
+                  Snapshot=True):
     """
+    First part of `save_banks`: rebin, group and convert the workspace to
+    distribution into a new workspace, without copying the input first
 
-    # Make a local clone
-    CloneWorkspace(InputWorkspace=InputWorkspace, OutputWorkspace="__tmp")
-    tmp_wksp = mtd["__tmp"]
+    Rebinning and grouping write straight into the (smaller) output, so
+    the input is never cloned as a whole. Only a workspace in counts that
+    is neither rebinned nor grouped is cloned, to convert it to
+    distribution. If nothing needs to change, the input itself is returned
+    unless `Snapshot` asks for a copy.
 
-    # Rebin if requested
+    :param InputWorkspace: Mantid workspace to save out
+    :type InputWorkspace: MatrixWorkspace
+    :param Binning: Optional rebinning of event workspace.
+                    See `Rebin` in Mantid for options
+    :type Binning: dbl list
+    :param GroupingWorkspace: A workspace with grouping
+                              information for the output spectra
+    :type GroupWorkspace: GroupWorkspace
+    :param Snapshot: If the result must not change with the input, as when
+                     it is written after the input is modified
+    :type Snapshot: bool
+
+    :return: The workspace to write and if it is a temporary one, that
+             `write_banks` deletes
+    :rtype: tuple
+    """
+    wksp = InputWorkspace
+    if isinstance(wksp, str):
+        wksp = mtd[wksp]
+    yunit = wksp.YUnit()
+    isEventWksp = isinstance(wksp, IEventWorkspace)
+    focus = isEventWksp and GroupingWorkspace and yunit == "Counts"
+
+    # Uniquely named, saves may run concurrently
+    tmp_name = "__tmp_{}".format(uuid.uuid4().hex)
+    source = wksp
+
+    # Rebin if requested. Events are only kept if they are grouped next:
+    # without grouping they are written as histograms anyway
     if Binning:
-        tmp_wksp = Rebin(InputWorkspace=tmp_wksp,
-                         Params=Binning,
-                         PreserveEvents=True)
+        source = Rebin(InputWorkspace=source,
+                       OutputWorkspace=tmp_name,
+                       Params=Binning,
+                       PreserveEvents=bool(focus))
 
-    # Convert to distributions to remove bin width dependence
-    yunit = tmp_wksp.YUnit()
-    if yunit == "Counts":
+    # Output to desired level of grouping
+    if focus:
+        source = DiffractionFocussing(InputWorkspace=source,
+                                      OutputWorkspace=tmp_name,
+                                      GroupingWorkspace=GroupingWorkspace,
+                                      PreserveEvents=False)
+
+    # Convert to distributions to remove bin width dependence (events
+    # cannot be converted, they are written as counts)
+    distribution = yunit == "Counts" and not isEventWksp
+    if source is wksp and (distribution or Snapshot):
+        source = CloneWorkspace(InputWorkspace=wksp, OutputWorkspace=tmp_name)
+    if distribution:
         try:
-            ConvertToDistribution(tmp_wksp)
+            ConvertToDistribution(source)
         except BaseException:
             pass
+    return source, source is not wksp
 
-    # Output to desired level of grouping
-    isEventWksp = isinstance(tmp_wksp, IEventWorkspace)
-    if isEventWksp and GroupingWorkspace and yunit == "Counts":
-        tmp_wksp = DiffractionFocussing(InputWorkspace=tmp_wksp,
-                                        GroupingWorkspace=GroupingWorkspace,
-                                        PreserveEvents=False)
 
+def write_banks(InputWorkspace, Filename, Title, OutputDir, NexusFiles=None,
+                Temporary=True):
+    """
+    Second part of `save_banks`: append the workspace from `prepare_banks`
+    to the NeXus file and delete it if it is a temporary one
+
+    :param InputWorkspace: Workspace from `prepare_banks`
+    :type InputWorkspace: MatrixWorkspace
+    :param Filename: Filename to save output
+    :type Filename: str
+    :param Title: A title to describe the saved workspace
+    :type Title: str
+    :param OutputDir: Output directory to save the processed NeXus file
+    :type OutputDir: path str
+    :param NexusFiles: Open files to write to instead of SaveNexusProcessed
+    :type NexusFiles: ProcessedNexusFiles
+    :param Temporary: If the workspace is deleted once written
+    :type Temporary: bool
+    """
     # Save out wksp to file
     filename = os.path.join(os.path.abspath(OutputDir), Filename)
-    SaveNexusProcessed(
-        InputWorkspace=tmp_wksp,
-        Filename=filename,
-        Title=Title,
-        Append=True,
-        PreserveEvents=False,
-        WorkspaceIndexList=range(
-            tmp_wksp.getNumberHistograms()))
-    DeleteWorkspace(tmp_wksp)
+    try:
+        with nexus_write_lock:
+            if NexusFiles is not None:
+                NexusFiles.write(filename, InputWorkspace, Title)
+            else:
+                SaveNexusProcessed(
+                    InputWorkspace=InputWorkspace,
+                    Filename=filename,
+                    Title=Title,
+                    Append=True,
+                    PreserveEvents=False,
+                    WorkspaceIndexList=range(
+                        InputWorkspace.getNumberHistograms()))
+    finally:
+        if Temporary:
+            DeleteWorkspace(InputWorkspace)
+
+
+class BankWriter(object):
+    """ Runs `save_banks` in a background thread
+
+    `save_banks` returns once the workspace is rebinned and grouped (or
+    copied) into a new workspace, and these snapshots are written by a
+    single writer thread, in the order they were saved, so the reduction
+    goes on while the files are written. At most `max_pending` snapshots
+    wait to be written, further saves block until the writer catches up.
+    Once a write fails, the following snapshots are dropped and the error
+    is raised by the next call.
+
+    :param max_pending: Maximum number of snapshots waiting to be written
+    :type max_pending: int
+    """
+
+    def __init__(self, max_pending=4):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._write, name="BankWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                wksp, kwargs = job
+                if self._error is not None:
+                    DeleteWorkspace(wksp)  # failed already, just drop
+                    continue
+                with profile('save_banks', kwargs['Title']):
+                    write_banks(wksp, **kwargs)
+            except BaseException as e:
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    def save_banks(self, InputWorkspace, Filename, Title, OutputDir,
+                   Binning=None, GroupingWorkspace=None, NexusFiles=None):
+        """ Queue a workspace to be written like `save_banks` does
+
+        Raises the error of an earlier write, if any.
+        """
+        self._raise_error()
+        with profile('save_banks_snapshot', Title):
+            wksp, _ = prepare_banks(InputWorkspace, Binning,
+                                    GroupingWorkspace, Snapshot=True)
+        self._queue.put((wksp, {'Filename': Filename,
+                                'Title': Title,
+                                'OutputDir': OutputDir,
+                                'NexusFiles': NexusFiles}))
+
+    def flush(self):
+        """ Wait until every queued workspace is written
+
+        Raises the error of a failed write, if any.
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """ Write the queued workspaces and stop the writer thread
+
+        Raises the error of a failed write, if any.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
 
 
 def save_file(ws, filename, header=None):
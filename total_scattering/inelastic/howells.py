@@ -0,0 +1,221 @@
+from __future__ import (absolute_import, division, print_function)
+
+import json
+import os
+import threading
+
+import numpy as np
+from scipy import optimize, special
+
+# Parameters of the Howells function, in order
+HOWELLS_PARAMETERS = ['phi_max', 'phi_epi', 'lam_t', 'lam_1', 'lam_2', 'a']
+
+# Initial guess when no fitted parameters are known
+DEFAULT_GUESS = [1., 1., 1., 0., 1., 1.]
+
+
+def _howellsShapes(lambdas, lam_t, lam_1, lam_2, a):
+    """ Thermal (Maxwellian) and epithermal terms of the Howells function
+    for unit fluxes, and the cutoff of the epithermal term """
+    maxwellian = (lam_t ** 4. / lambdas ** 5.) \
+        * np.exp(-(lam_t / lambdas) ** 2.)
+    u = (lambdas - lam_1) / lam_2
+    cutoff = special.expit(-u)  # 1 / (1 + exp(u)), without overflow
+    epithermal = cutoff / lambdas ** (1. + 2. * a)
+    return maxwellian, epithermal, u, cutoff
+
+
+def howellsFunction(lambdas, phi_max, phi_epi, lam_t, lam_1, lam_2, a):
+    """ Incident spectrum of a moderator, from Howells et al.
+
+    :param lambdas: Wavelengths
+    :type lambdas: numpy.array
+
+    :return: Incident spectrum
+    :rtype: numpy.array
+    """
+    maxwellian, epithermal, _, _ = _howellsShapes(
+        lambdas, lam_t, lam_1, lam_2, a)
+    return phi_max * maxwellian + phi_epi * epithermal
+
+
+def howellsDerivative(lambdas, phi_max, phi_epi, lam_t, lam_1, lam_2, a):
+    """ First derivative of the Howells function in wavelength
+
+    :param lambdas: Wavelengths
+    :type lambdas: numpy.array
+
+    :return: Derivative of the incident spectrum
+    :rtype: numpy.array
+    """
+    maxwellian, epithermal, _, cutoff = _howellsShapes(
+        lambdas, lam_t, lam_1, lam_2, a)
+    return phi_max * maxwellian \
+        * (2. * lam_t ** 2. / lambdas ** 3. - 5. / lambdas) \
+        - phi_epi * epithermal \
+        * ((1. + 2. * a) / lambdas + (1. - cutoff) / lam_2)
+
+
+def howellsJacobian(lambdas, phi_max, phi_epi, lam_t, lam_1, lam_2, a):
+    """ Derivatives of the Howells function with respect to its parameters
+
+    :param lambdas: Wavelengths
+    :type lambdas: numpy.array
+
+    :return: Jacobian, one column per parameter of HOWELLS_PARAMETERS
+    :rtype: numpy.array
+    """
+    maxwellian, epithermal, u, cutoff = _howellsShapes(
+        lambdas, lam_t, lam_1, lam_2, a)
+    d_lam_t = phi_max * maxwellian * (4. / lam_t - 2. * lam_t / lambdas ** 2.)
+    d_lam_1 = phi_epi * epithermal * (1. - cutoff) / lam_2
+    d_lam_2 = d_lam_1 * u
+    d_a = -2. * phi_epi * epithermal * np.log(lambdas)
+    return np.stack(np.broadcast_arrays(
+        maxwellian, epithermal, d_lam_t, d_lam_1, d_lam_2, d_a), axis=-1)
+
+
+def fitHowells(x_fit, y_fit, p0=None, maxfev=2000):
+    """ Least-squares fit of the Howells function, with its analytic
+    Jacobian
+
+    :param x_fit: Wavelengths
+    :type x_fit: numpy.array
+    :param y_fit: Incident spectrum
+    :type y_fit: numpy.array
+    :param p0: Initial parameters (ie fitted earlier), DEFAULT_GUESS if None
+    :type p0: list
+    :param maxfev: Maximum number of function evaluations
+    :type maxfev: int
+
+    :return: Fitted parameters, in the order of HOWELLS_PARAMETERS
+    :rtype: numpy.array
+    """
+    guesses = [DEFAULT_GUESS] if p0 is None else [p0, DEFAULT_GUESS]
+    for guess in guesses:
+        try:
+            params, _ = optimize.curve_fit(
+                howellsFunction, x_fit, y_fit, guess, jac=howellsJacobian,
+                maxfev=maxfev)
+            return params
+        except RuntimeError:
+            if guess is guesses[-1]:
+                raise
+
+
+def fitHowellsBatch(x_fit, y_fits, p0=None, maxfev=2000):
+    """ Fit the Howells function to many spectra, one after the other, with
+    its analytic Jacobian
+
+    Each spectrum is fitted by `scipy.optimize.least_squares` (the
+    Levenberg-Marquardt method, as `fitHowells`). Fits that do not converge
+    within `maxfev` evaluations keep their last parameters, those starting
+    from non-finite values keep their initial parameters.
+
+    :param x_fit: Wavelengths shared by the spectra
+    :type x_fit: numpy.array
+    :param y_fits: Incident spectra, shape (spectra, wavelengths)
+    :type y_fits: numpy.array
+    :param p0: Initial parameters, for all the spectra or one row each,
+               DEFAULT_GUESS if None
+    :type p0: numpy.array
+    :param maxfev: Maximum number of function evaluations per spectrum
+    :type maxfev: int
+
+    :return: Fitted parameters, shape (spectra, 6), and whether each fit
+             converged
+    :rtype: tuple
+    """
+    x_fit = np.asarray(x_fit, dtype=np.float64)
+    y_fits = np.atleast_2d(np.asarray(y_fits, dtype=np.float64))
+    if p0 is None:
+        p0 = DEFAULT_GUESS
+    params = np.array(np.broadcast_to(p0, (len(y_fits), 6)),
+                      dtype=np.float64)
+    converged = np.zeros(len(y_fits), dtype=bool)
+
+    def jacobian(params, y_fit):
+        return howellsJacobian(x_fit, *params)
+
+    def residuals(params, y_fit):
+        return howellsFunction(x_fit, *params) - y_fit
+
+    for row, y_fit in enumerate(y_fits):
+        try:
+            with np.errstate(all='ignore'):
+                result = optimize.least_squares(
+                    residuals, params[row], jac=jacobian, method='lm',
+                    max_nfev=maxfev, args=(y_fit,))
+        except ValueError:  # residuals not finite at the initial parameters
+            continue
+        params[row] = result.x
+        converged[row] = result.success
+    return params, converged
+
+
+class HowellsWarmStarts(object):
+    """ Howells function parameters fitted earlier, per instrument and
+    moderator, used as the initial guess of the next fit
+
+    The parameters are kept in a JSON file, so a fit of a new run starts
+    from those of the runs reduced before it, and so depends on them within
+    the fit tolerance. Reductions running at the same time share the file,
+    the last one to store its parameters wins.
+
+    :param filename: JSON file of the parameters
+    :type filename: str
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(instrument, moderator=None):
+        """ Key of an instrument and moderator in the file """
+        return '{}/{}'.format(instrument, moderator or 'default')
+
+    def _read(self):
+        try:
+            with open(self.filename, 'r') as handle:
+                return json.load(handle)
+        except (IOError, OSError, ValueError):
+            return dict()
+
+    def get(self, instrument, moderator=None):
+        """ Parameters fitted last for an instrument and moderator
+
+        :param instrument: Instrument name
+        :type instrument: str
+        :param moderator: Moderator name
+        :type moderator: str
+
+        :return: Parameters, or None if none were stored
+        :rtype: list or None
+        """
+        with self._lock:
+            return self._read().get(self.key(instrument, moderator))
+
+    def update(self, instrument, moderator, params):
+        """ Store the parameters fitted for an instrument and moderator
+
+        :param instrument: Instrument name
+        :type instrument: str
+        :param moderator: Moderator name
+        :type moderator: str
+        :param params: Fitted parameters, in the order of HOWELLS_PARAMETERS
+        :type params: list
+        """
+        params = [float(value) for value in params]
+        if not np.all(np.isfinite(params)):
+            return
+        with self._lock:
+            stored = self._read()
+            stored[self.key(instrument, moderator)] = params
+            directory = os.path.dirname(self.filename)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp_filename = '{}.tmp{}'.format(self.filename, os.getpid())
+            with open(tmp_filename, 'w') as handle:
+                json.dump(stored, handle, indent=2, sort_keys=True)
+            os.rename(tmp_filename, self.filename)
@@ -1,17 +1,43 @@
+import os
+import re
+
+import h5py
 import numpy as np
-from scipy import signal, ndimage, interpolate, optimize
+from scipy import signal, ndimage, interpolate
 
 from mantid import mtd
+from mantid.api import FileFinder
+from mantid.kernel import Logger
 from mantid.simpleapi import (
     ConvertToPointData,
     ConvertUnits,
     CreateWorkspace,
+    DeleteWorkspace,
     LoadNexusMonitors,
     Rebin,
     ResampleX,
     SplineSmoothing,
 )
 
+from total_scattering.inelastic.howells import \
+    fitHowells, \
+    fitHowellsBatch, \
+    howellsDerivative, \
+    howellsFunction
+
+# Default wavelength binning of the monitor spectra (min, bins, max)
+MONITOR_BINNING = ".1,6000,2.9"
+
+# Planck constant / neutron mass in Angstrom * meter / microsecond, so that
+# wavelength = NEUTRON_WAVELENGTH_TOF * time-of-flight / flight path
+NEUTRON_WAVELENGTH_TOF = 3.956034e-3
+
+# Time-of-flight units of the monitor arrays, in microseconds
+TOF_UNITS = {'microsecond': 1., 'microseconds': 1., 'us': 1.,
+             'nanosecond': 1e-3, 'nanoseconds': 1e-3, 'ns': 1e-3,
+             'millisecond': 1e3, 'milliseconds': 1e3, 'ms': 1e3,
+             'second': 1e6, 'seconds': 1e6, 's': 1e6}
+
 # Functions for fitting the incident spectrum
 
 
@@ -48,46 +74,20 @@ def fitCubicSplineViaMantidSplineSmoothing(InputWorkspace, Params, **kwargs):
     return mtd['fit'].readY(0), mtd['fit_prime_1'].readY(0)
 
 
-def fitHowellsFunction(x_fit, y_fit, x):
+def fitHowellsFunction(x_fit, y_fit, x, p0=None):
     # Fit with analytical function from HowellsEtAl
-    def calc_HowellsFunction(
-            lambdas,
-            phi_max,
-            phi_epi,
-            lam_t,
-            lam_1,
-            lam_2,
-            a):
-        term1 = phi_max * ((lam_t**4.) / lambdas**5.) * \
-            np.exp(-(lam_t / lambdas)**2.)
-        term2 = (phi_epi / (lambdas**(1. + 2. * a))) * \
-            (1. / (1 + np.exp((lambdas - lam_1) / lam_2)))
-        return term1 + term2
-
-    def calc_HowellsFunction1stDerivative(
-            lambdas, phi_max, phi_epi, lam_t, lam_1, lam_2, a):
-        term1 = (((2 * lam_t**2) / lambdas**2) - 5.) * (1. / lambdas) \
-            * phi_max * ((lam_t**4.) / lambdas**5.) \
-            * np.exp(-(lam_t / lambdas)**2.)
-        term2 = ((1 + 2 * a) / lambdas) \
-            * (1. / lambdas) * (phi_epi / (lambdas ** (1. + 2. * a))) \
-            * (1. / (1 + np.exp((lambdas - lam_1) / lam_2)))
-        return term1 + term2
-
-    params = [1., 1., 1., 0., 1., 1.]
-    params, convergence = optimize.curve_fit(
-        calc_HowellsFunction, x_fit, y_fit, params)
-    fit = calc_HowellsFunction(x, *params)
-    fit_prime = calc_HowellsFunction1stDerivative(x, *params)
+    params = fitHowells(x_fit, y_fit, p0)
+    fit = howellsFunction(x, *params)
+    fit_prime = howellsDerivative(x, *params)
     return fit, fit_prime
 
 
 def fitCubicSplineWithGaussConv(x_fit, y_fit, x, sigma=3):
     # Fit with Cubic Spline using a Gaussian Convolution to get weights
     def moving_average(y, sigma=sigma):
-        b = signal.gaussian(39, sigma)
-        average = ndimage.filters.convolve1d(y, b / b.sum())
-        var = ndimage.filters.convolve1d(np.power(y - average, 2), b / b.sum())
+        b = signal.windows.gaussian(39, sigma)
+        average = ndimage.convolve1d(y, b / b.sum())
+        var = ndimage.convolve1d(np.power(y - average, 2), b / b.sum())
         return average, var
 
     avg, var = moving_average(y_fit)
@@ -98,6 +98,197 @@ def fitCubicSplineWithGaussConv(x_fit, y_fit, x, sigma=3):
     return fit, fit_prime
 
 
+def gaussianSmooth(y, sigma):
+    """ Gaussian smoothing through the FFT, with the ends reflected as
+    `ndimage.convolve1d` does
+
+    :param y: Values on a uniform grid
+    :type y: numpy.array
+    :param sigma: Standard deviation of the Gaussian, in grid points
+    :type sigma: float
+
+    :return: Smoothed values
+    :rtype: numpy.array
+    """
+    pad = min(len(y) - 1, int(np.ceil(4. * sigma)))
+    padded = np.pad(y, pad, mode='symmetric')
+    # Sampled Gaussian, centered on the first point and wrapped around
+    distance = np.fft.fftfreq(len(padded)) * len(padded)
+    kernel = np.exp(-0.5 * (distance / sigma) ** 2)
+    transfer = np.fft.rfft(kernel / kernel.sum())
+    smoothed = np.fft.irfft(np.fft.rfft(padded) * transfer, len(padded))
+    return smoothed[pad:pad + len(y)]
+
+
+def evaluateCubicSpline(spline, x):
+    """ Values and first derivative of a cubic B-spline, sharing the search
+    of the knot interval of each point
+
+    :param spline: Cubic spline
+    :type spline: scipy.interpolate.BSpline
+    :param x: Points to evaluate at, extrapolated outside of the knots
+    :type x: numpy.array
+
+    :return: Values and first derivative
+    :rtype: tuple
+    """
+    knots = spline.t
+    coefficients = interpolate.PPoly.from_spline(spline).c
+    interval = np.clip(np.searchsorted(knots, x, side='right') - 1,
+                       3, len(knots) - 5)
+    c0, c1, c2, c3 = coefficients[:, interval]
+    d = x - knots[interval]
+    fit = ((c0 * d + c1) * d + c2) * d + c3
+    fit_prime = (3. * c0 * d + 2. * c1) * d + c2
+    return fit, fit_prime
+
+
+def fitLSQSplineWithGaussConv(x_fit, y_fit, x, sigma=2, knots=None):
+    """ Fit with a least-squares cubic spline on fixed knots, weighted by
+    the local scatter of the data about its Gaussian smoothing
+
+    The weights are those of `fitCubicSplineWithGaussConv`, but the
+    smoothing goes through the FFT and the spline has a fixed number of
+    knots placed evenly among the data, so the cost of the fit does not
+    depend on the noise.
+
+    :param x_fit: Wavelengths of the data, on a uniform grid
+    :type x_fit: numpy.array
+    :param y_fit: Incident spectrum
+    :type y_fit: numpy.array
+    :param x: Wavelengths to evaluate the fit at
+    :type x: numpy.array
+    :param sigma: Width of the smoothing, in points of `x_fit`
+    :type sigma: float
+    :param knots: Number of interior knots, at most 30 by default
+    :type knots: int
+
+    :return: Fit and its first derivative at `x`
+    :rtype: tuple
+    """
+    x_fit = np.asarray(x_fit, dtype=np.float64)
+    y_fit = np.asarray(y_fit, dtype=np.float64)
+    average = gaussianSmooth(y_fit, sigma)
+    var = gaussianSmooth((y_fit - average) ** 2, sigma)
+    var = np.maximum(var, np.finfo(np.float64).eps * max(var.max(), 1.))
+
+    if knots is None:
+        knots = min(30, len(x_fit) // 2)
+    # Knots at quantiles of the data leave points in every knot interval
+    interior = np.quantile(x_fit, np.linspace(0., 1., knots + 2)[1:-1])
+    t = np.concatenate([[x_fit[0]] * 4, interior, [x_fit[-1]] * 4])
+    spline = interpolate.make_lsq_spline(x_fit, y_fit, t, k=3,
+                                         w=1. / np.sqrt(var))
+    return evaluateCubicSpline(spline, np.asarray(x, dtype=np.float64))
+
+
+# Read monitors straight from the NeXus file
+
+def getWavelengthEdges(Binning, BinType="ResampleX"):
+    """ Wavelength bin edges, as made by ResampleX or Rebin
+
+    :param Binning: "min,bins,max" for ResampleX (log bins if bins < 0) or
+                    "min,step,max" for Rebin (log bins if step < 0)
+    :type Binning: str
+    :param BinType: ResampleX or Rebin
+    :type BinType: str
+
+    :return: Bin edges
+    :rtype: numpy.array
+    """
+    lambdaMin, lambdaBinning, lambdaMax = [float(x) for x in Binning.split(',')]
+    if BinType == 'ResampleX':
+        bins = abs(int(lambdaBinning))
+        if int(lambdaBinning) < 0:
+            return np.geomspace(lambdaMin, lambdaMax, bins + 1)
+        return np.linspace(lambdaMin, lambdaMax, bins + 1)
+    if BinType != 'Rebin':
+        raise RuntimeError("Unknown BinType '{}'".format(BinType))
+    if lambdaBinning > 0.:
+        edges = np.arange(lambdaMin, lambdaMax, lambdaBinning)
+    else:
+        bins = np.ceil(np.log(lambdaMax / lambdaMin)
+                       / np.log1p(-lambdaBinning))
+        edges = lambdaMin * (1. - lambdaBinning) ** np.arange(bins)
+        edges = edges[edges < lambdaMax]
+    # As Rebin, a last bin narrower than a quarter of the one before it is
+    # merged into it
+    if len(edges) > 1 and (lambdaMax - edges[-1]) \
+            < 0.25 * (edges[-1] - edges[-2]):
+        edges = edges[:-1]
+    return np.append(edges, lambdaMax)
+
+
+def _tofScale(dataset):
+    """ Factor converting a time-of-flight dataset to microseconds """
+    units = dataset.attrs.get('units', b'microsecond')
+    if isinstance(units, bytes):
+        units = units.decode()
+    try:
+        return TOF_UNITS[str(units).strip()]
+    except KeyError:
+        raise RuntimeError("Unknown time-of-flight units '{}'".format(units))
+
+
+def _monitorGroups(entry):
+    """ NXmonitor groups of an entry, in the order of their numbers """
+    def number(name):
+        return [int(part) if part.isdigit() else part
+                for part in re.split(r'(\d+)', name)]
+
+    names = list()
+    for name, group in entry.items():
+        nx_class = group.attrs.get('NX_class', b'')
+        if isinstance(nx_class, bytes):
+            nx_class = nx_class.decode()
+        if nx_class == 'NXmonitor':
+            names.append(name)
+    return [entry[name] for name in sorted(names, key=number)]
+
+
+def readMonitorSpectrum(Filename, edges, MonitorIndex=0, L1=None):
+    """ Histogram a monitor of a raw NeXus file in wavelength
+
+    Reads the monitor events (`event_time_offset`) or histogram (`data` and
+    `time_of_flight`) with h5py. The wavelength edges are converted to
+    time-of-flight with the flight path from the moderator to the monitor,
+    L1 plus the `distance` of the monitor to the sample, so events are
+    binned without converting each of them. Histograms are rebinned
+    assuming the counts are spread evenly within their bins, as Rebin does.
+
+    :param Filename: Path to the NeXus file
+    :type Filename: str
+    :param edges: Wavelength bin edges
+    :type edges: numpy.array
+    :param MonitorIndex: Index of the monitor, in the order of their names
+    :type MonitorIndex: int
+    :param L1: Moderator to sample distance in meters, read from
+               `instrument/moderator/distance` if None
+    :type L1: float
+
+    :return: Counts in each wavelength bin
+    :rtype: numpy.array
+    """
+    with h5py.File(Filename, 'r') as handle:
+        entry = handle[list(handle.keys())[0]]
+        if L1 is None:
+            L1 = abs(float(entry['instrument/moderator/distance'][()]))
+        monitor = _monitorGroups(entry)[MonitorIndex]
+        flight_path = L1 + float(np.ravel(monitor['distance'][()])[0])
+        tof_edges = np.asarray(edges) * flight_path / NEUTRON_WAVELENGTH_TOF
+
+        if 'event_time_offset' in monitor:
+            tof = monitor['event_time_offset']
+            tof_edges = tof_edges / _tofScale(tof)
+            return np.histogram(tof[()], bins=tof_edges)[0].astype(np.float64)
+
+        tof = monitor['time_of_flight']
+        data_edges = tof[()] * _tofScale(tof)
+        counts = np.ravel(monitor['data'][()]).astype(np.float64)
+    cumulative = np.concatenate([[0.], np.cumsum(counts)])
+    return np.diff(np.interp(tof_edges, data_edges, cumulative))
+
+
 # Get incident spectrum from Monitor
 
 def GetIncidentSpectrumFromMonitor(
@@ -105,20 +296,82 @@ def GetIncidentSpectrumFromMonitor(
         OutputWorkspace="IncidentWorkspace",
         IncidentIndex=0,
         TransmissionIndex=1,
-        Binning=".1,6000,2.9",
-        BinType="ResampleX"):
+        Binning=MONITOR_BINNING,
+        BinType="ResampleX",
+        L1=None,
+        ReadWithH5py=True):
+    """ Incident spectrum in wavelength from the monitor of a run,
+    corrected for the efficiency of the 3He beam monitor
+
+    The monitor is read and histogrammed directly from the NeXus file
+    unless `ReadWithH5py` is False or the file does not have the monitor
+    layout expected (ie no `distance`), in which case it is loaded with
+    LoadNexusMonitors and binned with Mantid algorithms.
+
+    :param Filename: Run name or path to the NeXus file
+    :type Filename: str
+    :param OutputWorkspace: Name of the incident spectrum
+    :type OutputWorkspace: str
+    :param IncidentIndex: Index of the incident beam monitor
+    :type IncidentIndex: int
+    :param TransmissionIndex: Index of the transmission monitor (unused)
+    :type TransmissionIndex: int
+    :param Binning: Wavelength binning, see `getWavelengthEdges`
+    :type Binning: str
+    :param BinType: ResampleX or Rebin
+    :type BinType: str
+    :param L1: Moderator to sample distance in meters for the direct read,
+               taken from the file if None
+    :type L1: float
+    :param ReadWithH5py: Read the monitor directly from the file
+    :type ReadWithH5py: bool
+
+    :return: The incident spectrum, as point data
+    :rtype: MatrixWorkspace
+    """
+    lam, bm = None, None
+    if ReadWithH5py:
+        try:
+            path = Filename
+            if not os.path.isfile(path):
+                path = FileFinder.findRuns(Filename)[0]
+            edges = getWavelengthEdges(Binning, BinType)
+            bm = readMonitorSpectrum(path, edges, IncidentIndex, L1)
+            lam = 0.5 * (edges[:-1] + edges[1:])
+        except (IOError, OSError, KeyError, IndexError, RuntimeError,
+                ValueError) as error:
+            msg = "Could not read the monitor of '{}' directly ({}), " \
+                  "loading it with LoadNexusMonitors"
+            Logger('GetIncidentSpectrumFromMonitor').notice(
+                msg.format(Filename, error))
+    if bm is None:
+        lam, bm = _loadMonitorSpectrum(Filename, IncidentIndex, Binning,
+                                       BinType)
 
     # -------------------------------------------------
     # Joerg's read_bm.pro code
+    p = 0.000794807                       # Pressure
+    thickness = .1                        # 1 mm = .1 cm
+    abs_xs_3He = 5333.0                   # barns for lambda == 1.798 A
+    p_to_rho = 2.43e-5                    # pressure to rho (atoms/angstroms^3)
+    # p is set to give efficiency of 1.03 10^-5 at 1.8 A
+    e0 = abs_xs_3He * lam / 1.798 * p_to_rho * p * thickness
+    bmeff = bm / (1. - np.exp(-e0))      # neutron counts / microsecond
+    # bmeff = bmeff / constants.micro      # neutron counts / second
+
+    CreateWorkspace(DataX=lam, DataY=bmeff,
+                    OutputWorkspace=OutputWorkspace, UnitX='Wavelength')
+    mtd[OutputWorkspace].setYUnit('Counts')
+    return mtd[OutputWorkspace]
+
 
-    # Loop workspaces to get each incident spectrum
+def _loadMonitorSpectrum(Filename, IncidentIndex, Binning, BinType):
+    """ Monitor spectrum in wavelength, loaded and binned with Mantid """
     monitor = 'monitor'
     LoadNexusMonitors(Filename=Filename, OutputWorkspace=monitor)
     ConvertUnits(InputWorkspace=monitor, OutputWorkspace=monitor,
                  Target='Wavelength', EMode='Elastic')
     lambdaMin, lambdaBinning, lambdaMax = [float(x) for x in Binning.split(',')]
-    for x in [lambdaMin, lambdaBinning, lambdaMax]:
-        print(x, type(x))
     if BinType == 'ResampleX':
         ResampleX(InputWorkspace=monitor,
                   OutputWorkspace=monitor,
@@ -134,46 +387,68 @@ def GetIncidentSpectrumFromMonitor(
               PreserveEvents=True)
     ConvertToPointData(InputWorkspace=monitor, OutputWorkspace=monitor)
 
-    lam = mtd[monitor].readX(IncidentIndex)    # wavelength in A
-    bm = mtd[monitor].readY(IncidentIndex)     # neutron counts / microsecond
-    p = 0.000794807                       # Pressure
-    thickness = .1                        # 1 mm = .1 cm
-    abs_xs_3He = 5333.0                   # barns for lambda == 1.798 A
-    p_to_rho = 2.43e-5                    # pressure to rho (atoms/angstroms^3)
-    # p is set to give efficiency of 1.03 10^-5 at 1.8 A
-    e0 = abs_xs_3He * lam / 1.798 * p_to_rho * p * thickness
-    print('Efficiency:', 1. - np.exp(-e0))
-    bmeff = bm / (1. - np.exp(-e0))      # neutron counts / microsecond
-    print(bmeff)
-    # bmeff = bmeff / constants.micro      # neutron counts / second
+    lam = np.array(mtd[monitor].readX(IncidentIndex))    # wavelength in A
+    bm = np.array(mtd[monitor].readY(IncidentIndex))     # neutron counts
+    DeleteWorkspace(monitor)
+    return lam, bm
 
-    CreateWorkspace(DataX=lam, DataY=bmeff,
-                    OutputWorkspace=OutputWorkspace, UnitX='Wavelength')
-    mtd[OutputWorkspace].setYUnit('Counts')
-    return mtd[OutputWorkspace]
+
+def _calcWavelengths(incident_ws, BinningForCalc, incident_index=0):
+    """ Wavelengths the fit is evaluated at, either from BinningForCalc or
+    those of the incident spectrum """
+    if BinningForCalc is None:
+        return np.array(incident_ws.readX(incident_index))
+    try:
+        params = [float(x) for x in BinningForCalc.split(',')]
+    except AttributeError:
+        params = [float(x) for x in BinningForCalc]
+    xlo, binsize, xhi = params
+    return np.arange(xlo, xhi, binsize)
 
 
 def FitIncidentSpectrum(InputWorkspace, OutputWorkspace,
                         FitSpectrumWith='GaussConvCubicSpline',
                         BinningForFit="0.15,0.05,3.2",
                         BinningForCalc=None,
-                        PlotDiagnostics=False):
+                        PlotDiagnostics=False,
+                        WarmStarts=None,
+                        Instrument=None,
+                        Moderator=None):
+    """ Fit the incident spectrum and its derivative
+
+    With `HowellsFunction`, `WarmStarts` (a `HowellsWarmStarts`) starts the
+    fit from the parameters fitted last for the instrument and moderator,
+    and stores the new ones.
+
+    :param InputWorkspace: Incident spectrum
+    :type InputWorkspace: str
+    :param OutputWorkspace: Name of the fit (spectrum 0) and its derivative
+                            (spectrum 1)
+    :type OutputWorkspace: str
+    :param FitSpectrumWith: Fitting method
+    :type FitSpectrumWith: str
+    :param BinningForFit: Wavelength binning the spectrum is fitted on
+    :type BinningForFit: str
+    :param BinningForCalc: Wavelength binning of the fit, those of the
+                           incident spectrum if None
+    :type BinningForCalc: str
+    :param WarmStarts: Howells function parameters fitted earlier
+    :type WarmStarts: HowellsWarmStarts
+    :param Instrument: Instrument name for the warm starts
+    :type Instrument: str
+    :param Moderator: Moderator name for the warm starts
+    :type Moderator: str
 
+    :return: The fit and its derivative
+    :rtype: MatrixWorkspace
+    """
     incident_ws = mtd[InputWorkspace]
 
     # Fit Incident Spectrum
     # Get axis for actual calc (either provided in BinningForCalc or extracted
     # from incident wksp)
     incident_index = 0
-    if BinningForCalc is None:
-        x = incident_ws.readX(incident_index)
-    else:
-        try:
-            params = [float(x) for x in BinningForCalc.split(',')]
-        except AttributeError:
-            params = [float(x) for x in BinningForCalc]
-        xlo, binsize, xhi = params
-        x = np.arange(xlo, xhi, binsize)
+    x = _calcWavelengths(incident_ws, BinningForCalc, incident_index)
 
     Rebin(
         incident_ws,
@@ -189,9 +464,18 @@ def FitIncidentSpectrum(InputWorkspace, OutputWorkspace,
         fit, fit_prime = fitCubicSplineViaMantidSplineSmoothing(
             InputWorkspace, Params=BinningForFit, MaxNumberOfBreaks=8)
     elif FitSpectrumWith == 'HowellsFunction':
-        fit, fit_prime = fitHowellsFunction(x_fit, y_fit, x)
+        p0 = None
+        if WarmStarts is not None:
+            p0 = WarmStarts.get(Instrument, Moderator)
+        params = fitHowells(x_fit, y_fit, p0)
+        if WarmStarts is not None:
+            WarmStarts.update(Instrument, Moderator, params)
+        fit = howellsFunction(x, *params)
+        fit_prime = howellsDerivative(x, *params)
     elif FitSpectrumWith == 'GaussConvCubicSpline':
         fit, fit_prime = fitCubicSplineWithGaussConv(x_fit, y_fit, x, sigma=2)
+    elif FitSpectrumWith == 'GaussConvLSQSpline':
+        fit, fit_prime = fitLSQSplineWithGaussConv(x_fit, y_fit, x, sigma=2)
     else:
         raise Exception("Unknown method for fitting incident spectrum")
         return
@@ -206,3 +490,58 @@ def FitIncidentSpectrum(InputWorkspace, OutputWorkspace,
         NSpec=2,
         Distribution=False)
     return mtd[OutputWorkspace]
+
+
+def FitHowellsSpectra(InputWorkspace, OutputWorkspace,
+                      BinningForFit="0.15,0.05,3.2",
+                      BinningForCalc=None,
+                      InitialParameters=None):
+    """ Fit the Howells function to every spectrum of a workspace, ie the
+    incident spectra of event-filtered slices of a run, read and written
+    in one pass
+
+    :param InputWorkspace: Incident spectra, sharing their wavelengths
+    :type InputWorkspace: str
+    :param OutputWorkspace: Name of the fits and derivatives, spectra 2i and
+                            2i+1 for spectrum i as in FitIncidentSpectrum
+    :type OutputWorkspace: str
+    :param BinningForFit: Wavelength binning the spectra are fitted on
+    :type BinningForFit: str
+    :param BinningForCalc: Wavelength binning of the fits, those of the
+                           incident spectra if None
+    :type BinningForCalc: str
+    :param InitialParameters: Initial Howells parameters, for all the
+                              spectra or one row each
+    :type InitialParameters: numpy.array
+
+    :return: The fitted parameters, shape (spectra, 6), and whether each fit
+             converged
+    :rtype: tuple
+    """
+    incident_ws = mtd[InputWorkspace]
+    x = _calcWavelengths(incident_ws, BinningForCalc)
+
+    fit_ws = '__{}_fit'.format(OutputWorkspace)
+    Rebin(
+        incident_ws,
+        OutputWorkspace=fit_ws,
+        Params=BinningForFit,
+        PreserveEvents=True)
+    x_fit = np.array(mtd[fit_ws].readX(0))
+    y_fits = mtd[fit_ws].extractY()
+    DeleteWorkspace(fit_ws)
+
+    params, converged = fitHowellsBatch(x_fit, y_fits, InitialParameters)
+    columns = [column[:, np.newaxis] for column in params.T]
+    fits = np.empty((2 * len(params), len(x)))
+    fits[0::2] = howellsFunction(x, *columns)
+    fits[1::2] = howellsDerivative(x, *columns)
+
+    CreateWorkspace(
+        DataX=x,
+        DataY=fits.ravel(),
+        OutputWorkspace=OutputWorkspace,
+        UnitX='Wavelength',
+        NSpec=len(fits),
+        Distribution=False)
+    return params, converged
@@ -1,10 +1,12 @@
 import sys
 import json
 import collections
+import threading
 import numpy as np
 import scipy
 from mantid import mtd
 from mantid.simpleapi import \
+    CreateDetectorTable, \
     CreateWorkspace, \
     Load, \
     SetSampleMaterial
@@ -13,6 +15,16 @@ from total_scattering.inelastic.incident_spectrum import \
     FitIncidentSpectrum, GetIncidentSpectrumFromMonitor
 
 
+# Number of values of the correction computed at once, so that a block of
+# it is all that is held besides the output, ie for every pixel of an
+# instrument (128 MB)
+CHUNK_VALUES = 2 ** 24
+
+# Species of the materials seen so far, by formula and number density
+_material_properties = dict()
+_material_lock = threading.Lock()
+
+
 # -------------------------------------------------------------------------
 # Placzek - 1st order inelastic correction
 def GetLogBinning(start, stop, num=100):
@@ -38,42 +50,182 @@ def ConvertQToLambda(q, angle):
     return lam
 
 
-def GetSampleSpeciesInfo(InputWorkspace):
-    # get sample information: mass, total scattering length, and concentration
-    # of each species
-    total_stoich = 0.0
-    material = mtd[InputWorkspace].sample().getMaterial().chemicalFormula()
-    atom_species = collections.OrderedDict()
-    for atom, stoich in zip(material[0], material[1]):
-        print(atom.neutron()['tot_scatt_length'])
+class MaterialProperties(object):
+    """ Stoichiometry, concentration, mass and <b^2> of each species of a
+    material, as arrays in the order of its chemical formula
 
-        # <b^2> == scatter_xsection / 4*pi (in barns)
-        material = mtd[InputWorkspace].sample().getMaterial()
-        b_sqrd_bar = material.totalScatterXSection() / (4. * np.pi)
+    :param material: Material of a sample
+    :type material: mantid.kernel.Material
+    """
 
-        atom_species[atom.symbol] = {'mass': atom.mass,
-                                     'stoich': stoich,
-                                     'b_sqrd_bar': b_sqrd_bar}
-        total_stoich += stoich
+    def __init__(self, material):
+        atoms, stoich = material.chemicalFormula()
+        self.symbols = [atom.symbol for atom in atoms]
+        self.masses = np.array([atom.mass for atom in atoms])
+        self.stoich = np.asarray(stoich, dtype=np.float64)
+        self.concentrations = self.stoich / self.stoich.sum()
 
-    for atom, props in atom_species.items(
-    ):  # inefficient in py2, but works with py3
-        props['concentration'] = props['stoich'] / total_stoich
+        # <b^2> == scatter_xsection / 4*pi (in barns), of the material
+        self.b_sqrd_bar = np.full(
+            len(atoms), material.totalScatterXSection() / (4. * np.pi))
 
-    return atom_species
+    def elastic_self_term(self):
+        """ Elastic self-scattering, sum of c <b^2> over the species """
+        return float(np.dot(self.concentrations, self.b_sqrd_bar))
 
+    def placzek_summation_term(self, neutron_mass):
+        """ Sum of c <b^2> m_n / M over the species
 
-def CalculateElasticSelfScattering(InputWorkspace):
+        :param neutron_mass: Neutron mass, in the units of the masses (amu)
+        :type neutron_mass: float
+        """
+        return float(np.sum(self.concentrations * self.b_sqrd_bar
+                            * neutron_mass / self.masses))
 
-    atom_species = GetSampleSpeciesInfo(InputWorkspace)
 
-    # calculate elastic self-scattering term
-    elastic_self_term = 0.0
-    for species, props in atom_species.items(
-    ):  # inefficient in py2, but works with py3
-        elastic_self_term += props['concentration'] * props['b_sqrd_bar']
+def GetMaterialProperties(InputWorkspace):
+    """ Species of the sample material of a workspace, computed once per
+    chemical formula, density and cross sections for the whole process (ie
+    shared by the sample, the vanadium and the reductions of a batch)
+
+    :param InputWorkspace: Workspace with a sample material
+    :type InputWorkspace: str
+
+    :return: The species of the material
+    :rtype: MaterialProperties
+    """
+    material = mtd[str(InputWorkspace)].sample().getMaterial()
+    # The number density follows from the formula and the mass density, the
+    # cross sections tell apart materials with custom scattering lengths
+    key = (material.name(), material.numberDensity,
+           material.totalScatterXSection(), material.cohScatterXSection(),
+           material.incohScatterXSection())
+    with _material_lock:
+        properties = _material_properties.get(key)
+    if properties is None:
+        properties = MaterialProperties(material)
+        with _material_lock:
+            _material_properties[key] = properties
+    return properties
+
+
+def ClearMaterialProperties():
+    """ Forget the materials seen so far """
+    with _material_lock:
+        _material_properties.clear()
+
 
-    return elastic_self_term
+def GetSampleSpeciesInfo(InputWorkspace):
+    # get sample information: mass, total scattering length, and concentration
+    # of each species
+    properties = GetMaterialProperties(InputWorkspace)
+    atom_species = collections.OrderedDict()
+    for symbol, mass, stoich, concentration, b_sqrd_bar in zip(
+            properties.symbols, properties.masses, properties.stoich,
+            properties.concentrations, properties.b_sqrd_bar):
+        atom_species[symbol] = {'mass': mass,
+                                'stoich': stoich,
+                                'b_sqrd_bar': b_sqrd_bar,
+                                'concentration': concentration}
+    return atom_species
+
+
+def CalculateElasticSelfScattering(InputWorkspace):
+    # calculate elastic self-scattering term
+    return GetMaterialProperties(InputWorkspace).elastic_self_term()
+
+
+def PlaczekSelfCorrection(phi_1, eps_1, summation_term, L1, L2, Polar):
+    """ Inelastic Placzek self-scattering correction of each detector (or
+    bank) at every wavelength, see Eq. (A1.14) of Howe, McGreevy, and
+    Howells
+
+    Computed as one broadcast of the detectors against the wavelengths
+    into a preallocated (detectors, wavelengths) array, using
+    (f - 1) phi_1 - f eps_1 + f - 3 == f (phi_1 - eps_1 + 1) - (phi_1 + 3)
+    so that no other array of that size is created.
+
+    :param phi_1: Incident spectrum term, lambda * I'(lambda) / I(lambda)
+    :type phi_1: numpy.array
+    :param eps_1: Detector efficiency term at the same wavelengths
+    :type eps_1: numpy.array
+    :param summation_term: Sum over the species of c * <b^2> * m_n / M
+    :type summation_term: float
+    :param L1: Primary flight path (m)
+    :type L1: float
+    :param L2: Secondary flight path of each detector (m)
+    :type L2: list
+    :param Polar: Polar (two theta) angle of each detector (degrees)
+    :type Polar: list
+
+    :return: Correction, shape (detectors, wavelengths)
+    :rtype: numpy.array
+    """
+    L2 = np.asarray(L2, dtype=np.float64)
+    Polar = np.asarray(Polar, dtype=np.float64)
+    phi_1 = np.asarray(phi_1, dtype=np.float64)
+    eps_1 = np.asarray(eps_1, dtype=np.float64)
+
+    f = (L1 / (L1 + L2))[:, np.newaxis]
+    angle_conv = np.pi / 180.
+    sin_theta_by_2 = np.sin(Polar * angle_conv / 2.)
+    scale = 2. * sin_theta_by_2 * sin_theta_by_2 * summation_term
+
+    correction = np.empty((len(L2), len(phi_1)))
+    np.multiply(f, phi_1 - eps_1 + 1., out=correction)
+    correction -= phi_1 + 3.
+    correction *= scale[:, np.newaxis]
+    return correction
+
+
+def PlaczekSelfCorrectionChunks(phi_1, eps_1, summation_term, L1, L2, Polar,
+                                ChunkSize=None):
+    """ `PlaczekSelfCorrection` for a block of detectors at a time, so that
+    only one block is held in memory
+
+    :param ChunkSize: Number of detectors per block, defaults to as many as
+                      fit in `CHUNK_VALUES` values
+    :type ChunkSize: int
+
+    See `PlaczekSelfCorrection` for the other parameters.
+
+    :return: Generator of (first detector index, correction of the block)
+    :rtype: generator
+    """
+    if ChunkSize is None:
+        ChunkSize = max(1, CHUNK_VALUES // max(1, len(phi_1)))
+    for start in range(0, len(L2), ChunkSize):
+        stop = start + ChunkSize
+        yield start, PlaczekSelfCorrection(
+            phi_1, eps_1, summation_term, L1, L2[start:stop],
+            Polar[start:stop])
+
+
+def GetDetectorGeometry(InputWorkspace):
+    """ Flight paths and polar angles of every spectrum (ie pixel) of a
+    workspace, for a per-pixel `CalculatePlaczekSelfScattering`
+
+    Read at once from the detector table of the workspace. Monitors and
+    spectra without detectors get an L2 and angle of zero, so their
+    correction is zero.
+
+    :param InputWorkspace: Workspace with the instrument
+    :type InputWorkspace: str
+
+    :return: `L1` (m), and per spectrum `L2` (m) and `Polar` (degrees)
+             arrays
+    :rtype: dict
+    """
+    wksp = mtd[str(InputWorkspace)]
+    table = CreateDetectorTable(InputWorkspace=wksp, StoreInADS=False)
+    detectors = np.array(table.column('Monitor')) == 'no'
+    L2 = np.where(detectors, np.asarray(table.column('R'), dtype=np.float64),
+                  0.)
+    Polar = np.where(detectors, np.asarray(table.column('Theta'),
+                                           dtype=np.float64), 0.)
+    return {'L1': wksp.spectrumInfo().l1(),
+            'L2': L2,
+            'Polar': Polar}
 
 
 def CalculatePlaczekSelfScattering(
@@ -82,9 +234,38 @@ def CalculatePlaczekSelfScattering(
         L1,
         L2,
         Polar,
-        Azimuthal=None,
         Detector=None,
-        ParentWorkspace=None):
+        ParentWorkspace=None,
+        ChunkSize=None):
+    """ First order Placzek inelastic self-scattering correction
+
+    The correction is computed for the focused banks, or per pixel with
+    the arrays of `GetDetectorGeometry`. It is computed a block of
+    `ChunkSize` spectra at a time (as many as fit in `CHUNK_VALUES` values
+    by default) into one array, which goes to the output workspace with a
+    single `CreateWorkspace`, the wavelengths being shared by all spectra.
+
+    :param IncidentWorkspace: Fitted incident spectrum and its derivative,
+                              with the sample material set
+    :type IncidentWorkspace: str
+    :param OutputWorkspace: Name of the correction workspace
+    :type OutputWorkspace: str
+    :param L1: Primary flight path (m)
+    :type L1: float
+    :param L2: Secondary flight path of each bank or pixel (m)
+    :type L2: list
+    :param Polar: Polar angle of each bank or pixel (degrees)
+    :type Polar: list
+    :param Detector: Detector efficiency law (`Alpha`, `LambdaD`, `Law`)
+    :type Detector: dict
+    :param ParentWorkspace: Workspace to copy the instrument from
+    :type ParentWorkspace: str
+    :param ChunkSize: Number of spectra computed at once
+    :type ChunkSize: int
+
+    :return: The correction workspace
+    :rtype: MatrixWorkspace
+    """
 
     # constants and conversions
     key = 'atomic mass unit-kilogram relationship'
@@ -92,16 +273,11 @@ def CalculatePlaczekSelfScattering(
     factor = 1. / amu_kg
     neutron_mass = factor * scipy.constants.m_n
 
-    # get sample information: mass, total scattering length, and concentration
-    # of each species
-    atom_species = GetSampleSpeciesInfo(IncidentWorkspace)
-
-    # calculate summation term w/ neutron mass over molecular mass ratio
-    summation_term = 0.0
-    for species, props in atom_species.items(
-    ):  # inefficient in py2, but works with py3
-        summation_term += props['concentration'] * \
-            props['b_sqrd_bar'] * neutron_mass / props['mass']
+    # calculate summation term w/ neutron mass over molecular mass ratio,
+    # from the mass, total scattering length, and concentration of each
+    # species
+    summation_term = GetMaterialProperties(
+        IncidentWorkspace).placzek_summation_term(neutron_mass)
 
     # get incident spectrum and 1st derivative
     incident_index = 0
@@ -131,10 +307,6 @@ def CalculatePlaczekSelfScattering(
 
     eps_1 = detector_law_term
 
-    # Set default azimuthal angle
-    if Azimuthal is None:
-        Azimuthal = np.zeros(len(Polar))
-
     # Placzek
     '''
     Original Placzek inelastic correction Ref (for constant wavelength):
@@ -149,46 +321,24 @@ def CalculatePlaczekSelfScattering(
     to Howe's Equation for P(theta)
     by adding the elastic self-scattering
     '''
-    x_lambdas = np.array([])
-    placzek_correction = np.array([])
-    for bank, (l2, theta, phi) in enumerate(zip(L2, Polar, Azimuthal)):
-        # variables
-        L_total = L1 + l2
-        f = L1 / L_total
-
-        angle_conv = np.pi / 180.
-        sin_theta_by_2 = np.sin(theta * angle_conv / 2.)
-
-        term1 = (f - 1.) * phi_1
-        term2 = f * eps_1
-        term3 = f - 3.
-
-        # per_bank_q = ConvertLambdaToQ(x_lambda,theta) - See Eq. (A1.14) of
-        inelastic_placzek_self_correction = 2. * \
-            (term1 - term2 + term3) \
-            * sin_theta_by_2 * sin_theta_by_2 * summation_term
-        x_lambdas = np.append(x_lambdas, x_lambda)
-        placzek_correction = np.append(
-            placzek_correction,
-            inelastic_placzek_self_correction)
-
+    L2 = np.asarray(L2, dtype=np.float64)
+    Polar = np.asarray(Polar, dtype=np.float64)
+    placzek_correction = np.empty((len(L2), len(phi_1)))
+    for start, chunk in PlaczekSelfCorrectionChunks(
+            phi_1, eps_1, summation_term, L1, L2, Polar, ChunkSize):
+        placzek_correction[start:start + len(chunk)] = chunk
+
+    parent = dict()
     if ParentWorkspace:
-        CreateWorkspace(
-            DataX=x_lambdas,
-            DataY=placzek_correction,
-            OutputWorkspace=OutputWorkspace,
-            UnitX='Wavelength',
-            NSpec=len(Polar),
-            ParentWorkspace=ParentWorkspace,
-            Distribution=True)
-    else:
-        CreateWorkspace(
-            DataX=x_lambdas,
-            DataY=placzek_correction,
-            OutputWorkspace=OutputWorkspace,
-            UnitX='Wavelength',
-            NSpec=len(Polar),
-            Distribution=True)
+        parent['ParentWorkspace'] = ParentWorkspace
+    CreateWorkspace(
+        DataX=np.asarray(x_lambda, dtype=np.float64),
+        DataY=placzek_correction.ravel(),
+        OutputWorkspace=OutputWorkspace,
+        UnitX='Wavelength',
+        NSpec=len(Polar),
+        Distribution=True,
+        **parent)
     print("Placzek YUnit:", mtd[OutputWorkspace].YUnit())
     print("Placzek distribution:", mtd[OutputWorkspace].isDistribution())
 
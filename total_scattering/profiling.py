@@ -0,0 +1,210 @@
+from __future__ import (absolute_import, division, print_function)
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from mantid import mtd
+
+# Profiler collecting the records, None when profiling is off so that the
+# instrumented code only pays for checking it
+_profiler = None
+
+
+def peak_rss():
+    """ Peak resident set size of the process in bytes (0 if unknown) """
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss():
+    """ Current resident set size of the process in bytes (0 if unknown) """
+    try:
+        with open('/proc/self/statm', 'r') as handle:
+            pages = int(handle.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return 0
+
+
+def ads_sizes():
+    """ Memory used by each workspace of the Analysis Data Service
+
+    :return: Workspace name -> size in bytes
+    :rtype: dict
+    """
+    sizes = dict()
+    for name in mtd.getObjectNames():
+        try:
+            sizes[name] = int(mtd[name].getMemorySize())
+        except (AttributeError, KeyError, RuntimeError):
+            pass  # groups have no size of their own, or deleted meanwhile
+    return sizes
+
+
+class Profiler(object):
+    """ Collects wall time, CPU time, memory and workspace sizes of the
+    stages of a reduction and of the calls made by them
+
+    :param name: Name of the profiled reduction, part of the report
+    :type name: str
+    """
+
+    # Kinds of records sampling the workspace sizes, walking the whole
+    # Analysis Data Service is too slow for the calls made inside the stages
+    ads_kinds = ['stage']
+
+    def __init__(self, name):
+        self.name = name
+        self.records = list()
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def record(self, kind, name):
+        """ Record the resources used by a block of code
+
+        :param kind: Kind of record (ie `stage` or `save_banks`)
+        :type kind: str
+        :param name: Name of the stage or call
+        :type name: str
+        """
+        start = time.time()
+        start_cpu = time.process_time()
+        start_thread_cpu = time.thread_time()
+        start_peak = peak_rss()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            record = {
+                'kind': kind,
+                'name': name,
+                'thread': threading.current_thread().name,
+                'start': start - self.started,
+                'wall_time': time.time() - start,
+                'cpu_time_thread': time.thread_time() - start_thread_cpu,
+                'cpu_time_process': time.process_time() - start_cpu,
+                'error': error}
+            # sampled once the block is timed so it does not count in it
+            peak = peak_rss()
+            record.update(peak_rss=peak,
+                          peak_rss_increase=peak - start_peak,
+                          rss=current_rss())
+            if kind in self.ads_kinds:
+                sizes = ads_sizes()
+                record.update(ads_size=sum(sizes.values()),
+                              ads_workspaces=sizes)
+            with self._lock:
+                self.records.append(record)
+
+    def report(self):
+        """ The report as a JSON serializable dict """
+        with self._lock:
+            records = list(self.records)
+        totals = dict()
+        for record in records:
+            total = totals.setdefault(record['kind'], {
+                'count': 0, 'wall_time': 0., 'cpu_time_thread': 0.})
+            total['count'] += 1
+            total['wall_time'] += record['wall_time']
+            total['cpu_time_thread'] += record['cpu_time_thread']
+        return {'name': self.name,
+                'started': time.strftime(
+                    '%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'wall_time': time.time() - self.started,
+                'cpu_time_process': time.process_time(),
+                'peak_rss': peak_rss(),
+                'totals': totals,
+                'records': records}
+
+    def write(self, filename):
+        """ Write the report to a JSON file
+
+        :param filename: Path of the report
+        :type filename: str
+        """
+        directory = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(filename, 'w') as handle:
+            json.dump(self.report(), handle, indent=2)
+
+
+def start_profiling(name):
+    """ Turn profiling on
+
+    :param name: Name of the profiled reduction
+    :type name: str
+
+    :return: The profiler collecting the records
+    :rtype: Profiler
+    """
+    global _profiler
+    _profiler = Profiler(name)
+    return _profiler
+
+
+def stop_profiling():
+    """ Turn profiling off
+
+    :return: The profiler that was collecting the records, if any
+    :rtype: Profiler or None
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+@contextmanager
+def _not_profiled():
+    yield
+
+
+def profile(kind, name):
+    """ Context manager recording a block of code if profiling is on
+
+    :param kind: Kind of record (ie `stage`)
+    :type kind: str
+    :param name: Name of the stage or call
+    :type name: str
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _not_profiled()
+    return profiler.record(kind, name)
+
+
+def profiled(kind, name_arg=None):
+    """ Decorator recording every call of a function if profiling is on
+
+    :param kind: Kind of record, also the name if `name_arg` is not given
+    :type kind: str
+    :param name_arg: Keyword argument holding the name of the record (ie
+                     `Title`)
+    :type name_arg: str
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return func(*args, **kwargs)
+            name = kwargs.get(name_arg, kind) if name_arg else kind
+            with profiler.record(kind, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,236 @@
+from __future__ import (absolute_import, division, print_function)
+
+import copy
+import json
+import multiprocessing
+import shutil
+import tempfile
+import traceback
+from collections import OrderedDict
+
+from mantid import mtd
+from mantid.kernel import Logger
+
+from total_scattering.reduction.stage_cache import \
+    StageCache, \
+    cache_settings, \
+    hash_json
+from total_scattering.reduction.total_scattering_reduction import \
+    SAVE_STAGE_PREFIX, \
+    TotalScatteringReduction, \
+    build_reduction_graph, \
+    configure_reduction, \
+    initial_values
+
+# Values that only depend on the normalization, the backgrounds and the
+# container, so samples measured with the same ones can share them
+SHARED_OUTPUTS = ['van_normalization', 'nvan_atoms', 'container',
+                  'container_bg']
+
+
+def read_batch_configs(filenames):
+    """ Read the JSON inputs of a batch of reductions
+
+    :param filenames: JSON files, each holding one input or a list of them,
+                      or JSON Lines files (`.jsonl`) with one input per line
+    :type filenames: list
+
+    :return: JSON inputs for reduction
+    :rtype: list
+    """
+    configs = list()
+    for filename in filenames:
+        with open(filename, 'r') as handle:
+            if filename.endswith('.jsonl'):
+                configs.extend(json.loads(line) for line in handle
+                               if line.strip())
+                continue
+            config = json.load(handle)
+        if isinstance(config, list):
+            configs.extend(config)
+        else:
+            configs.append(config)
+    return configs
+
+
+def with_stage_cache(config):
+    """ Copy of a JSON input with the stage cache enabled, which is how
+    shared stages are passed from one reduction to the others
+
+    Unless the input already enables it, the cache only keeps the stages
+    producing `SHARED_OUTPUTS`, so a batch does not store every stage of
+    every reduction.
+
+    :param config: JSON input for reduction
+    :type config: dict
+
+    :return: JSON input for reduction with the stage cache enabled
+    :rtype: dict
+    """
+    config = dict(config)
+    if not config.get('StageCache'):
+        settings, graph, initial = shared_graph(config)
+        config['StageCache'] = {'Stages': list(graph.stages)}
+    return config
+
+
+def with_worker_budget(config, processes):
+    """ Copy of a JSON input sharing the CPUs with the other reductions of
+    a batch
+
+    Each of the `processes` reductions running at once gets an equal share
+    of the CPUs for its `"MaxWorkers"` stages and their `"RunWorkers"`
+    processes.
+
+    :param config: JSON input for reduction
+    :type config: dict
+    :param processes: Number of reductions running at once
+    :type processes: int
+
+    :return: JSON input for reduction with the workers capped
+    :rtype: dict
+    """
+    config = dict(config)
+    share = max(multiprocessing.cpu_count() // max(processes or 1, 1), 1)
+    max_workers = min(config.get('MaxWorkers', 1) or 1, share)
+    config['MaxWorkers'] = max_workers
+    config['RunWorkers'] = min(config.get('RunWorkers', 1) or 1,
+                               max(share // max_workers, 1))
+    return config
+
+
+def shared_graph(config):
+    """ Build the graph of the stages producing the shared values
+
+    The stages saving outputs to files are left out, the reductions sharing
+    these values write them.
+
+    :param config: JSON input for reduction
+    :type config: dict
+
+    :return: The settings, the shared graph and its initial values
+    :rtype: tuple
+    """
+    settings = configure_reduction(copy.deepcopy(config))
+    initial = initial_values(settings)
+    graph = build_reduction_graph(settings)
+    saves = [name for name in graph.stages
+             if name.startswith(SAVE_STAGE_PREFIX)]
+    graph = graph.subgraph(SHARED_OUTPUTS, initial, skip=saves)
+    return settings, graph, initial
+
+
+def group_jobs(configs):
+    """ Group reductions by the stages they share
+
+    Reductions are grouped by the cache keys of the stages producing
+    `SHARED_OUTPUTS`, so two of them end up in the same group only if these
+    stages have the same settings and input files.
+
+    :param configs: JSON inputs for reduction (with the stage cache enabled)
+    :type configs: list
+
+    :return: Group key -> indices of the reductions in `configs`
+    :rtype: OrderedDict
+    """
+    groups = OrderedDict()
+    for index, config in enumerate(configs):
+        cache = StageCache(**cache_settings(config))
+        settings, graph, initial = shared_graph(config)
+        keys = graph.keys(cache, initial)
+        if any(key is None for key in keys.values()):
+            group = 'job{}'.format(index)  # cannot tell what it shares
+        else:
+            group = hash_json([cache.root, sorted(keys.values())])
+        groups.setdefault(group, list()).append(index)
+    return groups
+
+
+def prepare_shared(config):
+    """ Run the shared stages of a reduction, storing them in the cache
+
+    Stages writing some of their intermediate steps (ie the vanadium
+    preparation with full diagnostics) write them to a temporary directory,
+    since the reduction runs them again to write its own.
+
+    :param config: JSON input for reduction (with the stage cache enabled)
+    :type config: dict
+    """
+    output_dir = tempfile.mkdtemp(prefix='shared_')
+    try:
+        settings, graph, initial = shared_graph(
+            dict(config, OutputDir=output_dir))
+        graph.run(
+            initial=initial,
+            max_workers=settings['max_workers'],
+            cache=StageCache(**cache_settings(config)))
+    finally:
+        mtd.clear()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def reduce_job(config):
+    """ Run one reduction of a batch, catching its errors
+
+    :param config: JSON input for reduction
+    :type config: dict
+
+    :return: The title of the reduction and the traceback if it failed
+    :rtype: tuple
+    """
+    try:
+        TotalScatteringReduction(copy.deepcopy(config))
+        return config.get('Title'), None
+    except Exception:
+        return config.get('Title'), traceback.format_exc()
+    finally:
+        mtd.clear()
+
+
+def reduce_batch(configs, processes=1):
+    """ Reduce many samples, computing what they share only once
+
+    Reductions sharing the normalization, the backgrounds and the container
+    are grouped. The shared stages of each group (ie the vanadium
+    preparation) run once and are stored in the stage cache, then every
+    reduction runs in a pool of `processes` processes, taking the shared
+    stages from the cache. The CPUs are shared between the reductions
+    running at once, see `with_worker_budget`.
+
+    :param configs: JSON inputs for reduction
+    :type configs: list
+    :param processes: Number of reductions running at once
+    :type processes: int
+
+    :return: The title of each reduction and the traceback if it failed
+    :rtype: list
+    """
+    log = Logger("BatchReduction")
+    configs = [with_stage_cache(config) for config in configs]
+
+    groups = group_jobs(configs)
+    msg = "{} reductions in {} groups sharing normalization and backgrounds"
+    log.notice(msg.format(len(configs), len(groups)))
+    for indices in groups.values():
+        if len(indices) < 2:
+            continue
+        titles = [configs[index].get('Title') for index in indices]
+        log.notice("Preparing shared stages of {}".format(titles))
+        try:
+            prepare_shared(configs[indices[0]])
+        except Exception:
+            # Each reduction of the group will compute it and report
+            msg = "Could not prepare shared stages of {}:\n{}"
+            log.error(msg.format(titles, traceback.format_exc()))
+
+    if processes is None or processes <= 1:
+        return [reduce_job(config) for config in configs]
+
+    # Mantid does not survive a fork, so workers start from scratch
+    configs = [with_worker_budget(config, processes) for config in configs]
+    pool = multiprocessing.get_context('spawn').Pool(processes)
+    try:
+        return pool.map(reduce_job, configs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
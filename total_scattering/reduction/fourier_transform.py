@@ -0,0 +1,191 @@
+from __future__ import (absolute_import, division, print_function)
+
+import numpy as np
+from mantid import mtd
+from mantid.simpleapi import CreateWorkspace
+
+# Number of Q x r values of the sine matrix computed at once, bounds the
+# memory of the transform of long r grids
+BLOCK_SIZE = 2 ** 22
+
+
+def fourier_transform_settings(config):
+    """ Get the settings of the S(Q) to G(r) transform from the JSON input
+
+    `"FourierTransform": {"Qmin": 0.5, "Qmax": 30.0, "Rmax": 50.0,
+    "DeltaR": 0.01, "Lorch": true}`. `Qmin` and `Qmax` are a single value or
+    one value per bank, and default to the Q range of the data.
+
+    :param config: JSON input for reduction
+    :type config: dict
+
+    :return: Arguments for `sofq_to_gofr`, or None if no transform is
+             requested
+    :rtype: dict or None
+    """
+    options = config.get('FourierTransform', None)
+    if options is None or options is False:
+        return None
+    if options is True:
+        options = dict()
+    settings = {'qmin': options.get('Qmin', None),
+                'qmax': options.get('Qmax', None),
+                'rmax': options.get('Rmax', 50.),
+                'dr': options.get('DeltaR', 0.01),
+                'lorch': options.get('Lorch', False)}
+    if settings['rmax'] <= 0. or settings['dr'] <= 0.:
+        msg = "FourierTransform Rmax and DeltaR must be positive, got {} and {}"
+        raise RuntimeError(msg.format(settings['rmax'], settings['dr']))
+    return settings
+
+
+def r_grid(rmax, dr):
+    """ Points of the G(r) grid, from `dr` to `rmax`
+
+    :param rmax: Last r value
+    :type rmax: float
+    :param dr: Step of the grid
+    :type dr: float
+
+    :return: r values
+    :rtype: numpy.array
+    """
+    return np.arange(1, int(round(rmax / dr)) + 1) * dr
+
+
+def lorch_window(q, qmax):
+    """ Lorch modification function, sin(pi Q / Qmax) / (pi Q / Qmax),
+    damping the termination ripples of the transform
+
+    :param q: Q values
+    :type q: numpy.array
+    :param qmax: Upper Q limit of the transform, for each spectrum
+    :type qmax: float or numpy.array
+
+    :return: Window values, broadcast over `q` and `qmax`
+    :rtype: numpy.array
+    """
+    return np.sinc(q / qmax)
+
+
+def sofq_to_gofr(q, sq, r, errors=None, qmin=None, qmax=None, lorch=False):
+    """ Sine transform of S(Q) to the pair distribution function
+
+    G(r) = 2 / pi * integral of Q [S(Q) - 1] sin(Q r) dQ from Qmin to Qmax,
+    computed for all the spectra at once as a product with the sine
+    matrix. NaN and infinite values of S(Q) are left out of the integral.
+
+    :param q: Q values shared by the spectra, either bin edges (one more
+              than the S(Q) values) or points
+    :type q: numpy.array
+    :param sq: S(Q) of each spectrum, shape (spectra, Q values)
+    :type sq: numpy.array
+    :param r: r values to compute G(r) at
+    :type r: numpy.array
+    :param errors: Errors of S(Q), propagated to G(r) if given
+    :type errors: numpy.array
+    :param qmin: Lower Q limit, a single value or one per spectrum
+    :type qmin: float or list
+    :param qmax: Upper Q limit, a single value or one per spectrum
+    :type qmax: float or list
+    :param lorch: If the Lorch modification function is applied
+    :type lorch: bool
+
+    :return: G(r) of each spectrum, shape (spectra, r values), and its
+             errors (None if `errors` is not given)
+    :rtype: tuple
+    """
+    sq = np.atleast_2d(np.asarray(sq, dtype=np.float64))
+    q = np.asarray(q, dtype=np.float64)
+    r = np.asarray(r, dtype=np.float64)
+    if len(q) == sq.shape[1] + 1:
+        dq = np.diff(q)
+        q = 0.5 * (q[:-1] + q[1:])
+    elif len(q) == sq.shape[1]:
+        dq = np.gradient(q) if len(q) > 1 else np.ones_like(q)
+    else:
+        msg = "{} Q values do not match {} S(Q) values"
+        raise RuntimeError(msg.format(len(q), sq.shape[1]))
+
+    spectra = sq.shape[0]
+    qmin = np.broadcast_to(
+        q[0] if qmin is None else np.asarray(qmin, dtype=np.float64),
+        (spectra,))[:, np.newaxis]
+    qmax = np.broadcast_to(
+        q[-1] if qmax is None else np.asarray(qmax, dtype=np.float64),
+        (spectra,))[:, np.newaxis]
+
+    # Integrand weights Q dQ, zero outside of each Q range
+    valid = np.isfinite(sq) & (q >= qmin) & (q <= qmax)
+    weights = np.where(valid, q * dq, 0.)
+    if lorch:
+        weights *= lorch_window(q, qmax)
+    integrand = np.where(valid, sq - 1., 0.) * weights
+
+    gr = np.empty((spectra, len(r)))
+    gr_errors = None
+    if errors is not None:
+        variance = np.where(valid, np.asarray(errors, dtype=np.float64), 0.)
+        variance = (variance * weights) ** 2
+        gr_errors = np.empty((spectra, len(r)))
+
+    block = max(1, BLOCK_SIZE // max(1, len(q)))
+    for start in range(0, len(r), block):
+        sine = np.sin(np.outer(q, r[start:start + block]))
+        gr[:, start:start + block] = integrand.dot(sine)
+        if gr_errors is not None:
+            gr_errors[:, start:start + block] = np.sqrt(
+                variance.dot(sine * sine))
+
+    gr *= 2. / np.pi
+    if gr_errors is not None:
+        gr_errors *= 2. / np.pi
+    return gr, gr_errors
+
+
+def transform_workspace(InputWorkspace, OutputWorkspace, rmax=50., dr=0.01,
+                        qmin=None, qmax=None, lorch=False):
+    """ Transform every spectrum of an S(Q) workspace to G(r)
+
+    :param InputWorkspace: S(Q) in MomentumTransfer, with common Q bins
+    :type InputWorkspace: str
+    :param OutputWorkspace: Name of the G(r) workspace
+    :type OutputWorkspace: str
+    :param rmax: Last r value
+    :type rmax: float
+    :param dr: Step of the r grid
+    :type dr: float
+    :param qmin: Lower Q limit, a single value or one per spectrum
+    :type qmin: float or list
+    :param qmax: Upper Q limit, a single value or one per spectrum
+    :type qmax: float or list
+    :param lorch: If the Lorch modification function is applied
+    :type lorch: bool
+
+    :return: The G(r) workspace
+    :rtype: MatrixWorkspace
+    """
+    wksp = mtd[str(InputWorkspace)]
+    unit = wksp.getAxis(0).getUnit().unitID()
+    if unit != 'MomentumTransfer':
+        msg = "S(Q) to G(r) expects MomentumTransfer, '{}' is in {}"
+        raise RuntimeError(msg.format(str(InputWorkspace), unit))
+    if not wksp.isCommonBins():
+        msg = "S(Q) to G(r) expects the spectra of '{}' to share Q bins"
+        raise RuntimeError(msg.format(str(InputWorkspace)))
+
+    r = r_grid(rmax, dr)
+    gr, gr_errors = sofq_to_gofr(
+        wksp.readX(0), wksp.extractY(), r, errors=wksp.extractE(),
+        qmin=qmin, qmax=qmax, lorch=lorch)
+    spectra = gr.shape[0]
+    return CreateWorkspace(
+        OutputWorkspace=OutputWorkspace,
+        DataX=np.tile(r, spectra),
+        DataY=gr.ravel(),
+        DataE=gr_errors.ravel(),
+        NSpec=spectra,
+        UnitX='AtomicDistance',
+        YUnitLabel='G(r)',
+        Distribution=True,
+        ParentWorkspace=wksp)
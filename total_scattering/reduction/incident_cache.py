@@ -0,0 +1,209 @@
+from __future__ import (absolute_import, division, print_function)
+
+import os
+
+from mantid import mtd
+from mantid.kernel import Logger
+from mantid.simpleapi import DeleteWorkspace, Plus
+
+from total_scattering import __version__
+from total_scattering.file_handling.load import split_filenames
+from total_scattering.inelastic.incident_spectrum import \
+    FitIncidentSpectrum, \
+    GetIncidentSpectrumFromMonitor, \
+    MONITOR_BINNING
+from total_scattering.reduction.stage_cache import \
+    StageCache, \
+    hash_json, \
+    resolve_files
+
+
+def incident_cache_settings(config):
+    """ Get the incident spectrum cache settings from the JSON input
+
+    The cache is enabled with `"IncidentSpectrumCache": true` or with a
+    dict such as `"IncidentSpectrumCache": {"MaxSizeGB": 1}`, and lives in
+    the `incident` directory of `CacheDir`.
+
+    :param config: JSON input for reduction
+    :type config: dict
+
+    :return: Arguments for `IncidentSpectrumCache`, or None if the cache is
+             disabled
+    :rtype: dict or None
+    """
+    options = config.get('IncidentSpectrumCache', False)
+    if not options:
+        return None
+    if not isinstance(options, dict):
+        options = dict()
+    return {'cache_dir': config.get('CacheDir', os.path.abspath('.')),
+            'max_size_gb': options.get('MaxSizeGB', None)}
+
+
+def warm_starts_file(config):
+    """ Get the file of the Howells function warm starts from the JSON input
+
+    `"HowellsWarmStarts": true` keeps them in `howells.json` of `CacheDir`,
+    `"HowellsWarmStarts": "/path/to/file.json"` in the given file.
+
+    :param config: JSON input for reduction
+    :type config: dict
+
+    :return: The file, or None if the warm starts are not used
+    :rtype: str or None
+    """
+    options = config.get('HowellsWarmStarts', False)
+    if not options:
+        return None
+    if not isinstance(options, str):
+        options = os.path.join(config.get('CacheDir', os.path.abspath('.')),
+                               'howells.json')
+    return options
+
+
+def sum_monitor_spectra(OutputWorkspace, Filenames, Binning=MONITOR_BINNING):
+    """ Sum the incident monitor spectra of runs
+
+    Every run is binned the same way in wavelength, so the spectra are
+    added bin by bin.
+
+    :param OutputWorkspace: Name of the summed incident spectrum
+    :type OutputWorkspace: str
+    :param Filenames: Comma separated string or list of runs/filenames
+    :type Filenames: str or list
+    :param Binning: Wavelength binning of the monitor spectra
+    :type Binning: str
+
+    :return: The summed incident spectrum
+    :rtype: MatrixWorkspace
+    """
+    filenames = split_filenames(Filenames)
+    if not filenames:
+        raise RuntimeError("No runs to get the incident spectrum from")
+    GetIncidentSpectrumFromMonitor(
+        Filename=filenames[0],
+        OutputWorkspace=OutputWorkspace,
+        Binning=Binning)
+    run_incident = '__{}_run'.format(OutputWorkspace)
+    for filename in filenames[1:]:
+        GetIncidentSpectrumFromMonitor(
+            Filename=filename,
+            OutputWorkspace=run_incident,
+            Binning=Binning)
+        Plus(LHSWorkspace=OutputWorkspace,
+             RHSWorkspace=run_incident,
+             OutputWorkspace=OutputWorkspace)
+    if mtd.doesExist(run_incident):
+        DeleteWorkspace(run_incident)
+    return mtd[OutputWorkspace]
+
+
+def fitted_incident_spectrum(OutputWorkspace, Filenames,
+                             FitSpectrumWith='GaussConvCubicSpline',
+                             BinningForFit="0.15,0.05,3.2",
+                             BinningForCalc=None,
+                             Binning=MONITOR_BINNING,
+                             cache=None,
+                             warm_starts=None,
+                             instrument=None,
+                             moderator=None):
+    """ Fit the incident spectrum of runs, summed over their monitors
+
+    The monitors of all the runs are summed and fitted once. With a cache,
+    the fit is reused when the same monitor files were fitted the same
+    way before, in this reduction or an earlier one. The warm starts are
+    then left out, so that a cached fit only depends on its key.
+
+    :param OutputWorkspace: Name of the fitted spectrum and its derivative
+    :type OutputWorkspace: str
+    :param Filenames: Comma separated string or list of runs/filenames
+    :type Filenames: str or list
+    :param FitSpectrumWith: Fitting method of `FitIncidentSpectrum`
+    :type FitSpectrumWith: str
+    :param BinningForFit: Wavelength binning the spectrum is fitted on
+    :type BinningForFit: str
+    :param BinningForCalc: Wavelength binning of the fitted spectrum
+    :type BinningForCalc: str
+    :param Binning: Wavelength binning of the monitor spectra
+    :type Binning: str
+    :param cache: Cache of fitted spectra, fitted every time if None
+    :type cache: IncidentSpectrumCache
+    :param warm_starts: Parameters of earlier Howells function fits
+    :type warm_starts: HowellsWarmStarts
+    :param instrument: Instrument name for the warm starts
+    :type instrument: str
+    :param moderator: Moderator name for the warm starts
+    :type moderator: str
+
+    :return: Name of the fitted spectrum
+    :rtype: str
+    """
+    fit_args = {'FitSpectrumWith': FitSpectrumWith,
+                'BinningForFit': BinningForFit,
+                'BinningForCalc': BinningForCalc}
+    key = None
+    if cache is not None:
+        key = cache.spectrum_key(Filenames, Binning, **fit_args)
+        warm_starts = None
+    if key is not None and cache.lookup(key) is not None:
+        cache.restore(key, rename={'incident': OutputWorkspace})
+        return OutputWorkspace
+
+    sum_monitor_spectra(OutputWorkspace, Filenames, Binning=Binning)
+    FitIncidentSpectrum(
+        InputWorkspace=OutputWorkspace,
+        OutputWorkspace=OutputWorkspace,
+        PlotDiagnostics=False,
+        WarmStarts=warm_starts,
+        Instrument=instrument,
+        Moderator=moderator,
+        **fit_args)
+    if key is not None:
+        cache.store(key, 'incident spectrum of {} runs'.format(
+            len(split_filenames(Filenames))), {'incident': OutputWorkspace})
+    return OutputWorkspace
+
+
+class IncidentSpectrumCache(StageCache):
+    """ Cache of fitted incident spectra
+
+    Entries hold the fit of the summed monitor spectra of a list of runs
+    and its derivative, keyed by the checksums of the run files, the
+    monitor binning and the fitting options, so a sample or vanadium
+    reduced again is not fitted again.
+
+    :param cache_dir: Directory of the cache (ie `CacheDir` from the input)
+    :type cache_dir: str
+    :param max_size_gb: Maximum size of the cache in GB, unbounded if None
+    :type max_size_gb: float
+    """
+    subdir = 'incident'
+
+    def __init__(self, cache_dir, max_size_gb=None):
+        super(IncidentSpectrumCache, self).__init__(cache_dir, max_size_gb)
+        self.log = Logger("IncidentSpectrumCache")
+
+    def spectrum_key(self, Filenames, Binning, **fit_args):
+        """ Key of the fitted incident spectrum of runs
+
+        :param Filenames: Comma separated string or list of runs/filenames
+        :type Filenames: str or list
+        :param Binning: Wavelength binning of the monitor spectra
+        :type Binning: str
+        :param fit_args: Arguments for `FitIncidentSpectrum`
+        :type fit_args: dict
+
+        :return: The key, or None if a run could not be found
+        :rtype: str or None
+        """
+        paths = resolve_files(Filenames)
+        if paths is None:
+            msg = "Could not find all of '{}', not caching the fit"
+            self.log.warning(msg.format(Filenames))
+            return None
+        return hash_json({'version': __version__,
+                          'files': [self.file_checksum(path)
+                                    for path in paths],
+                          'binning': Binning,
+                          'fit': fit_args})
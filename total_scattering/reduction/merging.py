@@ -0,0 +1,163 @@
+from __future__ import (absolute_import, division, print_function)
+
+import numpy as np
+from mantid import mtd
+from mantid.kernel import Logger
+from mantid.simpleapi import CreateWorkspace
+
+
+def _limits(limit, spectra, default, log=None):
+    """ Q limit of each spectrum as a column, for broadcasting
+
+    A single limit applies to every spectrum. Limits that do not match the
+    spectra are left out (with a warning to `log`), so the spectra are
+    merged without cropping.
+    """
+    if limit is None:
+        limit = default
+    limit = np.asarray(limit, dtype=np.float64).ravel()
+    if len(limit) not in [1, spectra]:
+        if log is not None:
+            msg = "{} Q limits given for {} spectra, merging without them"
+            log.warning(msg.format(len(limit), spectra))
+        limit = np.asarray(default, dtype=np.float64).ravel()
+    return np.broadcast_to(limit, (spectra,))[:, np.newaxis]
+
+
+def sum_bank_indices(sum_banks, spectra, log=None):
+    """ Workspace indices of the banks merged into the total S(Q)
+
+    :param sum_banks: Workspace indices from `"SumBanks"`, a list or a
+                      string of ranges (ie `"1-3,5"`), None for all banks
+    :type sum_banks: list or str
+    :param spectra: Number of banks
+    :type spectra: int
+    :param log: Logger warned about indices out of range
+    :type log: Logger
+
+    :return: Workspace indices, in increasing order
+    :rtype: list
+    """
+    if sum_banks is None:
+        return list(range(spectra))
+    if isinstance(sum_banks, str):
+        spans = (part.strip().partition('-')[::2]
+                 for part in sum_banks.split(',') if part.strip())
+        sum_banks = [index for start, stop in spans
+                     for index in range(int(start), int(stop or start) + 1)]
+    indices = sorted(set(int(index) for index in sum_banks))
+    valid = [index for index in indices if 0 <= index < spectra]
+    if len(valid) < len(indices) and log is not None:
+        log.warning("SumBanks {} out of range for {} banks".format(
+            [index for index in indices if index not in valid], spectra))
+    if not valid:
+        if log is not None:
+            log.warning("No SumBanks in range, merging all the banks")
+        return list(range(spectra))
+    return valid
+
+
+def merge_spectra(x, y, e, qmin=None, qmax=None, indices=None, log=None):
+    """ Crop each spectrum to its Q range and merge them with inverse
+    variance weights
+
+    Computed on the whole (spectra, bins) arrays at once: bins outside of
+    the Q range of their spectrum, or with a NaN value or a NaN or infinite
+    error, get no weight. Bins with a zero error (ie no counts) get the
+    smallest variance of their spectrum instead, so that they are not left
+    out of the merge, which would bias it upwards, nor outweigh the other
+    spectra. Spectra with no error at all get no weight. Bins where no
+    spectrum has weight are NaN.
+
+    :param x: Q values shared by the spectra, bin edges or points
+    :type x: numpy.array
+    :param y: Values of each spectrum, shape (spectra, bins)
+    :type y: numpy.array
+    :param e: Errors of each spectrum, shape (spectra, bins)
+    :type e: numpy.array
+    :param qmin: Lower Q limit, a single value or one per spectrum
+    :type qmin: float or list
+    :param qmax: Upper Q limit, a single value or one per spectrum
+    :type qmax: float or list
+    :param indices: Workspace indices of the spectra to merge, all if None
+    :type indices: list
+    :param log: Logger warned about Q limits not matching the spectra
+    :type log: Logger
+
+    :return: Merged values and errors
+    :rtype: tuple
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    e = np.atleast_2d(np.asarray(e, dtype=np.float64))
+    spectra, bins = y.shape
+    if len(x) == bins + 1:
+        low, high = x[:-1], x[1:]
+    elif len(x) == bins:
+        low, high = x, x
+    else:
+        msg = "{} Q values do not match {} bins"
+        raise RuntimeError(msg.format(len(x), bins))
+
+    inside = (low >= _limits(qmin, spectra, -np.inf, log)) \
+        & (high <= _limits(qmax, spectra, np.inf, log))
+    if indices is not None:
+        selected = np.zeros((spectra, 1), dtype=bool)
+        selected[list(indices)] = True
+        inside &= selected
+
+    valid = inside & np.isfinite(y) & np.isfinite(e)
+    variance = e * e
+    positive = valid & (variance > 0.)
+    floor = np.where(positive, variance, np.inf).min(axis=1, initial=np.inf)
+    variance = np.where(variance > 0., variance, floor[:, np.newaxis])
+    valid &= np.isfinite(variance)
+    weights = np.zeros_like(y)
+    np.divide(1., variance, out=weights, where=valid)
+    total = weights.sum(axis=0)
+    merged_y = np.full(bins, np.nan)
+    merged_e = np.full(bins, np.nan)
+    covered = total > 0.
+    merged_y[covered] = np.where(valid, weights * y, 0.).sum(
+        axis=0)[covered] / total[covered]
+    merged_e[covered] = 1. / np.sqrt(total[covered])
+    return merged_y, merged_e
+
+
+def merge_workspace(InputWorkspace, OutputWorkspace, qmin=None, qmax=None,
+                    sum_banks=None):
+    """ Merge the banks of an S(Q) workspace into a single spectrum
+
+    :param InputWorkspace: S(Q) bank-by-bank, with common Q bins
+    :type InputWorkspace: str
+    :param OutputWorkspace: Name of the merged workspace
+    :type OutputWorkspace: str
+    :param qmin: Lower Q limit, a single value or one per bank
+    :type qmin: float or list
+    :param qmax: Upper Q limit, a single value or one per bank
+    :type qmax: float or list
+    :param sum_banks: Workspace indices of the banks to merge, all if None
+    :type sum_banks: list or str
+
+    :return: The merged workspace
+    :rtype: MatrixWorkspace
+    """
+    wksp = mtd[str(InputWorkspace)]
+    if not wksp.isCommonBins():
+        msg = "Merging expects the banks of '{}' to share Q bins"
+        raise RuntimeError(msg.format(str(InputWorkspace)))
+    spectra = wksp.getNumberHistograms()
+    log = Logger('merge_workspace')
+    indices = sum_bank_indices(sum_banks, spectra, log)
+    y, e = merge_spectra(wksp.readX(0), wksp.extractY(), wksp.extractE(),
+                         qmin=qmin, qmax=qmax, indices=indices, log=log)
+    return CreateWorkspace(
+        OutputWorkspace=OutputWorkspace,
+        DataX=np.array(wksp.readX(0)),
+        DataY=y,
+        DataE=e,
+        NSpec=1,
+        UnitX=wksp.getAxis(0).getUnit().unitID(),
+        YUnitLabel=wksp.YUnitLabel(),
+        Distribution=wksp.isDistribution(),
+        ParentWorkspace=wksp)
@@ -0,0 +1,159 @@
+from __future__ import (absolute_import, division, print_function)
+
+import os
+
+from mantid import mtd
+from mantid.simpleapi import DeleteWorkspace
+
+from total_scattering import __version__
+from total_scattering.file_handling.load import \
+    focus_runs, \
+    split_filenames, \
+    sum_runs
+from total_scattering.reduction.stage_cache import \
+    StageCache, \
+    hash_json, \
+    resolve_files
+
+# Align and focus arguments that do not change the focused runs
+RUNTIME_ARGS = ['CacheDir', 'ReductionProperties']
+
+# Align and focus arguments naming files, keyed by their content
+FILE_ARGS = ['CalFilename', 'GroupFilename', 'CharacterizationRunsFile']
+
+
+def run_cache_settings(config):
+    """ Get the run cache settings from the JSON input
+
+    The run cache is enabled with `"RunCache": true` or with a dict such as
+    `"RunCache": {"MaxSizeGB": 50}`, and lives in the `runs` directory of
+    `CacheDir`.
+
+    :param config: JSON input for reduction
+    :type config: dict
+
+    :return: Arguments for `RunCache`, or None if the cache is disabled
+    :rtype: dict or None
+    """
+    options = config.get('RunCache', False)
+    if not options:
+        return None
+    if not isinstance(options, dict):
+        options = dict()
+    return {'cache_dir': config.get('CacheDir', os.path.abspath('.')),
+            'max_size_gb': options.get('MaxSizeGB', None)}
+
+
+class RunCache(StageCache):
+    """ Cache of focused runs and of their running sums
+
+    Each run is focused on its own and stored, keyed by the checksum of its
+    file, the align and focus arguments and the checksums of the files they
+    name (calibration, grouping and characterization runs). The sum of a
+    list of runs is stored too, so when runs are appended to a sample only
+    the new runs are focused and added to the stored sum of the earlier
+    ones. Runs are stored before normalizing by the proton charge, which
+    `load` applies to the sum as for a single AlignAndFocusPowderFromFiles
+    call.
+
+    :param cache_dir: Directory of the cache (ie `CacheDir` from the input)
+    :type cache_dir: str
+    :param max_size_gb: Maximum size of the cache in GB, unbounded if None
+    :type max_size_gb: float
+    """
+    subdir = 'runs'
+
+    def run_keys(self, paths, align_and_focus_args):
+        """ Keys of the focused runs
+
+        :param paths: Full paths of the runs
+        :type paths: list
+        :param align_and_focus_args: Arguments for
+                                     AlignAndFocusPowderFromFiles
+        :type align_and_focus_args: dict
+
+        :return: One key per run, or None if a file given in the arguments
+                 could not be found
+        :rtype: list or None
+        """
+        args = {key: value for key, value in align_and_focus_args.items()
+                if key not in RUNTIME_ARGS}
+        checksums = dict()
+        for key in FILE_ARGS:
+            if not args.get(key):
+                continue
+            arg_paths = resolve_files(args[key])
+            if arg_paths is None:
+                return None
+            checksums[key] = [self.file_checksum(path) for path in arg_paths]
+        return [hash_json({'version': __version__,
+                           'file': self.file_checksum(path),
+                           'args': args,
+                           'files': checksums})
+                for path in paths]
+
+    def focus(self, ws_name, input_files, run_workers=1,
+              **align_and_focus_args):
+        """ Focus and sum runs, reusing runs and sums focused earlier
+
+        :param ws_name: Name of the summed workspace
+        :type ws_name: str
+        :param input_files: Comma separated string or list of runs/filenames
+        :type input_files: str or list
+        :param run_workers: Number of processes focusing the new runs
+        :type run_workers: int
+
+        :return: Name of the summed workspace
+        :rtype: str
+        """
+        paths = resolve_files(input_files)
+        keys = None
+        if paths is not None:
+            keys = self.run_keys(paths, align_and_focus_args)
+        if keys is None:
+            msg = "Could not find all of '{}' or of the files they are " \
+                  "focused with, not using the run cache"
+            self.log.warning(msg.format(input_files))
+            focus_runs([ws_name], [','.join(split_filenames(input_files))],
+                       **align_and_focus_args)
+            return ws_name
+
+        # Start from the longest list of leading runs summed before
+        if mtd.doesExist(ws_name):
+            DeleteWorkspace(ws_name)
+        done = 0
+        for count in range(len(keys), 0, -1):
+            if self.lookup(hash_json(keys[:count])) is not None:
+                self.restore(hash_json(keys[:count]),
+                             rename={'sum': ws_name})
+                done = count
+                break
+        if done == len(keys):
+            return ws_name
+
+        # Take the remaining runs from the cache, focusing those missing
+        run_names = ['__{}_run{}'.format(ws_name, index)
+                     for index in range(done, len(keys))]
+        missing = list()
+        for run_name, key, path in zip(run_names, keys[done:], paths[done:]):
+            if self.lookup(key) is not None:
+                self.restore(key, rename={'focused': run_name})
+            else:
+                missing.append((run_name, key, path))
+        if missing:
+            self.log.notice("Focusing {} new runs of {}".format(
+                len(missing), ws_name))
+            focus_runs([run_name for run_name, _, _ in missing],
+                       [path for _, _, path in missing],
+                       run_workers, **align_and_focus_args)
+            for run_name, key, path in missing:
+                self.store(key, 'run {}'.format(os.path.basename(path)),
+                           {'focused': run_name})
+
+        sum_runs(ws_name, run_names)
+        for run_name in run_names:
+            DeleteWorkspace(run_name)
+        if len(keys) > 1:
+            self.store(hash_json(keys), 'sum of {} runs'.format(len(keys)),
+                       {'sum': ws_name})
+        return ws_name
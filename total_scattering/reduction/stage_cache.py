@@ -0,0 +1,384 @@
+from __future__ import (absolute_import, division, print_function)
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+from mantid import mtd
+from mantid.api import FileFinder
+from mantid.kernel import Logger
+from mantid.simpleapi import LoadNexusProcessed, SaveNexusProcessed
+
+from total_scattering import __version__
+from total_scattering.file_handling.load import split_filenames
+from total_scattering.file_handling.save import nexus_write_lock
+
+MANIFEST = 'manifest.json'
+CHECKSUMS = 'checksums.json'
+GIGABYTE = 1024. ** 3
+
+
+def hash_json(obj):
+    """ SHA-256 of the canonical JSON representation of an object
+
+    :param obj: JSON serializable object (unknown types hash via `str`)
+    :type obj: any
+
+    :return: Hex digest
+    :rtype: str
+    """
+    text = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def resolve_files(input_files):
+    """ Find the full paths of run names or filenames
+
+    :param input_files: Comma separated string or list of runs/filenames
+    :type input_files: str or list
+
+    :return: Full paths, or None if any of them could not be found
+    :rtype: list or None
+    """
+    paths = list()
+    for name in split_filenames(input_files):
+        if os.path.isfile(name):
+            paths.append(os.path.abspath(name))
+            continue
+        if os.path.dirname(name):
+            return None  # a path to a missing file
+        try:
+            found = FileFinder.findRuns(name)
+        except (RuntimeError, ValueError):
+            found = None
+        if not found:
+            return None
+        paths.extend(found)
+    return paths
+
+
+def tmp_suffix():
+    """ Suffix for temporary files unique to this process and thread """
+    return '.tmp{}-{}'.format(os.getpid(), threading.current_thread().ident)
+
+
+def cache_settings(config):
+    """ Get the stage cache settings from the JSON input
+
+    The stage cache is enabled with `"StageCache": true` or with a dict
+    such as `"StageCache": {"MaxSizeGB": 50}`, and lives in the `stages`
+    directory of `CacheDir`. `"Stages"` in the dict limits it to the named
+    stages.
+
+    :param config: JSON input for reduction
+    :type config: dict
+
+    :return: Arguments for `StageCache`, or None if the cache is disabled
+    :rtype: dict or None
+    """
+    options = config.get('StageCache', False)
+    if not options:
+        return None
+    if not isinstance(options, dict):
+        options = dict()
+    cache_dir = config.get('CacheDir', os.path.abspath('.'))
+    return {'cache_dir': cache_dir,
+            'max_size_gb': options.get('MaxSizeGB', None),
+            'stages': options.get('Stages', None)}
+
+
+class StageCache(object):
+    """ Content-addressed on-disk cache of stage outputs
+
+    Each entry is a directory named after the stage key holding a manifest
+    and one processed NeXus file per output workspace. The key of a stage
+    combines its name, the package version, its configuration, the
+    checksums of the files it reads and the keys of the stages it depends
+    on, so changing any of them invalidates the stage and everything
+    downstream of it. Entries are evicted least recently used first once
+    the cache grows past `max_size_gb`.
+
+    :param cache_dir: Directory of the cache (ie `CacheDir` from the input)
+    :type cache_dir: str
+    :param max_size_gb: Maximum size of the cache in GB, unbounded if None
+    :type max_size_gb: float
+    :param checksum_files: Identify input files by their content, otherwise
+                           only by path, size and modification time (enough
+                           for short lived caches such as checkpoints)
+    :type checksum_files: bool
+    :param stages: Names of the stages to cache, all of them if None
+    :type stages: list
+    """
+
+    # Directory of the entries within `cache_dir`
+    subdir = 'stages'
+
+    def __init__(self, cache_dir, max_size_gb=None, checksum_files=True,
+                 stages=None):
+        self.root = os.path.join(os.path.abspath(cache_dir), self.subdir)
+        self.max_size_gb = max_size_gb
+        self.checksum_files = checksum_files
+        self.stages = None if stages is None else set(stages)
+        self.log = Logger("StageCache")
+        self._lock = threading.Lock()
+        self._checksums = None
+
+    def caches(self, stage):
+        """ If the outputs of a stage are kept in this cache
+
+        :param stage: The stage
+        :type stage: Stage
+
+        :rtype: bool
+        """
+        return stage.cacheable and (self.stages is None
+                                    or stage.name in self.stages)
+
+    # Keys
+
+    def stage_key(self, stage, upstream):
+        """ Compute the key of a stage
+
+        :param stage: The stage
+        :type stage: Stage
+        :param upstream: Input name -> key of the producing stage, or the
+                         value itself for inputs given up front
+        :type upstream: dict
+
+        :return: The key, or None if an input file could not be found
+        :rtype: str or None
+        """
+        checksums = list()
+        for input_files in stage.files:
+            paths = resolve_files(input_files)
+            if paths is None:
+                msg = "Could not find '{}', not caching stage '{}'"
+                self.log.warning(msg.format(input_files, stage.name))
+                return None
+            checksums.append([self.file_checksum(path) for path in paths])
+
+        return hash_json({
+            'stage': stage.name,
+            'version': __version__,
+            'params': stage.params,
+            'files': checksums,
+            'upstream': upstream})
+
+    def file_checksum(self, path):
+        """ SHA-256 of a file, memoized on disk by path, size and mtime
+
+        :param path: Path to the file
+        :type path: str
+
+        :return: Hex digest
+        :rtype: str
+        """
+        if not self.checksum_files:
+            stat = os.stat(path)
+            return hash_json([path, stat.st_size, stat.st_mtime])
+
+        with self._lock:
+            if self._checksums is None:
+                self._checksums = self._read_json(
+                    os.path.join(self.root, CHECKSUMS), dict())
+            stat = os.stat(path)
+            memo = self._checksums.get(path)
+            if memo and memo['size'] == stat.st_size \
+                    and memo['mtime'] == stat.st_mtime:
+                return memo['sha256']
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as handle:
+            for block in iter(lambda: handle.read(4 * 1024 * 1024), b''):
+                sha.update(block)
+
+        with self._lock:
+            self._checksums[path] = {'size': stat.st_size,
+                                     'mtime': stat.st_mtime,
+                                     'sha256': sha.hexdigest()}
+            self._write_json(os.path.join(self.root, CHECKSUMS),
+                             self._checksums)
+        return sha.hexdigest()
+
+    # Entries
+
+    def lookup(self, key):
+        """ Get the outputs of a cached stage
+
+        Only the manifest is read, workspaces are loaded by `restore`.
+
+        :param key: Stage key
+        :type key: str
+
+        :return: The stage outputs, or None on a cache miss
+        :rtype: dict or None
+        """
+        manifest_file = os.path.join(self.root, key, MANIFEST)
+        manifest = self._read_json(manifest_file, None)
+        if manifest is None:
+            return None
+
+        # Mark as recently used
+        os.utime(manifest_file, None)
+        self.log.notice("Found stage '{}' in cache entry {}".format(
+            manifest['stage'], key))
+        return {name: output['value']
+                for name, output in manifest['outputs'].items()}
+
+    def restore(self, key, outputs=None, rename=None):
+        """ Load the output workspaces of a cached stage into the ADS
+
+        :param key: Stage key
+        :type key: str
+        :param outputs: Names of the outputs to load, all of them if None
+        :type outputs: list
+        :param rename: Output name -> workspace name to load it as, instead
+                       of the name it was stored under
+        :type rename: dict
+        """
+        entry_dir = os.path.join(self.root, key)
+        manifest = self._read_json(os.path.join(entry_dir, MANIFEST), None)
+        if manifest is None:
+            raise RuntimeError("Cache entry {} is missing".format(key))
+        for name, output in manifest['outputs'].items():
+            if outputs is not None and name not in outputs:
+                continue
+            if output['type'] == 'workspace':
+                with nexus_write_lock:
+                    LoadNexusProcessed(
+                        Filename=os.path.join(entry_dir, output['file']),
+                        OutputWorkspace=(rename or dict()).get(
+                            name, output['value']))
+
+    def store(self, key, stage_name, outputs):
+        """ Save the outputs of a stage under its key
+
+        Output values naming a workspace in the ADS are saved as processed
+        NeXus files, others are stored in the manifest.
+
+        :param key: Stage key
+        :type key: str
+        :param stage_name: Name of the stage (for listing the cache)
+        :type stage_name: str
+        :param outputs: The stage outputs
+        :type outputs: dict
+        """
+        entry_dir = os.path.join(self.root, key)
+        tmp_dir = entry_dir + tmp_suffix()
+        if not os.path.isdir(tmp_dir):
+            os.makedirs(tmp_dir)
+
+        manifest = {'stage': stage_name,
+                    'version': __version__,
+                    'created': time.time(),
+                    'outputs': dict()}
+        for name, value in outputs.items():
+            if isinstance(value, str) and value and mtd.doesExist(value):
+                filename = '{}.nxs'.format(name)
+                with nexus_write_lock:
+                    SaveNexusProcessed(
+                        InputWorkspace=value,
+                        Filename=os.path.join(tmp_dir, filename))
+                manifest['outputs'][name] = {'type': 'workspace',
+                                             'value': value,
+                                             'file': filename}
+            else:
+                if isinstance(value, np.ndarray):
+                    value = value.tolist()
+                manifest['outputs'][name] = {'type': 'value',
+                                             'value': value}
+        self._write_json(os.path.join(tmp_dir, MANIFEST), manifest)
+
+        # Publish the entry atomically (another process may have stored the
+        # same stage meanwhile), then keep the cache within bounds
+        with self._lock:
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                if not os.path.isdir(entry_dir):
+                    raise
+                shutil.rmtree(tmp_dir)
+        if self.max_size_gb is not None:
+            self.prune(self.max_size_gb)
+
+    def entries(self):
+        """ List the cache entries, least recently used first
+
+        :return: Dicts with the key, stage, size (bytes) and last access
+        :rtype: list
+        """
+        entries = list()
+        if not os.path.isdir(self.root):
+            return entries
+        for key in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, key)
+            manifest_file = os.path.join(entry_dir, MANIFEST)
+            if '.tmp' in key or not os.path.isfile(manifest_file):
+                continue
+            manifest = self._read_json(manifest_file, dict())
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(entry_dir, filename))
+                    for filename in os.listdir(entry_dir))
+            except OSError:
+                continue  # evicted by another process meanwhile
+            entries.append({'key': key,
+                            'stage': manifest.get('stage'),
+                            'version': manifest.get('version'),
+                            'size': size,
+                            'last_access': os.path.getmtime(manifest_file)})
+        entries.sort(key=lambda entry: entry['last_access'])
+        return entries
+
+    def size(self):
+        """ Total size of the cache entries in bytes """
+        return sum(entry['size'] for entry in self.entries())
+
+    def prune(self, max_size_gb=0.):
+        """ Evict least recently used entries until the cache fits
+
+        :param max_size_gb: Size to shrink the cache to in GB (0 clears it)
+        :type max_size_gb: float
+
+        :return: The evicted entries
+        :rtype: list
+        """
+        evicted = list()
+        with self._lock:
+            entries = self.entries()
+            total = sum(entry['size'] for entry in entries)
+            for entry in entries:
+                if total <= max_size_gb * GIGABYTE:
+                    break
+                shutil.rmtree(os.path.join(self.root, entry['key']),
+                              ignore_errors=True)
+                total -= entry['size']
+                evicted.append(entry)
+        for entry in evicted:
+            self.log.notice("Evicted stage '{}' cache entry {}".format(
+                entry['stage'], entry['key']))
+        return evicted
+
+    # Helpers
+
+    @staticmethod
+    def _read_json(filename, default):
+        try:
+            with open(filename, 'r') as handle:
+                return json.load(handle)
+        except (IOError, OSError, ValueError):
+            return default
+
+    @staticmethod
+    def _write_json(filename, obj):
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_filename = filename + tmp_suffix()
+        with open(tmp_filename, 'w') as handle:
+            json.dump(obj, handle, indent=2, sort_keys=True, default=str)
+        os.rename(tmp_filename, filename)
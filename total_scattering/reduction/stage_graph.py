@@ -0,0 +1,357 @@
+from __future__ import (absolute_import, division, print_function)
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import \
+    FIRST_COMPLETED, \
+    ThreadPoolExecutor, \
+    wait
+
+from mantid.kernel import Logger
+
+from total_scattering.profiling import profile
+
+
+class Stage(object):
+    """ A step of a reduction with declared inputs and outputs
+
+    The stage function is called with one keyword argument per input and
+    must return a dict with one entry per output (or None if the stage
+    declares no outputs). Inputs and outputs are names of values in the
+    graph, typically workspace names or numbers derived from them.
+
+    :param name: Unique name of the stage
+    :type name: str
+    :param func: Callable that performs the stage
+    :type func: callable
+    :param inputs: Names of the values the stage reads
+    :type inputs: list
+    :param outputs: Names of the values the stage produces
+    :type outputs: list
+    :param after: Names of stages that must finish before this one even
+                  though no value is passed between them (ie they touch
+                  the same files)
+    :type after: list
+    :param params: Configuration the stage depends on, part of its cache key
+    :type params: dict
+    :param files: Input files (runs or filenames, each a comma separated
+                  string or list) the stage reads, part of its cache key
+    :type files: list
+    :param cacheable: If the outputs of the stage can be cached. Stages
+                      without outputs are never cached.
+    :type cacheable: bool
+    :param checkpoint: If the outputs of the stage are checkpointed so an
+                       interrupted run can resume after it
+    :type checkpoint: bool
+    :param key_stage: Stage this one stands in for (ie a copy of what it
+                      would load), whose name, inputs, configuration and
+                      files give the cache key instead
+    :type key_stage: Stage
+    """
+
+    def __init__(self, name, func, inputs=None, outputs=None, after=None,
+                 params=None, files=None, cacheable=True, checkpoint=False,
+                 key_stage=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs or [])
+        self.outputs = list(outputs or [])
+        self.after = list(after or [])
+        self.params = params or dict()
+        self.files = [names for names in (files or []) if names]
+        self.cacheable = cacheable and bool(self.outputs)
+        self.checkpoint = checkpoint and self.cacheable
+        self.key_stage = key_stage
+
+    def __repr__(self):
+        return "Stage({}: {} -> {})".format(
+            self.name, self.inputs, self.outputs)
+
+    def run(self, values):
+        """ Run the stage on the values computed so far
+
+        :param values: All values available in the graph
+        :type values: dict
+
+        :return: The values produced by this stage
+        :rtype: dict
+        """
+        kwargs = {key: values[key] for key in self.inputs}
+        results = self.func(**kwargs)
+        if results is None:
+            results = dict()
+        missing = [key for key in self.outputs if key not in results]
+        if missing:
+            msg = "Stage '{}' did not produce declared outputs {}"
+            raise RuntimeError(msg.format(self.name, missing))
+        return {key: results[key] for key in self.outputs}
+
+
+class StageGraph(object):
+    """ Dependency graph of stages, run by a scheduler that executes
+    independent branches concurrently
+
+    Dependencies are derived from the declared inputs and outputs: a stage
+    depends on the stage producing each of its inputs, plus any stages
+    listed in its `after` argument.
+    """
+
+    def __init__(self, name="StageGraph"):
+        self.name = name
+        self.stages = OrderedDict()
+        self.timings = OrderedDict()
+        self.log = Logger(name)
+
+    def add(self, stage):
+        """ Add a stage to the graph
+
+        :param stage: The stage to add
+        :type stage: Stage
+
+        :return: The added stage
+        :rtype: Stage
+        """
+        if stage.name in self.stages:
+            msg = "Stage '{}' is already in the graph"
+            raise RuntimeError(msg.format(stage.name))
+        self.stages[stage.name] = stage
+        return stage
+
+    def add_stage(self, name, func, inputs=None, outputs=None, after=None,
+                  **kwargs):
+        """ Convenience wrapper to create and add a `Stage` """
+        return self.add(Stage(name, func, inputs, outputs, after, **kwargs))
+
+    def producers(self):
+        """ Map each value name to the name of the stage that produces it
+
+        :return: Value name -> stage name
+        :rtype: dict
+        """
+        producers = dict()
+        for stage in self.stages.values():
+            for key in stage.outputs:
+                if key in producers:
+                    msg = "'{}' is produced by both '{}' and '{}'"
+                    raise RuntimeError(
+                        msg.format(key, producers[key], stage.name))
+                producers[key] = stage.name
+        return producers
+
+    def dependencies(self, initial=None):
+        """ Build the dependency graph of the stages
+
+        :param initial: Values provided before any stage runs
+        :type initial: dict
+
+        :return: Stage name -> set of stage names it depends on
+        :rtype: OrderedDict
+        """
+        initial = initial or dict()
+        producers = self.producers()
+        dependencies = OrderedDict()
+        for stage in self.stages.values():
+            depends_on = set()
+            for key in stage.inputs:
+                if key in producers:
+                    depends_on.add(producers[key])
+                elif key not in initial:
+                    msg = "No stage produces '{}', required by '{}'"
+                    raise RuntimeError(msg.format(key, stage.name))
+            for name in stage.after:
+                if name in self.stages:
+                    depends_on.add(name)
+            dependencies[stage.name] = depends_on
+        return dependencies
+
+    def subgraph(self, outputs, initial=None, skip=None):
+        """ Graph of the stages needed to produce some of the values
+
+        :param outputs: Names of the values to produce
+        :type outputs: list
+        :param initial: Values provided before any stage runs
+        :type initial: dict
+        :param skip: Names of stages only ordered before others (through
+                     `after`) to leave out, ie those writing files
+        :type skip: list
+
+        :return: Graph with the producers of `outputs` and everything
+                 upstream of them, in the same insertion order
+        :rtype: StageGraph
+        """
+        producers = self.producers()
+        dependencies = self.dependencies(initial)
+        needed = set()
+        skip = set(skip or [])
+        pending = [producers[key] for key in outputs if key in producers]
+        while pending:
+            name = pending.pop()
+            if name not in needed and name not in skip:
+                needed.add(name)
+                pending.extend(dependencies[name])
+
+        graph = StageGraph(self.name)
+        for name, stage in self.stages.items():
+            if name in needed:
+                graph.add(stage)
+        return graph
+
+    def order(self, initial=None):
+        """ Topological order of the stages, keeping insertion order
+        between stages that do not depend on each other
+
+        :param initial: Values provided before any stage runs
+        :type initial: dict
+
+        :return: Stage names in an order that satisfies the dependencies
+        :rtype: list
+        """
+        dependencies = self.dependencies(initial)
+        ordered = list()
+        done = set()
+        while len(ordered) < len(dependencies):
+            ready = [name for name, deps in dependencies.items()
+                     if name not in done and deps <= done]
+            if not ready:
+                remaining = [name for name in dependencies
+                             if name not in done]
+                msg = "Cycle detected between stages {}"
+                raise RuntimeError(msg.format(remaining))
+            ordered.extend(ready)
+            done.update(ready)
+        return ordered
+
+    def keys(self, cache, initial=None):
+        """ Compute the cache key of every stage
+
+        The key of a stage depends on the keys of the stages producing its
+        inputs, so a change anywhere upstream changes it too.
+
+        :param cache: Cache computing the key of a single stage
+        :type cache: StageCache
+        :param initial: Values provided before any stage runs
+        :type initial: dict
+
+        :return: Stage name -> key (None if the stage cannot be keyed)
+        :rtype: dict
+        """
+        initial = initial or dict()
+        producers = self.producers()
+        keys = dict()
+        for name in self.order(initial):
+            stage = self.stages[name].key_stage or self.stages[name]
+            upstream = dict()
+            for key in stage.inputs:
+                if key in producers:
+                    upstream[key] = keys[producers[key]]
+                else:
+                    upstream[key] = initial[key]
+            if any(value is None for key, value in upstream.items()
+                   if key in producers):
+                keys[name] = None
+            else:
+                keys[name] = cache.stage_key(stage, upstream)
+        return keys
+
+    def run(self, initial=None, max_workers=1, cache=None, checkpoints=None):
+        """ Run all the stages of the graph
+
+        With a single worker, the stages run one after another in the order
+        given by `order`. Otherwise, every stage whose dependencies are done
+        is submitted to a thread pool of `max_workers` threads.
+
+        :param initial: Values provided before any stage runs
+        :type initial: dict
+        :param max_workers: Maximum number of stages running at once
+        :type max_workers: int
+        :param cache: Cache to load unchanged stage outputs from and to
+                      store new ones in
+        :type cache: StageCache
+        :param checkpoints: Store for the outputs of checkpoint stages, to
+                            resume from if they are already in it
+        :type checkpoints: StageCache
+
+        :return: All values, the initial ones plus those from every stage
+        :rtype: dict
+        """
+        values = dict(initial or dict())
+        self.timings = OrderedDict()
+        producers = self.producers()
+
+        stores = list()
+        if cache is not None:
+            stores.append((cache, cache.caches))
+        if checkpoints is not None:
+            stores.append((checkpoints, lambda stage: stage.checkpoint))
+        keys = self.keys(stores[0][0], initial) if stores else dict()
+
+        # Outputs of cache hits are only loaded back into the ADS once a
+        # stage that has to run needs them
+        hits = dict()
+        restored = set()
+        restore_lock = threading.Lock()
+
+        def restore_inputs(stage):
+            with restore_lock:
+                for key in stage.inputs:
+                    name = producers.get(key)
+                    if name in hits and (name, key) not in restored:
+                        store, stage_key = hits[name]
+                        store.restore(stage_key, outputs=[key])
+                        restored.add((name, key))
+
+        def run_stage(name, values):
+            stage = self.stages[name]
+            key = keys.get(name)
+            start = time.time()
+            results = None
+            use_stores = [store for store, use in stores
+                          if key is not None and use(stage)]
+            for store in use_stores:
+                results = store.lookup(key)
+                if results is not None:
+                    hits[name] = (store, key)
+                    break
+            if results is None:
+                if hits:
+                    restore_inputs(stage)
+                self.log.notice("Running stage '{}'".format(name))
+                with profile('stage', name):
+                    results = stage.run(values)
+                for store in use_stores:
+                    store.store(key, name, results)
+            self.timings[name] = time.time() - start
+            self.log.notice("Stage '{}' took {:.2f} s".format(
+                name, self.timings[name]))
+            return results
+
+        if max_workers is None or max_workers <= 1:
+            for name in self.order(initial):
+                values.update(run_stage(name, values))
+            return values
+
+        dependencies = self.dependencies(initial)
+        self.order(initial)  # fail early on cycles
+        done = set()
+        running = dict()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while len(done) < len(dependencies):
+                for name, deps in dependencies.items():
+                    if name in done or name in running.values():
+                        continue
+                    if deps <= done:
+                        future = executor.submit(run_stage, name, dict(values))
+                        running[future] = name
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        values.update(future.result())
+                    except BaseException:
+                        for pending in running:
+                            pending.cancel()
+                        raise
+                    done.add(name)
+        return values
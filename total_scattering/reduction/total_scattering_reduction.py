@@ -2,7 +2,12 @@
 from __future__ import (absolute_import, division, print_function)
 
 import os
+import functools
+import multiprocessing
+import shutil
 import itertools
+import traceback
+from collections import OrderedDict
 import numpy as np
 from scipy.constants import Avogadro
 
@@ -15,9 +20,9 @@ from mantid.simpleapi import \
     ConvertToDistribution, \
     ConvertToHistogram,\
     ConvertUnits, \
-    CreateEmptyTableWorkspace, \
     CreateGroupingWorkspace, \
     CropWorkspaceRagged, \
+    DeleteWorkspace, \
     Divide, \
     FFTSmooth, \
     GenerateEventsFilter, \
@@ -36,12 +41,39 @@ from mantid.simpleapi import \
     SetUncertainties, \
     StripVanadiumPeaks
 
-from total_scattering.file_handling.load import load, create_absorption_wksp
-from total_scattering.file_handling.save import save_banks
+from total_scattering.file_handling.load import \
+    chain_jobs_sharing_files, \
+    create_absorption_wksp, \
+    load, \
+    reduction_properties_name, \
+    split_filenames
+from total_scattering.file_handling.nexus_writer import \
+    ProcessedNexusFiles, nexus_writer_settings
+from total_scattering.file_handling.save import \
+    BankWriter, save_banks, save_file
+from total_scattering.profiling import start_profiling, stop_profiling
+from total_scattering.reduction.fourier_transform import \
+    fourier_transform_settings, transform_workspace
+from total_scattering.reduction.merging import merge_workspace
+from total_scattering.inelastic.howells import HowellsWarmStarts
 from total_scattering.inelastic.placzek import \
-    CalculatePlaczekSelfScattering, \
-    FitIncidentSpectrum, \
-    GetIncidentSpectrumFromMonitor
+    CalculatePlaczekSelfScattering
+from total_scattering.reduction.incident_cache import \
+    IncidentSpectrumCache, \
+    fitted_incident_spectrum, \
+    incident_cache_settings, \
+    warm_starts_file
+from total_scattering.reduction.run_cache import \
+    RunCache, \
+    run_cache_settings
+from total_scattering.reduction.stage_cache import \
+    StageCache, \
+    cache_settings
+from total_scattering.reduction.stage_graph import Stage, StageGraph
+from total_scattering.reduction.vanadium_library import \
+    VanadiumLibrary, \
+    describe_vanadium, \
+    library_dir
 
 
 # Constants
@@ -49,32 +81,21 @@ MS_AND_ABS_CORR_WARNING = (
     "The multiple scattering option should not be used with the "
     "absorption correction set")
 
+# Options that do not change the results of the stages
+RUNTIME_OPTIONS = ['AsyncSave', 'CacheDir', 'Checkpoints', 'DiagnosticsFile',
+                   'DiagnosticsLevel', 'HowellsWarmStarts',
+                   'IncidentSpectrumCache', 'MaxWorkers', 'Profile', 'Resume',
+                   'RunCache', 'RunWorkers', 'StageCache']
 
-# Utilities
-def generate_cropping_table(qmin, qmax):
-    ''' Generate a Table workspace that can be used to crop
-    another workspace in reciprocal space (ie MomentumTransfer)
-
-    :param qmin: list of Qmin values to crop each spectra by
-    :type qmin: str (example: '0.2,0.4,1.0')
-    :param qmax: list of Qmax values to crop each spectra by
-    :type qmax: str (example: '10.5,12.0,40.0')
-
-    :return: Cropping table with columns of ("SpectraList","Xmin","Xmax")
-    :rtype: TableWorkspace
-    '''
-    mask_info = CreateEmptyTableWorkspace()
-    mask_info.addColumn("str", "SpectraList")
-    mask_info.addColumn("double", "XMin")
-    mask_info.addColumn("double", "XMax")
-    for (i, value) in enumerate(qmin):
-        mask_info.addRow([str(i), 0.0, value])
-    for (i, value) in enumerate(qmax):
-        mask_info.addRow([str(i), value, 100.0])
+# Prefix of the stages writing the outputs of another stage to files
+SAVE_STAGE_PREFIX = 'save_'
 
-    return mask_info
+# How much of the intermediate steps is written to the diagnostics file,
+# from least to most: only the final output, a few key steps, every step
+DIAGNOSTICS_LEVELS = ['none', 'key', 'full']
 
 
+# Utilities
 def get_each_spectra_xmin_xmax(wksp):
     ''' Get Xmin and Xmax lists for Workspace, excluding
     values of inf and NaN
@@ -336,6 +357,12 @@ def extract_key_match_from_dict(keys, dictionary):
         raise Exception(e)
 
 
+def is_requested(correction):
+    """ If a correction from the JSON input (ie `AbsorptionCorrection`) has
+    a type set """
+    return bool(correction and correction.get("Type"))
+
+
 def get_sample(config):
     """ Extract the sample section from JSON input
 
@@ -365,6 +392,96 @@ def get_normalization(config):
 
 
 def TotalScatteringReduction(config=None):
+    settings = configure_reduction(config)
+    if not settings['profile']:
+        return run_reduction(config, settings)
+
+    # Report where time and memory go, even if the reduction fails
+    profiler = start_profiling(settings['title'])
+    try:
+        return run_reduction(config, settings)
+    finally:
+        stop_profiling()
+        report = os.path.join(os.path.abspath(settings['OutputDir']),
+                              settings['title'] + '_profile.json')
+        profiler.write(report)
+        settings['log'].notice("Wrote profile to {}".format(report))
+
+
+def run_reduction(config, settings):
+    """ Run the stages of a reduction
+
+    :param config: JSON input for reduction
+    :type config: dict
+    :param settings: Settings from `configure_reduction`
+    :type settings: dict
+
+    :return: The reduced workspace
+    :rtype: MatrixWorkspace
+    """
+    if settings['vanadium_library'] is not None:
+        settings['vanadium_key'] = prepared_vanadium_key(settings)
+    graph = build_reduction_graph(settings)
+    cache_args = cache_settings(config)
+    cache = StageCache(**cache_args) if cache_args else None
+
+    checkpoints = None
+    checkpoint_dir = settings['checkpoint_dir']
+    if checkpoint_dir:
+        if not settings['resume'] and os.path.isdir(checkpoint_dir):
+            shutil.rmtree(checkpoint_dir)
+        checkpoints = StageCache(checkpoint_dir, checksum_files=False)
+
+    # Diagnostics are written in the background while the stages run, to
+    # files opened once for the whole reduction
+    writer = BankWriter() if settings['async_save'] else None
+    settings['bank_writer'] = writer
+    nexus_args = settings['nexus_writer']
+    nexus_files = ProcessedNexusFiles(**nexus_args) if nexus_args else None
+    settings['nexus_files'] = nexus_files
+    try:
+        values = graph.run(
+            initial=initial_values(settings),
+            max_workers=settings['max_workers'],
+            cache=cache,
+            checkpoints=checkpoints)
+    except BaseException:
+        if writer is not None:
+            settings['bank_writer'] = None
+            try:
+                writer.close()
+            except Exception:
+                settings['log'].error("Could not write diagnostics:\n{}".format(
+                    traceback.format_exc()))
+        raise
+    else:
+        if writer is not None:
+            settings['bank_writer'] = None
+            writer.close()
+    finally:
+        if nexus_files is not None:
+            settings['nexus_files'] = None
+            nexus_files.close()
+
+    # Checkpoints are only needed until the reduction succeeds
+    if checkpoint_dir:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(checkpoint_dir))
+        except OSError:
+            pass  # checkpoints of other reductions are left
+    return mtd[values['result']]
+
+
+def configure_reduction(config):
+    """ Parse the JSON input into the settings shared by all the stages
+
+    :param config: JSON input for reduction
+    :type config: dict
+
+    :return: Settings used by the reduction stages
+    :rtype: dict
+    """
     facility = config['Facility']
     title = config['Title']
     instr = config['Instrument']
@@ -407,12 +524,64 @@ def TotalScatteringReduction(config=None):
     merging = config['Merging']
     binning = merging['QBinning']
     characterizations = merging.get('Characterizations', None)
+    sum_banks = merging.get('SumBanks', None)
 
     # Grouping
     grouping = merging.get('Grouping', None)
     cache_dir = config.get("CacheDir", os.path.abspath('.'))
     OutputDir = config.get("OutputDir", os.path.abspath('.'))
 
+    # Number of workers for stages that can run concurrently (1 == serial)
+    max_workers = config.get("MaxWorkers", 1)
+
+    # Number of processes focusing the runs of a multi-run load (1 == serial).
+    # Each of the MaxWorkers stages running at once may start that many, so
+    # together they are kept within the number of CPUs.
+    run_workers = config.get("RunWorkers", 1)
+    cpu_share = max(multiprocessing.cpu_count() // max(max_workers or 1, 1), 1)
+    if run_workers is not None and run_workers > cpu_share:
+        msg = "RunWorkers {} capped at {} ({} CPUs shared by {} MaxWorkers)"
+        log.warning(msg.format(run_workers, cpu_share,
+                               multiprocessing.cpu_count(), max_workers))
+        run_workers = cpu_share
+
+    # Intermediate steps written out, steps only needed for the skipped
+    # ones are not computed
+    diagnostics_level = config.get("DiagnosticsLevel", "full")
+    if diagnostics_level not in DIAGNOSTICS_LEVELS:
+        msg = "Unknown DiagnosticsLevel '{}', expected one of {}"
+        raise RuntimeError(msg.format(diagnostics_level, DIAGNOSTICS_LEVELS))
+
+    # Cache of focused runs, so that only runs added since the last
+    # reduction are focused
+    run_cache = None
+    if run_cache_settings(config):
+        run_cache = RunCache(**run_cache_settings(config))
+
+    # Cache of fitted incident spectra for the Placzek correction
+    incident_cache = None
+    if incident_cache_settings(config):
+        incident_cache = IncidentSpectrumCache(
+            **incident_cache_settings(config))
+
+    # Howells function parameters fitted earlier, per instrument and
+    # moderator, to start the next fits from
+    warm_starts = None
+    if warm_starts_file(config):
+        warm_starts = HowellsWarmStarts(warm_starts_file(config))
+
+    # Checkpoints written after each step to resume an interrupted run,
+    # only when asked for since they copy every intermediate workspace
+    checkpoint_dir = None
+    if config.get("Checkpoints", False):
+        checkpoint_dir = os.path.join(
+            os.path.abspath(OutputDir), '.checkpoints', title)
+
+    # Library of prepared vanadium, reused instead of preparing it again
+    vanadium_library = None
+    if library_dir(config):
+        vanadium_library = VanadiumLibrary(library_dir(config))
+
     # Create Nexus file basenames
     sample['Runs'] = expand_ints(sample['Runs'])
     sample['Background']['Runs'] = expand_ints(
@@ -420,7 +589,6 @@ def TotalScatteringReduction(config=None):
 
     '''
     Currently not implemented:
-    # wkspIndices = merging.get('SumBanks', None)
     # high_q_linear_fit_range = config['HighQLinearFitRange']
 
     POWGEN options not used
@@ -497,20 +665,6 @@ def TotalScatteringReduction(config=None):
     if sam_abs_corr and sam_ms_corr:
         log.warning(MS_AND_ABS_CORR_WARNING)
 
-    # Compute the absorption correction on the sample if it was provided
-    sam_abs_ws = ''
-    con_abs_ws = ''
-    if sam_abs_corr:
-        msg = "Applying '{}' absorption correction to sample"
-        log.notice(msg.format(sam_abs_corr["Type"]))
-        sam_abs_ws, con_abs_ws = create_absorption_wksp(
-            sam_scans,
-            sam_abs_corr["Type"],
-            sam_geo_dict,
-            sam_mat_dict,
-            sam_env_dict,
-            **config)
-
     # Get vanadium corrections
     van_mass_density = van.get('MassDensity', van_mass_density)
     van_packing_fraction = van.get(
@@ -525,18 +679,6 @@ def TotalScatteringReduction(config=None):
     if van_abs_corr["Type"] and van_ms_corr["Type"]:
         log.warning(MS_AND_ABS_CORR_WARNING)
 
-    # Compute the absorption correction for the vanadium if provided
-    van_abs_corr_ws = ''
-    if van_abs_corr:
-        msg = "Applying '{}' absorption correction to vanadium"
-        log.notice(msg.format(van_abs_corr["Type"]))
-        van_abs_corr_ws, van_con_ws = create_absorption_wksp(
-            van_scans,
-            van_abs_corr["Type"],
-            van_geo_dict,
-            van_mat_dict,
-            **config)
-
     alignAndFocusArgs = dict()
     alignAndFocusArgs['CalFilename'] = config['Calibration']['Filename']
     # alignAndFocusArgs['GroupFilename'] don't use
@@ -553,13 +695,561 @@ def TotalScatteringReduction(config=None):
         alignAndFocusArgs.update(otherArgs)
 
     # Setup grouping
-    output_grouping = False
     grp_wksp = "wksp_output_group"
-
     if grouping:
         if 'Initial' in grouping:
             if grouping['Initial'] and not grouping['Initial'] == u'':
                 alignAndFocusArgs['GroupFilename'] = grouping['Initial']
+    else:
+        # Setup the 6 bank method if no grouping specified
+        alignAndFocusArgs['GroupingWorkspace'] = grp_wksp
+
+    return {
+        'config': config,
+        'log': log,
+        'facility': facility,
+        'title': title,
+        'instr': instr,
+        'sample': sample,
+        'sam_mass_density': sam_mass_density,
+        'sam_packing_fraction': sam_packing_fraction,
+        'sam_geometry': sam_geometry,
+        'sam_material': sam_material,
+        'sam_geo_dict': sam_geo_dict,
+        'sam_mat_dict': sam_mat_dict,
+        'sam_env_dict': sam_env_dict,
+        'van': van,
+        'van_mass_density': van_mass_density,
+        'van_packing_fraction': van_packing_fraction,
+        'van_geometry': van_geometry,
+        'van_material': van_material,
+        'van_geo_dict': van_geo_dict,
+        'van_mat_dict': van_mat_dict,
+        'binning': binning,
+        'characterizations': characterizations,
+        'sum_banks': sum_banks,
+        'grouping': grouping,
+        'OutputDir': OutputDir,
+        'max_workers': max_workers,
+        'run_workers': run_workers,
+        'run_cache': run_cache,
+        'incident_cache': incident_cache,
+        'warm_starts': warm_starts,
+        'diagnostics_level': diagnostics_level,
+        'async_save': config.get("AsyncSave", True),
+        'bank_writer': None,
+        'nexus_writer': nexus_writer_settings(config),
+        'nexus_files': None,
+        'checkpoint_dir': checkpoint_dir,
+        'resume': config.get("Resume", False),
+        'profile': config.get("Profile", False),
+        'vanadium_library': vanadium_library,
+        'vanadium_key': None,
+        'facility_file_format': facility_file_format,
+        'sam_scans': sam_scans,
+        'container_scans': container_scans,
+        'container_bg_scans': container_bg,
+        'van_scans': van_scans,
+        'van_bg_scans': van_bg_scans,
+        'nexus_filename': nexus_filename,
+        'fourier_transform': fourier_transform_settings(config),
+        'sam_abs_corr': sam_abs_corr,
+        'sam_ms_corr': sam_ms_corr,
+        'sam_inelastic_corr': sam_inelastic_corr,
+        'van_abs_corr': van_abs_corr,
+        'van_ms_corr': van_ms_corr,
+        'van_inelastic_corr': van_inelastic_corr,
+        'alignAndFocusArgs': alignAndFocusArgs,
+        'grp_wksp': grp_wksp,
+    }
+
+
+def initial_values(settings):
+    """ Values of the reduction graph that are not produced by a stage,
+    ie the optional backgrounds and absorption corrections that are not part
+    of the input
+
+    :param settings: Settings from `configure_reduction`
+    :type settings: dict
+
+    :return: Value name -> value
+    :rtype: dict
+    """
+    values = dict()
+    if not is_requested(settings['sam_abs_corr']):
+        values['sam_abs_ws'] = ''
+        values['con_abs_ws'] = ''
+    if not is_requested(settings['van_abs_corr']):
+        values['van_abs_ws'] = ''
+    if settings['container_bg_scans'] is None:
+        values['container_bg'] = None
+    if settings['van_bg_scans'] is None:
+        values['van_bg'] = None
+    if not settings['characterizations']:
+        values['qmin'] = None
+        values['qmax'] = None
+    return values
+
+
+def build_reduction_graph(settings):
+    """ Build the graph of stages for a total scattering reduction
+
+    :param settings: Settings from `configure_reduction`
+    :type settings: dict
+
+    :return: The reduction graph
+    :rtype: StageGraph
+    """
+    graph = StageGraph("TotalScatteringReduction")
+
+    # Settings that affect the stages, part of their cache keys. Options
+    # that only change how the reduction runs are left out.
+    params = dict(settings)
+    params['alignAndFocusArgs'] = {
+        key: value for key, value in settings['alignAndFocusArgs'].items()
+        if key not in RUNTIME_OPTIONS}
+    # Entries of the JSON input read by create_absorption_wksp
+    params['absorption_args'] = {
+        key: value for key, value in settings['config'].items()
+        if key in ['AlignAndFocusArgs', 'props', 'characterization_files']}
+
+    # Stages taken from a cache or a checkpoint do not run, so the outputs
+    # of a stage are written to the diagnostics and output files by a
+    # `save_<stage>` stage that always runs. Stages also writing some of
+    # their intermediate steps are only cached when these are not written.
+    save_stages = list()
+
+    def add(func, inputs=None, outputs=None, after=None, uses=None,
+            files=None, cacheable=True, checkpoint=False, saves=None,
+            writes=None):
+        if writes is not None and diagnostics_enabled(settings, writes):
+            cacheable = False
+        graph.add_stage(
+            func.__name__, functools.partial(func, settings),
+            inputs=inputs, outputs=outputs, after=after,
+            params={name: params[name] for name in uses or []},
+            files=files, cacheable=cacheable, checkpoint=checkpoint)
+
+        saves = [save for save in saves or []
+                 if diagnostics_enabled(settings, save.get('Level', 'full'))]
+        if saves:
+            save_inputs = list()
+            for save in saves:
+                for key in ['InputWorkspace', 'TitleFrom']:
+                    if key in save and save[key] not in save_inputs:
+                        save_inputs.append(save[key])
+            graph.add_stage(
+                SAVE_STAGE_PREFIX + func.__name__,
+                functools.partial(save_stage_outputs, settings, saves),
+                inputs=save_inputs,
+                cacheable=False)
+            save_stages.append(SAVE_STAGE_PREFIX + func.__name__)
+
+    # Files read while loading, besides the runs
+    grouping = settings['grouping'] or dict()
+    load_files = [settings['alignAndFocusArgs']['CalFilename'],
+                  grouping.get('Initial')]
+    load_uses = ['alignAndFocusArgs', 'facility', 'instr']
+
+    # Take the vanadium from the library if it was prepared already
+    library = settings['vanadium_library']
+    library_key = settings['vanadium_key']
+    prepared = library is not None and library_key is not None \
+        and library.lookup(library_key) is not None
+
+    # The container background, and the sample and container without
+    # background subtraction, are only written out with full diagnostics
+    full_diagnostics = diagnostics_enabled(settings, 'full')
+    container_bg_scans = settings['container_bg_scans']
+    if not full_diagnostics:
+        container_bg_scans = None
+
+    add(setup_grouping,
+        outputs=['grp_wksp'],
+        uses=['instr', 'grouping', 'grp_wksp'],
+        files=[settings['alignAndFocusArgs']['CalFilename'],
+               grouping.get('Output')],
+        cacheable=False)
+    # Absorption corrections are only computed if requested, so that the
+    # vanadium and container stages do not depend on the sample otherwise
+    if is_requested(settings['sam_abs_corr']):
+        add(compute_sample_absorption,
+            outputs=['sam_abs_ws', 'con_abs_ws'],
+            uses=['absorption_args', 'sam_abs_corr', 'sam_geo_dict',
+                  'sam_mat_dict', 'sam_env_dict'],
+            files=[settings['sam_scans']],
+            checkpoint=True)
+    if is_requested(settings['van_abs_corr']) and not prepared:
+        add(compute_vanadium_absorption,
+            outputs=['van_abs_ws'],
+            uses=['absorption_args', 'van_abs_corr', 'van_geo_dict',
+                  'van_mat_dict'],
+            files=[settings['van_scans']],
+            checkpoint=True)
+
+    # Loads without sample specific corrections give the same workspace for
+    # the same runs, so each run set is loaded once and cloned for the other
+    # roles (ie a container background that is also the vanadium background)
+    plain_loads = OrderedDict()  # stage -> (runs, workspace, output)
+    if not is_requested(settings['sam_abs_corr']):
+        plain_loads['load_container'] = (
+            settings['container_scans'], 'container', 'container')
+    if container_bg_scans is not None:
+        plain_loads['load_container_background'] = (
+            container_bg_scans, 'container_background', 'container_bg')
+    if settings['van_bg_scans'] is not None and not prepared:
+        plain_loads['load_vanadium_background'] = (
+            settings['van_bg_scans'], 'vanadium_background', 'van_bg')
+    clones = OrderedDict()  # stage -> stage loading the same runs
+    for name, (runs, _, _) in plain_loads.items():
+        for other in plain_loads:
+            if other == name:
+                break
+            if other not in clones and \
+                    split_filenames(plain_loads[other][0]) == \
+                    split_filenames(runs):
+                clones[name] = other
+                break
+
+    # Loads reading the same file must not run at the same time, since
+    # AlignAndFocusPowderFromFiles names intermediates after the file
+    load_stages = OrderedDict()
+    load_stages['load_sample'] = settings['sam_scans']
+    load_stages['load_container'] = settings['container_scans']
+    if container_bg_scans is not None and \
+            'load_container_background' not in clones:
+        load_stages['load_container_background'] = container_bg_scans
+    if not prepared:
+        load_stages['load_vanadium'] = settings['van_scans']
+    if settings['van_bg_scans'] is not None and not prepared and \
+            'load_vanadium_background' not in clones:
+        load_stages['load_vanadium_background'] = settings['van_bg_scans']
+    chains = chain_jobs_sharing_files(OrderedDict(
+        (name, {'input_files': files})
+        for name, files in load_stages.items()))
+    after = dict()
+    for chain in chains:
+        for previous, name in zip(chain[:-1], chain[1:]):
+            after[name] = [previous]
+
+    add(load_sample,
+        inputs=['grp_wksp', 'sam_abs_ws'],
+        outputs=['sam_wksp', 'natoms'],
+        after=after.get('load_sample'),
+        uses=load_uses + ['sam_geometry', 'sam_material',
+                          'sam_mass_density', 'sam_packing_fraction'],
+        files=load_files + [settings['sam_scans']],
+        checkpoint=True,
+        saves=[{'InputWorkspace': 'sam_wksp',
+                'Title': 'sample_and_container'}])
+    add(load_container,
+        inputs=['grp_wksp', 'con_abs_ws'],
+        outputs=['container'],
+        after=after.get('load_container'),
+        uses=load_uses,
+        files=load_files + [settings['container_scans']],
+        checkpoint=True,
+        saves=[{'InputWorkspace': 'container', 'Title': 'container'}])
+    if 'load_container_background' in load_stages:
+        add(load_container_background,
+            inputs=['grp_wksp'],
+            outputs=['container_bg'],
+            after=after.get('load_container_background'),
+            uses=load_uses,
+            files=load_files + [container_bg_scans],
+            checkpoint=True,
+            saves=[{'InputWorkspace': 'container_bg',
+                    'Title': 'container_background'}])
+    if not prepared:
+        add(load_vanadium,
+            inputs=['grp_wksp', 'van_abs_ws'],
+            outputs=['van_wksp', 'nvan_atoms'],
+            after=after.get('load_vanadium'),
+            uses=load_uses + ['van_geometry', 'van_material',
+                              'van_mass_density'],
+            files=load_files + [settings['van_scans']],
+            checkpoint=True,
+            saves=[{'InputWorkspace': 'van_wksp',
+                    'Title': 'vanadium_and_background'}])
+    if 'load_vanadium_background' in load_stages:
+        add(load_vanadium_background,
+            inputs=['grp_wksp'],
+            outputs=['van_bg'],
+            after=after.get('load_vanadium_background'),
+            uses=load_uses,
+            files=load_files + [settings['van_bg_scans']],
+            checkpoint=True,
+            saves=[{'InputWorkspace': 'van_bg',
+                    'Title': 'vanadium_background'}])
+    # Clones are keyed like the background load they replace, so that the
+    # stages downstream of them have the same keys whether the runs were
+    # loaded or cloned
+    for name, source in clones.items():
+        runs, ws_name, output = plain_loads[name]
+        load = Stage(
+            name, None,
+            inputs=['grp_wksp'],
+            outputs=[output],
+            params={key: params[key] for key in load_uses},
+            files=load_files + [runs])
+        graph.add_stage(
+            name.replace('load_', 'clone_'),
+            functools.partial(clone_run_set, settings, ws_name, output),
+            inputs=[plain_loads[source][2]],
+            outputs=[output],
+            cacheable=False,
+            key_stage=load)
+
+    if settings['characterizations']:
+        add(determine_characterizations,
+            inputs=['sam_wksp'],
+            outputs=['qmin', 'qmax'],
+            uses=['characterizations'])
+
+    # STEP 1: Subtract Backgrounds
+    if full_diagnostics:
+        add(copy_raw_workspaces,
+            inputs=['sam_wksp', 'container'],
+            outputs=['sam_raw', 'container_raw'],
+            checkpoint=True)
+    add(subtract_sample_background,
+        inputs=['sam_wksp', 'container'],
+        after=['determine_characterizations', 'copy_raw_workspaces'],
+        outputs=['sam_minus_back', 'container_matched'],
+        checkpoint=True,
+        saves=[{'InputWorkspace': 'sam_minus_back',
+                'Title': 'sample_minus_back', 'Level': 'key'}])
+    if full_diagnostics:
+        add(subtract_container_background,
+            inputs=['container_matched', 'container_bg'],
+            outputs=['container_minus_back', 'container_bg_matched'],
+            checkpoint=True,
+            saves=[{'InputWorkspace': 'container_minus_back',
+                    'Title': 'container_minus_back'}])
+    if not prepared:
+        add(subtract_vanadium_background,
+            inputs=['van_wksp', 'van_bg'],
+            outputs=['van_minus_back', 'van_bg_matched'],
+            checkpoint=True,
+            saves=[{'InputWorkspace': 'van_minus_back',
+                    'Title': 'vanadium_minus_back', 'Level': 'key'}])
+
+    # STEP 2.0: Prepare vanadium as normalization calibrant
+    vanadium_saves = [{'InputWorkspace': 'van_corrected',
+                       'Title': prepared_vanadium_title(settings),
+                       'Level': 'key'}]
+    if prepared:
+        add(load_prepared_vanadium,
+            outputs=['van_corrected', 'nvan_atoms', 'van_bg_matched'],
+            uses=['vanadium_key'],
+            cacheable=False,
+            saves=vanadium_saves)
+    else:
+        add(prepare_vanadium,
+            inputs=['van_minus_back'],
+            outputs=['van_corrected'],
+            uses=['van', 'van_abs_corr', 'van_ms_corr', 'van_inelastic_corr',
+                  'van_mass_density', 'van_scans', 'alignAndFocusArgs',
+                  'binning', 'facility_file_format', 'instr'],
+            checkpoint=True,
+            saves=vanadium_saves,
+            writes='full')
+    if library_key is not None and not prepared:
+        add(store_prepared_vanadium,
+            inputs=['van_corrected', 'nvan_atoms', 'van_bg_matched'])
+
+    # STEP 2.1: Normalize by Vanadium
+    add(rebin_vanadium,
+        inputs=['van_corrected'],
+        outputs=['van_normalization'],
+        after=['store_prepared_vanadium'],
+        uses=['binning'])
+    add(normalize_sample,
+        inputs=['sam_minus_back', 'van_normalization'],
+        outputs=['sam_normalized', 'sam_normalized_title'],
+        uses=['binning'],
+        checkpoint=True,
+        saves=[{'InputWorkspace': 'sam_normalized',
+                'TitleFrom': 'sam_normalized_title', 'Level': 'key'},
+               # Initial I(Q) of the sample
+               {'InputWorkspace': 'sam_normalized', 'Title': 'IQ_banks',
+                'Filename': settings['title'] + '_initial_iofq_banks.nxs',
+                'Level': 'key'}])
+    if full_diagnostics:
+        add(normalize_raw_workspaces,
+            inputs=['sam_raw', 'container_raw', 'van_normalization'])
+        add(normalize_backgrounds,
+            inputs=['container_minus_back', 'container_bg_matched',
+                    'van_bg_matched', 'van_normalization'])
+
+    # STEP 3 & 4: Subtract multiple scattering and apply absorption correction
+    sample_corrected = settings['sam_abs_corr'] and settings['sam_ms_corr']
+    add(correct_sample_ms_and_absorption,
+        inputs=['sam_normalized', 'sam_normalized_title'],
+        outputs=['sam_corrected', 'sam_corrected_title'],
+        uses=['sam_abs_corr', 'sam_ms_corr', 'sample'],
+        checkpoint=True,
+        saves=[{'InputWorkspace': 'sam_corrected',
+                'TitleFrom': 'sam_corrected_title'}]
+        if sample_corrected else None)
+
+    # STEP 5: Divide by number of atoms in sample
+    add(normalize_by_atoms,
+        inputs=['sam_corrected', 'sam_corrected_title', 'natoms',
+                'nvan_atoms'],
+        outputs=['sam_norm_by_atoms', 'sam_norm_by_atoms_title'],
+        checkpoint=True,
+        saves=[{'InputWorkspace': 'sam_norm_by_atoms',
+                'TitleFrom': 'sam_norm_by_atoms_title'}])
+
+    # STEP 6: Divide by total scattering length squared
+    sample_placzek = settings['sam_inelastic_corr']['Type'] == "Placzek"
+    add(multiply_by_vanadium_self_scattering,
+        inputs=['sam_norm_by_atoms', 'sam_norm_by_atoms_title',
+                'van_normalization'],
+        outputs=['sam_scaled', 'sam_scaled_title'],
+        checkpoint=True,
+        saves=[{'InputWorkspace': 'sam_scaled',
+                'TitleFrom': 'sam_scaled_title',
+                'Level': 'full' if sample_placzek else 'key'}])
+
+    # STEP 7: Inelastic correction
+    add(correct_sample_inelastic,
+        inputs=['sam_scaled', 'sam_scaled_title'],
+        outputs=['sam_inelastic_corrected', 'sam_inelastic_corrected_title'],
+        uses=['sample', 'sam_material', 'sam_mass_density',
+              'sam_inelastic_corr', 'sam_scans', 'alignAndFocusArgs',
+              'binning', 'facility_file_format', 'instr'],
+        checkpoint=True,
+        saves=[{'InputWorkspace': 'sam_inelastic_corrected',
+                'TitleFrom': 'sam_inelastic_corrected_title',
+                'Level': 'key'}] if sample_placzek else None,
+        writes='full' if sample_placzek else None)
+
+    # Output spectrum
+    add(output_spectrum,
+        inputs=['sam_inelastic_corrected', 'van_normalization'],
+        outputs=['result', 'sq_banks'],
+        cacheable=False)
+
+    # Total S(Q) from the banks, each cropped to its Q range
+    if settings['sum_banks'] is not None or settings['fourier_transform']:
+        add(merge_banks,
+            inputs=['sq_banks', 'qmin', 'qmax'],
+            outputs=['sq_merged'],
+            cacheable=False)
+
+    # Pair distribution function
+    if settings['fourier_transform']:
+        add(transform_to_gofr,
+            inputs=['sq_banks', 'sq_merged'],
+            outputs=['gofr_banks', 'gofr_merged'],
+            cacheable=False)
+
+    # Clones have to be taken, and outputs saved, before the workspace is
+    # changed in place by the next stages. Stages only reading it are left
+    # in any order.
+    readers = set(save_stages) | set(
+        name.replace('load_', 'clone_') for name in clones)
+    for name, source in clones.items():
+        clone = name.replace('load_', 'clone_')
+        for stage in graph.stages.values():
+            if plain_loads[source][2] in stage.inputs \
+                    and stage.name not in readers:
+                stage.after.append(clone)
+    for name in save_stages:
+        saved = set(graph.stages[name].inputs)
+        for stage in graph.stages.values():
+            if saved & set(stage.inputs) and stage.name not in readers:
+                stage.after.append(name)
+
+    return graph
+
+
+def diagnostics_enabled(settings, Level):
+    """ If steps of a diagnostics level are written with the
+    `DiagnosticsLevel` of the reduction
+
+    :param settings: Settings from `configure_reduction`
+    :type settings: dict
+    :param Level: Level of the step, one of `DIAGNOSTICS_LEVELS`
+    :type Level: str
+    """
+    return DIAGNOSTICS_LEVELS.index(settings['diagnostics_level']) >= \
+        DIAGNOSTICS_LEVELS.index(Level)
+
+
+def save_diagnostics(settings, InputWorkspace, Title, Filename=None,
+                     Level='full', Rebin=True):
+    """ Save a workspace bank-by-bank to the diagnostics NeXus file (or
+    `Filename` if given) using the output grouping and Q binning
+
+    :param settings: Settings from `configure_reduction`
+    :type settings: dict
+    :param InputWorkspace: Workspace to save
+    :type InputWorkspace: str
+    :param Title: Title of the entry in the NeXus file
+    :type Title: str
+    :param Filename: Output filename, defaults to the diagnostics file
+    :type Filename: str
+    :param Level: Lowest `DiagnosticsLevel` writing the workspace, `none`
+                  for the final output
+    :type Level: str
+    :param Rebin: If the workspace is rebinned to the output Q binning,
+                  False for workspaces that are not in Q
+    :type Rebin: bool
+    """
+    if not diagnostics_enabled(settings, Level):
+        return
+    save = save_banks
+    if settings['bank_writer'] is not None:
+        save = settings['bank_writer'].save_banks
+    save(
+        InputWorkspace=InputWorkspace,
+        Filename=Filename or settings['nexus_filename'],
+        Title=Title,
+        OutputDir=settings['OutputDir'],
+        GroupingWorkspace=settings['grp_wksp'],
+        Binning=settings['binning'] if Rebin else None,
+        NexusFiles=settings['nexus_files'])
+
+
+def save_stage_outputs(settings, saves, **values):
+    """ Save the outputs of a stage with `save_diagnostics`
+
+    :param settings: Settings from `configure_reduction`
+    :type settings: dict
+    :param saves: Arguments of each `save_diagnostics` call, with the value
+                  holding the workspace as `InputWorkspace` and, instead of
+                  `Title`, the value holding the title as `TitleFrom`
+    :type saves: list
+    :param values: Outputs of the stage
+    :type values: dict
+    """
+    for save in saves:
+        save = dict(save)
+        workspace = values[save.pop('InputWorkspace')]
+        if workspace is None:
+            continue
+        if 'TitleFrom' in save:
+            save['Title'] = values[save.pop('TitleFrom')]
+        save_diagnostics(settings, workspace, **save)
+
+
+# -------------------------------------------------------------------------
+# Reduction stages
+#
+# Each stage takes the settings from `configure_reduction` followed by its
+# declared inputs as keyword arguments and returns a dict of its outputs.
+
+
+def setup_grouping(settings):
+    instr = settings['instr']
+    grouping = settings['grouping']
+    grp_wksp = settings['grp_wksp']
+
+    output_grouping = False
+    if grouping:
         if 'Output' in grouping:
             if grouping['Output'] and not grouping['Output'] == u'':
                 output_grouping = True
@@ -567,7 +1257,7 @@ def TotalScatteringReduction(config=None):
                                           OutputWorkspace=grp_wksp)
     # If no output grouping specified, create it with Calibration Grouping
     if not output_grouping:
-        LoadDiffCal(alignAndFocusArgs['CalFilename'],
+        LoadDiffCal(settings['alignAndFocusArgs']['CalFilename'],
                     InstrumentName=instr,
                     WorkspaceName=grp_wksp.replace('_group', ''),
                     MakeGroupingWorkspace=True,
@@ -579,159 +1269,184 @@ def TotalScatteringReduction(config=None):
         CreateGroupingWorkspace(InstrumentName=instr,
                                 GroupDetectorsBy='Group',
                                 OutputWorkspace=grp_wksp)
-        alignAndFocusArgs['GroupingWorkspace'] = grp_wksp
-
+    return {'grp_wksp': grp_wksp}
+
+
+def compute_sample_absorption(settings):
+    # Compute the absorption correction on the sample
+    sam_abs_corr = settings['sam_abs_corr']
+    msg = "Applying '{}' absorption correction to sample"
+    settings['log'].notice(msg.format(sam_abs_corr["Type"]))
+    sam_abs_ws, con_abs_ws = create_absorption_wksp(
+        settings['sam_scans'],
+        sam_abs_corr["Type"],
+        settings['sam_geo_dict'],
+        settings['sam_mat_dict'],
+        settings['sam_env_dict'],
+        **settings['config'])
+
+    return {'sam_abs_ws': sam_abs_ws,
+            'con_abs_ws': con_abs_ws}
+
+
+def compute_vanadium_absorption(settings):
+    # Compute the absorption correction for the vanadium
+    van_abs_corr = settings['van_abs_corr']
+    msg = "Applying '{}' absorption correction to vanadium"
+    settings['log'].notice(msg.format(van_abs_corr["Type"]))
+    van_abs_corr_ws, van_con_ws = create_absorption_wksp(
+        settings['van_scans'],
+        van_abs_corr["Type"],
+        settings['van_geo_dict'],
+        settings['van_mat_dict'],
+        **settings['config'])
+
+    return {'van_abs_ws': van_abs_corr_ws}
+
+
+def load_sample(settings, grp_wksp, sam_abs_ws):
     # TODO take out the RecalculatePCharge in the future once tested
-    # Load Sample
     print("#-----------------------------------#")
     print("# Sample")
     print("#-----------------------------------#")
     sam_wksp = load(
         'sample',
-        sam_scans,
-        sam_geometry,
-        sam_material,
-        sam_mass_density,
+        settings['sam_scans'],
+        settings['sam_geometry'],
+        settings['sam_material'],
+        settings['sam_mass_density'],
         sam_abs_ws,
-        **alignAndFocusArgs)
-    sample_title = "sample_and_container"
-    save_banks(InputWorkspace=sam_wksp,
-               Filename=nexus_filename,
-               Title=sample_title,
-               OutputDir=OutputDir,
-               GroupingWorkspace=grp_wksp,
-               Binning=binning)
+        run_workers=settings['run_workers'],
+        run_cache=settings['run_cache'],
+        **settings['alignAndFocusArgs'])
 
     sam_molecular_mass = mtd[sam_wksp].sample(
     ).getMaterial().relativeMolecularMass()
     natoms = getNumberAtoms(
-        sam_packing_fraction,
-        sam_mass_density,
+        settings['sam_packing_fraction'],
+        settings['sam_mass_density'],
         sam_molecular_mass,
-        Geometry=sam_geometry)
+        Geometry=settings['sam_geometry'])
+    print("Sample natoms:", natoms)
+
+    return {'sam_wksp': sam_wksp, 'natoms': natoms}
+
 
-    # Load Sample Container
+def load_container(settings, grp_wksp, con_abs_ws):
     print("#-----------------------------------#")
     print("# Sample Container")
     print("#-----------------------------------#")
     container = load(
         'container',
-        container_scans,
+        settings['container_scans'],
         absorption_wksp=con_abs_ws,
-        **alignAndFocusArgs)
-    save_banks(
-        InputWorkspace=container,
-        Filename=nexus_filename,
-        Title=container,
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
+        run_workers=settings['run_workers'],
+        run_cache=settings['run_cache'],
+        **settings['alignAndFocusArgs'])
+    return {'container': container}
 
-    # Load Sample Container Background
 
-    if container_bg is not None:
-        print("#-----------------------------------#")
-        print("# Sample Container's Background")
-        print("#-----------------------------------#")
-        container_bg = load(
-            'container_background',
-            container_bg,
-            **alignAndFocusArgs)
-        save_banks(
-            InputWorkspace=container_bg,
-            Filename=nexus_filename,
-            Title=container_bg,
-            OutputDir=OutputDir,
-            GroupingWorkspace=grp_wksp,
-            Binning=binning)
-
-    # Load Vanadium
+def load_container_background(settings, grp_wksp):
+    print("#-----------------------------------#")
+    print("# Sample Container's Background")
+    print("#-----------------------------------#")
+    container_bg = load(
+        'container_background',
+        settings['container_bg_scans'],
+        run_workers=settings['run_workers'],
+        run_cache=settings['run_cache'],
+        **settings['alignAndFocusArgs'])
+    return {'container_bg': container_bg}
 
+
+def load_vanadium(settings, grp_wksp, van_abs_ws):
     print("#-----------------------------------#")
     print("# Vanadium")
     print("#-----------------------------------#")
     van_wksp = load(
         'vanadium',
-        van_scans,
-        van_geometry,
-        van_material,
-        van_mass_density,
-        van_abs_corr_ws,
-        **alignAndFocusArgs)
-    vanadium_title = "vanadium_and_background"
-
-    save_banks(
-        InputWorkspace=van_wksp,
-        Filename=nexus_filename,
-        Title=vanadium_title,
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
+        settings['van_scans'],
+        settings['van_geometry'],
+        settings['van_material'],
+        settings['van_mass_density'],
+        van_abs_ws,
+        run_workers=settings['run_workers'],
+        run_cache=settings['run_cache'],
+        **settings['alignAndFocusArgs'])
 
     van_material = mtd[van_wksp].sample().getMaterial()
     van_molecular_mass = van_material.relativeMolecularMass()
     nvan_atoms = getNumberAtoms(
         1.0,
-        van_mass_density,
+        settings['van_mass_density'],
         van_molecular_mass,
-        Geometry=van_geometry)
-
-    print("Sample natoms:", natoms)
+        Geometry=settings['van_geometry'])
     print("Vanadium natoms:", nvan_atoms)
-    print("Vanadium natoms / Sample natoms:", nvan_atoms / natoms)
 
-    # Load Vanadium Background
-    van_bg = None
-    if van_bg_scans is not None:
-        print("#-----------------------------------#")
-        print("# Vanadium Background")
-        print("#-----------------------------------#")
-        van_bg = load('vanadium_background', van_bg_scans, **alignAndFocusArgs)
-        vanadium_bg_title = "vanadium_background"
-        save_banks(
-            InputWorkspace=van_bg,
-            Filename=nexus_filename,
-            Title=vanadium_bg_title,
-            OutputDir=OutputDir,
-            GroupingWorkspace=grp_wksp,
-            Binning=binning)
-
-    # Load Instrument Characterizations
-    if characterizations:
-        PDDetermineCharacterizations(
-            InputWorkspace=sam_wksp,
-            Characterizations='characterizations',
-            ReductionProperties='__snspowderreduction')
-        propMan = PropertyManagerDataService.retrieve('__snspowderreduction')
-        qmax = 2. * np.pi / propMan['d_min'].value
-        qmin = 2. * np.pi / propMan['d_max'].value
-        for a, b in zip(qmin, qmax):
-            print('Qrange:', a, b)
-        # TODO: Add when we apply Qmin, Qmax cropping
-        # mask_info = generate_cropping_table(qmin, qmax)
+    return {'van_wksp': van_wksp, 'nvan_atoms': nvan_atoms}
 
-    # STEP 1: Subtract Backgrounds
 
+def load_vanadium_background(settings, grp_wksp):
+    print("#-----------------------------------#")
+    print("# Vanadium Background")
+    print("#-----------------------------------#")
+    van_bg = load(
+        'vanadium_background',
+        settings['van_bg_scans'],
+        run_workers=settings['run_workers'],
+        run_cache=settings['run_cache'],
+        **settings['alignAndFocusArgs'])
+    return {'van_bg': van_bg}
+
+
+def clone_run_set(settings, ws_name, output, **inputs):
+    # Copy of a workspace loaded from the same runs for another role
+    source, = inputs.values()
+    print("#-----------------------------------#")
+    print("# {} (same runs as {})".format(ws_name, source))
+    print("#-----------------------------------#")
+    CloneWorkspace(
+        InputWorkspace=source,
+        OutputWorkspace=ws_name)
+    save_diagnostics(settings, ws_name, ws_name)
+    return {output: ws_name}
+
+
+def determine_characterizations(settings, sam_wksp):
+    # Load Instrument Characterizations, into a property manager of its own
+    # since the loads may be writing theirs meanwhile
+    reduction_properties = reduction_properties_name('characterizations')
+    PDDetermineCharacterizations(
+        InputWorkspace=sam_wksp,
+        Characterizations='characterizations',
+        ReductionProperties=reduction_properties)
+    propMan = PropertyManagerDataService.retrieve(reduction_properties)
+    qmax = 2. * np.pi / propMan['d_min'].value
+    qmin = 2. * np.pi / propMan['d_max'].value
+    for a, b in zip(qmin, qmax):
+        print('Qrange:', a, b)
+    # Applied to each bank when the banks are merged
+    return {'qmin': list(qmin), 'qmax': list(qmax)}
+
+
+def copy_raw_workspaces(settings, sam_wksp, container):
+    # Sample and container before background subtraction, only written to
+    # the diagnostics file
     sam_raw = 'sam_raw'
     CloneWorkspace(
         InputWorkspace=sam_wksp,
-        OutputWorkspace=sam_raw)  # for later
+        OutputWorkspace=sam_raw)
 
     container_raw = 'container_raw'
     CloneWorkspace(
         InputWorkspace=container,
-        OutputWorkspace=container_raw)  # for later
+        OutputWorkspace=container_raw)
 
-    if van_bg is not None:
-        RebinToWorkspace(
-            WorkspaceToRebin=van_bg,
-            WorkspaceToMatch=van_wksp,
-            OutputWorkspace=van_bg)
-        Minus(
-            LHSWorkspace=van_wksp,
-            RHSWorkspace=van_bg,
-            OutputWorkspace=van_wksp)
+    return {'sam_raw': sam_raw,
+            'container_raw': container_raw}
 
+
+def subtract_sample_background(settings, sam_wksp, container):
     RebinToWorkspace(
         WorkspaceToRebin=container,
         WorkspaceToMatch=sam_wksp,
@@ -741,6 +1456,18 @@ def TotalScatteringReduction(config=None):
         RHSWorkspace=container,
         OutputWorkspace=sam_wksp)
 
+    ConvertUnits(
+        InputWorkspace=sam_wksp,
+        OutputWorkspace=sam_wksp,
+        Target="MomentumTransfer",
+        EMode="Elastic")
+
+    return {'sam_minus_back': sam_wksp,
+            'container_matched': container}
+
+
+def subtract_container_background(settings, container_matched, container_bg):
+    container = container_matched
     if container_bg is not None:
         RebinToWorkspace(
             WorkspaceToRebin=container_bg,
@@ -751,44 +1478,50 @@ def TotalScatteringReduction(config=None):
             RHSWorkspace=container_bg,
             OutputWorkspace=container)
 
-    for wksp in [container, van_wksp, sam_wksp]:
-        ConvertUnits(
-            InputWorkspace=wksp,
-            OutputWorkspace=wksp,
-            Target="MomentumTransfer",
-            EMode="Elastic")
-    container_title = "container_minus_back"
-    vanadium_title = "vanadium_minus_back"
-    sample_title = "sample_minus_back"
-    save_banks(
+    ConvertUnits(
         InputWorkspace=container,
-        Filename=nexus_filename,
-        Title=container_title,
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
-    save_banks(
+        OutputWorkspace=container,
+        Target="MomentumTransfer",
+        EMode="Elastic")
+
+    return {'container_minus_back': container,
+            'container_bg_matched': container_bg}
+
+
+def subtract_vanadium_background(settings, van_wksp, van_bg):
+    if van_bg is not None:
+        RebinToWorkspace(
+            WorkspaceToRebin=van_bg,
+            WorkspaceToMatch=van_wksp,
+            OutputWorkspace=van_bg)
+        Minus(
+            LHSWorkspace=van_wksp,
+            RHSWorkspace=van_bg,
+            OutputWorkspace=van_wksp)
+
+    ConvertUnits(
         InputWorkspace=van_wksp,
-        Filename=nexus_filename,
-        Title=vanadium_title,
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
-    save_banks(
-        InputWorkspace=sam_wksp,
-        Filename=nexus_filename,
-        Title=sample_title,
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
+        OutputWorkspace=van_wksp,
+        Target="MomentumTransfer",
+        EMode="Elastic")
+
+    return {'van_minus_back': van_wksp,
+            'van_bg_matched': van_bg}
 
-    # STEP 2.0: Prepare vanadium as normalization calibrant
+
+def prepare_vanadium(settings, van_minus_back):
+    van = settings['van']
+    van_abs_corr = settings['van_abs_corr']
+    van_ms_corr = settings['van_ms_corr']
+    van_inelastic_corr = settings['van_inelastic_corr']
+    alignAndFocusArgs = settings['alignAndFocusArgs']
+    binning = settings['binning']
 
     # Multiple-Scattering and Absorption (Steps 2-4) for Vanadium
 
     van_corrected = 'van_corrected'
     ConvertUnits(
-        InputWorkspace=van_wksp,
+        InputWorkspace=van_minus_back,
         OutputWorkspace=van_corrected,
         Target="Wavelength",
         EMode="Elastic")
@@ -824,21 +1557,9 @@ def TotalScatteringReduction(config=None):
         OutputWorkspace=van_corrected,
         Target='MomentumTransfer',
         EMode='Elastic')
-    vanadium_title += "_ms_abs_corrected"
-    save_banks(
-        InputWorkspace=van_corrected,
-        Filename=nexus_filename,
-        Title=vanadium_title,
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
-    save_banks(
-        InputWorkspace=van_corrected,
-        Filename=nexus_filename,
-        Title=vanadium_title + "_with_peaks",
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
+    vanadium_title = "vanadium_minus_back_ms_abs_corrected"
+    save_diagnostics(settings, van_corrected, vanadium_title)
+    save_diagnostics(settings, van_corrected, vanadium_title + "_with_peaks")
 
     # TODO subtract self-scattering of vanadium (According to Eq. 7 of Howe,
     # McGreevey, and Howells, JPCM, 1989)
@@ -863,13 +1584,7 @@ def TotalScatteringReduction(config=None):
         Target='MomentumTransfer',
         EMode='Elastic')
     vanadium_title += '_peaks_stripped'
-    save_banks(
-        InputWorkspace=van_corrected,
-        Filename=nexus_filename,
-        Title=vanadium_title,
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
+    save_diagnostics(settings, van_corrected, vanadium_title)
 
     ConvertUnits(
         InputWorkspace=van_corrected,
@@ -891,42 +1606,34 @@ def TotalScatteringReduction(config=None):
         Target='MomentumTransfer',
         EMode='Elastic')
 
+    # Without inelastic correction, the smoothed vanadium is the output
     vanadium_title += '_smoothed'
-    save_banks(
-        InputWorkspace=van_corrected,
-        Filename=nexus_filename,
-        Title=vanadium_title,
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
+    placzek = van_inelastic_corr['Type'] == "Placzek"
 
     # Inelastic correction
-    if van_inelastic_corr['Type'] == "Placzek":
-        van_scan = van['Runs'][0]
+    if placzek:
+        save_diagnostics(settings, van_corrected, vanadium_title)
+
         van_incident_wksp = 'van_incident_wksp'
         van_inelastic_opts = van['InelasticCorrection']
-        lambda_binning_fit = van_inelastic_opts['LambdaBinningForFit']
-        lambda_binning_calc = van_inelastic_opts['LambdaBinningForCalc']
-        print('van_scan:', van_scan)
-        GetIncidentSpectrumFromMonitor(
-            Filename=facility_file_format % (instr, van_scan),
-            OutputWorkspace=van_incident_wksp)
-
-        fit_type = van['InelasticCorrection']['FitSpectrumWith']
-        FitIncidentSpectrum(
-            InputWorkspace=van_incident_wksp,
-            OutputWorkspace=van_incident_wksp,
-            FitSpectrumWith=fit_type,
-            BinningForFit=lambda_binning_fit,
-            BinningForCalc=lambda_binning_calc,
-            PlotDiagnostics=False)
+        fitted_incident_spectrum(
+            van_incident_wksp,
+            settings['van_scans'],
+            FitSpectrumWith=van_inelastic_opts['FitSpectrumWith'],
+            BinningForFit=van_inelastic_opts['LambdaBinningForFit'],
+            BinningForCalc=van_inelastic_opts['LambdaBinningForCalc'],
+            cache=settings['incident_cache'],
+            warm_starts=settings['warm_starts'],
+            instrument=settings['instr'],
+            moderator=van_inelastic_opts.get('Moderator'))
 
         van_placzek = 'van_placzek'
 
+        van_material = mtd[van_corrected].sample().getMaterial()
         SetSample(
             InputWorkspace=van_incident_wksp,
             Material={'ChemicalFormula': str(van_material),
-                      'SampleMassDensity': str(van_mass_density)})
+                      'SampleMassDensity': str(settings['van_mass_density'])})
 
         CalculatePlaczekSelfScattering(
             IncidentWorkspace=van_incident_wksp,
@@ -954,13 +1661,7 @@ def TotalScatteringReduction(config=None):
                 Params=binning,
                 PreserveEvents=True)
 
-        save_banks(
-            InputWorkspace=van_placzek,
-            Filename=nexus_filename,
-            Title="vanadium_placzek",
-            OutputDir=OutputDir,
-            GroupingWorkspace=grp_wksp,
-            Binning=binning)
+        save_diagnostics(settings, van_placzek, "vanadium_placzek")
 
         # Rebin in Wavelength
         for wksp in [van_placzek, van_corrected]:
@@ -972,7 +1673,7 @@ def TotalScatteringReduction(config=None):
             Rebin(
                 InputWorkspace=wksp,
                 OutputWorkspace=wksp,
-                Params=lambda_binning_calc,
+                Params=van_inelastic_opts['LambdaBinningForCalc'],
                 PreserveEvents=True)
 
         # Save after rebin in Q
@@ -998,7 +1699,7 @@ def TotalScatteringReduction(config=None):
             RHSWorkspace=van_placzek,
             OutputWorkspace=van_corrected)
 
-        # Save after subtraction
+        # Back to Q after subtraction
         for wksp in [van_placzek, van_corrected]:
             ConvertUnits(
                 InputWorkspace=wksp,
@@ -1006,30 +1707,144 @@ def TotalScatteringReduction(config=None):
                 Target='MomentumTransfer',
                 EMode='Elastic')
 
-        vanadium_title += '_placzek_corrected'
-        save_banks(
-            InputWorkspace=van_corrected,
-            Filename=nexus_filename,
-            Title=vanadium_title,
-            OutputDir=OutputDir,
-            GroupingWorkspace=grp_wksp,
-            Binning=binning)
-
     ConvertUnits(
         InputWorkspace=van_corrected,
         OutputWorkspace=van_corrected,
         Target='MomentumTransfer',
         EMode='Elastic')
 
+    return {'van_corrected': van_corrected}
+
+
+def prepared_vanadium_title(settings):
+    """ Title of the prepared vanadium in the diagnostics file """
+    title = "vanadium_minus_back_ms_abs_corrected_peaks_stripped_smoothed"
+    if settings['van_inelastic_corr']['Type'] == "Placzek":
+        title += '_placzek_corrected'
+    return title
+
+
+def prepared_vanadium_key(settings):
+    """ Key of the prepared vanadium in the vanadium library
+
+    :param settings: Settings from `configure_reduction`
+    :type settings: dict
+
+    :return: The key, or None if an input file could not be found
+    :rtype: str or None
+    """
+    graph = build_reduction_graph(dict(settings, vanadium_key=None))
+    initial = initial_values(settings)
+    graph = graph.subgraph(['van_corrected', 'nvan_atoms'], initial)
+    return graph.keys(settings['vanadium_library'], initial)[
+        'prepare_vanadium']
+
+
+def load_prepared_vanadium(settings):
+    library = settings['vanadium_library']
+    library.restore(settings['vanadium_key'])
+    outputs = library.lookup(settings['vanadium_key'])
+    # The background was subtracted when the vanadium was prepared, only
+    # kept for the diagnostics
+    van_bg_matched = outputs.get('van_bg_matched', None)
+    if van_bg_matched is None and settings['van_bg_scans'] is not None \
+            and diagnostics_enabled(settings, 'full'):
+        Logger("TotalScatteringReduction").warning(
+            "Prepared vanadium {} has no background, skipping the "
+            "vanadium_background_normalized diagnostic".format(
+                settings['vanadium_key']))
+    return {'van_corrected': outputs['van_corrected'],
+            'nvan_atoms': outputs['nvan_atoms'],
+            'van_bg_matched': van_bg_matched}
+
+
+def store_prepared_vanadium(settings, van_corrected, nvan_atoms,
+                            van_bg_matched):
+    settings['vanadium_library'].store(
+        settings['vanadium_key'],
+        describe_vanadium(settings),
+        {'van_corrected': van_corrected, 'nvan_atoms': nvan_atoms,
+         'van_bg_matched': van_bg_matched})
+
+
+def build_prepared_vanadium(config):
+    """ Prepare the vanadium of a reduction and add it to the library
+
+    :param config: JSON input for reduction, with `VanadiumLibrary` set
+    :type config: dict
+
+    :return: Key of the prepared vanadium and if it was already there
+    :rtype: tuple
+    """
+    settings = configure_reduction(config)
+    library = settings['vanadium_library']
+    if library is None:
+        raise RuntimeError("No VanadiumLibrary given in the input")
+    settings['vanadium_key'] = prepared_vanadium_key(settings)
+    if settings['vanadium_key'] is None:
+        raise RuntimeError("Could not find the vanadium input files")
+    if library.lookup(settings['vanadium_key']) is not None:
+        return settings['vanadium_key'], True
+
+    initial = initial_values(settings)
+    graph = build_reduction_graph(settings)
+    graph = graph.subgraph(['van_normalization'], initial)
+    graph.run(initial=initial, max_workers=settings['max_workers'])
+    return settings['vanadium_key'], False
+
+
+def rebin_vanadium(settings, van_corrected):
+    ConvertUnits(
+        InputWorkspace=van_corrected,
+        OutputWorkspace=van_corrected,
+        Target='MomentumTransfer',
+        EMode='Elastic',
+        ConvertFromPointData=False)
+
+    Rebin(
+        InputWorkspace=van_corrected,
+        OutputWorkspace=van_corrected,
+        Params=settings['binning'],
+        PreserveEvents=True)
+
     SetUncertainties(
         InputWorkspace=van_corrected,
         OutputWorkspace=van_corrected,
         SetError='zero')
 
-    # STEP 2.1: Normalize by Vanadium
+    return {'van_normalization': van_corrected}
 
-    wksp_list = [sam_wksp, sam_raw, van_corrected]
-    for name in wksp_list:
+
+def normalize_sample(settings, sam_minus_back, van_normalization):
+    sam_wksp = sam_minus_back
+    ConvertUnits(
+        InputWorkspace=sam_wksp,
+        OutputWorkspace=sam_wksp,
+        Target='MomentumTransfer',
+        EMode='Elastic',
+        ConvertFromPointData=False)
+
+    Rebin(
+        InputWorkspace=sam_wksp,
+        OutputWorkspace=sam_wksp,
+        Params=settings['binning'],
+        PreserveEvents=True)
+
+    # Save the sample - back / normalized
+    Divide(
+        LHSWorkspace=sam_wksp,
+        RHSWorkspace=van_normalization,
+        OutputWorkspace=sam_wksp)
+
+    sample_title = "sample_minus_back_normalized"
+
+    return {'sam_normalized': sam_wksp,
+            'sam_normalized_title': sample_title}
+
+
+def normalize_raw_workspaces(settings, sam_raw, container_raw,
+                             van_normalization):
+    for name in [sam_raw, container_raw]:
         ConvertUnits(
             InputWorkspace=name,
             OutputWorkspace=name,
@@ -1040,49 +1855,34 @@ def TotalScatteringReduction(config=None):
         Rebin(
             InputWorkspace=name,
             OutputWorkspace=name,
-            Params=binning,
+            Params=settings['binning'],
             PreserveEvents=True)
 
-    # Save the sample - back / normalized
-    Divide(
-        LHSWorkspace=sam_wksp,
-        RHSWorkspace=van_corrected,
-        OutputWorkspace=sam_wksp)
-
-    sample_title += "_normalized"
-    save_banks(
-        InputWorkspace=sam_wksp,
-        Filename=nexus_filename,
-        Title=sample_title,
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
-
     # Save the sample / normalized (ie no background subtraction)
     Divide(
        LHSWorkspace=sam_raw,
-       RHSWorkspace=van_corrected,
+       RHSWorkspace=van_normalization,
        OutputWorkspace=sam_raw)
 
-    save_banks(
-        InputWorkspace=sam_raw,
-        Filename=nexus_filename,
-        Title="sample_normalized",
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
-
-    # Output an initial I(Q) for sample
-    iq_filename = title + '_initial_iofq_banks.nxs'
-    save_banks(
-        InputWorkspace=sam_wksp,
-        Filename=iq_filename,
-        Title="IQ_banks",
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
+    save_diagnostics(settings, sam_raw, "sample_normalized")
+
+    # Save the container / normalized (ie no background subtraction)
+    Divide(
+       LHSWorkspace=container_raw,
+       RHSWorkspace=van_normalization,
+       OutputWorkspace=container_raw)
+
+    save_diagnostics(settings, container_raw, "container_normalized")
 
-    wksp_list = [container, container_raw, van_corrected]
+
+def normalize_backgrounds(settings, container_minus_back,
+                          container_bg_matched, van_bg_matched,
+                          van_normalization):
+    container = container_minus_back
+    container_bg = container_bg_matched
+    van_bg = van_bg_matched
+
+    wksp_list = [container]
     if container_bg is not None:
         wksp_list.append(container_bg)
     if van_bg is not None:
@@ -1099,71 +1899,42 @@ def TotalScatteringReduction(config=None):
         Rebin(
             InputWorkspace=name,
             OutputWorkspace=name,
-            Params=binning,
+            Params=settings['binning'],
             PreserveEvents=True)
 
     # Save the container - container_background / normalized
     Divide(
         LHSWorkspace=container,
-        RHSWorkspace=van_corrected,
+        RHSWorkspace=van_normalization,
         OutputWorkspace=container)
 
-    container_title += '_normalized'
-    save_banks(
-        InputWorkspace=container,
-        Filename=nexus_filename,
-        Title=container_title,
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
-
-    # Save the container / normalized (ie no background subtraction)
-    Divide(
-       LHSWorkspace=container_raw,
-       RHSWorkspace=van_corrected,
-       OutputWorkspace=container_raw)
-
-    save_banks(
-        InputWorkspace=container_raw,
-        Filename=nexus_filename,
-        Title="container_normalized",
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
+    save_diagnostics(settings, container, "container_minus_back_normalized")
 
     # Save the container_background / normalized
     if container_bg is not None:
         Divide(
             LHSWorkspace=container_bg,
-            RHSWorkspace=van_corrected,
+            RHSWorkspace=van_normalization,
             OutputWorkspace=container_bg)
 
-        container_bg_title = "container_back_normalized"
-        save_banks(
-            InputWorkspace=container_bg,
-            Filename=nexus_filename,
-            Title=container_bg_title,
-            OutputDir=OutputDir,
-            GroupingWorkspace=grp_wksp,
-            Binning=binning)
+        save_diagnostics(settings, container_bg, "container_back_normalized")
 
     # Save the vanadium_background / normalized
     if van_bg is not None:
         Divide(
             LHSWorkspace=van_bg,
-            RHSWorkspace=van_corrected,
+            RHSWorkspace=van_normalization,
             OutputWorkspace=van_bg)
 
-        vanadium_bg_title += "_normalized"
-        save_banks(
-            InputWorkspace=van_bg,
-            Filename=nexus_filename,
-            Title=vanadium_bg_title,
-            OutputDir=OutputDir,
-            GroupingWorkspace=grp_wksp,
-            Binning=binning)
+        save_diagnostics(settings, van_bg, "vanadium_background_normalized")
 
-    # STEP 3 & 4: Subtract multiple scattering and apply absorption correction
+
+def correct_sample_ms_and_absorption(settings, sam_normalized,
+                                     sam_normalized_title):
+    sam_wksp = sam_normalized
+    sample_title = sam_normalized_title
+    sam_abs_corr = settings['sam_abs_corr']
+    sam_ms_corr = settings['sam_ms_corr']
 
     ConvertUnits(
         InputWorkspace=sam_wksp,
@@ -1178,7 +1949,7 @@ def TotalScatteringReduction(config=None):
             CarpenterSampleCorrection(
                 InputWorkspace=sam_wksp,
                 OutputWorkspace=sam_corrected,
-                CylinderSampleRadius=sample['Geometry']['Radius'])
+                CylinderSampleRadius=settings['sample']['Geometry']['Radius'])
         elif sam_abs_corr['Type'] == 'Mayers' \
                 or sam_ms_corr['Type'] == 'Mayers':
             if sam_ms_corr['Type'] == 'Mayers':
@@ -1204,18 +1975,16 @@ def TotalScatteringReduction(config=None):
             EMode='Elastic')
 
         sample_title += "_ms_abs_corrected"
-        save_banks(
-            InputWorkspace=sam_corrected,
-            Filename=nexus_filename,
-            Title=sample_title,
-            OutputDir=OutputDir,
-            GroupingWorkspace=grp_wksp,
-            Binning=binning)
     else:
         CloneWorkspace(InputWorkspace=sam_wksp, OutputWorkspace=sam_corrected)
 
-    # STEP 5: Divide by number of atoms in sample
+    return {'sam_corrected': sam_corrected,
+            'sam_corrected_title': sample_title}
+
 
+def normalize_by_atoms(settings, sam_corrected, sam_corrected_title, natoms,
+                       nvan_atoms):
+    print("Vanadium natoms / Sample natoms:", nvan_atoms / natoms)
     mtd[sam_corrected] = (nvan_atoms / natoms) * mtd[sam_corrected]
     ConvertUnits(
         InputWorkspace=sam_corrected,
@@ -1223,77 +1992,79 @@ def TotalScatteringReduction(config=None):
         Target='MomentumTransfer',
         EMode='Elastic')
 
-    sample_title += "_norm_by_atoms"
-    save_banks(
-        InputWorkspace=sam_corrected,
-        Filename=nexus_filename,
-        Title=sample_title,
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
-
-    # STEP 6: Divide by total scattering length squared = total scattering
-    # cross-section over 4 * pi
-    van_material = mtd[van_corrected].sample().getMaterial()
+    sample_title = sam_corrected_title + "_norm_by_atoms"
+
+    return {'sam_norm_by_atoms': sam_corrected,
+            'sam_norm_by_atoms_title': sample_title}
+
+
+def multiply_by_vanadium_self_scattering(settings, sam_norm_by_atoms,
+                                         sam_norm_by_atoms_title,
+                                         van_normalization):
+    # Total scattering length squared = total scattering cross-section over
+    # 4 * pi
+    sam_corrected = sam_norm_by_atoms
+    van_material = mtd[van_normalization].sample().getMaterial()
     sigma_v = van_material.totalScatterXSection()
     prefactor = (sigma_v / (4. * np.pi))
     msg = "Total scattering cross-section of Vanadium:{} sigma_v / 4*pi: {}"
     print(msg.format(sigma_v, prefactor))
 
     mtd[sam_corrected] = prefactor * mtd[sam_corrected]
-    sample_title += '_multiply_by_vanSelfScat'
-    save_banks(
-        InputWorkspace=sam_corrected,
-        Filename=nexus_filename,
-        Title=sample_title,
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
+    sample_title = sam_norm_by_atoms_title + '_multiply_by_vanSelfScat'
+
+    return {'sam_scaled': sam_corrected,
+            'sam_scaled_title': sample_title}
+
+
+def correct_sample_inelastic(settings, sam_scaled, sam_scaled_title):
+    sam_corrected = sam_scaled
+    sample_title = sam_scaled_title
+    sample = settings['sample']
+    sam_material = settings['sam_material']
+    alignAndFocusArgs = settings['alignAndFocusArgs']
 
-    # STEP 7: Inelastic correction
     ConvertUnits(
         InputWorkspace=sam_corrected,
         OutputWorkspace=sam_corrected,
         Target='Wavelength',
         EMode='Elastic')
 
-    if sam_inelastic_corr['Type'] == "Placzek":
+    if settings['sam_inelastic_corr']['Type'] == "Placzek":
         if sam_material is None:
             error = "For Placzek correction, must specifiy a sample material."
             raise Exception(error)
-        for sam_scan in sample['Runs']:
-            sam_incident_wksp = 'sam_incident_wksp'
-            sam_inelastic_opts = sample['InelasticCorrection']
-            lambda_binning_fit = sam_inelastic_opts['LambdaBinningForFit']
-            lambda_binning_calc = sam_inelastic_opts['LambdaBinningForCalc']
-            GetIncidentSpectrumFromMonitor(
-                Filename=facility_file_format % (instr, sam_scan),
-                OutputWorkspace=sam_incident_wksp)
-
-            fit_type = sample['InelasticCorrection']['FitSpectrumWith']
-            FitIncidentSpectrum(
-                InputWorkspace=sam_incident_wksp,
-                OutputWorkspace=sam_incident_wksp,
-                FitSpectrumWith=fit_type,
-                BinningForFit=lambda_binning_fit,
-                BinningForCalc=lambda_binning_calc)
-
-            sam_placzek = 'sam_placzek'
-            SetSample(
-                InputWorkspace=sam_incident_wksp,
-                Material={'ChemicalFormula': str(sam_material),
-                          'SampleMassDensity': str(sam_mass_density)})
-            CalculatePlaczekSelfScattering(
-                IncidentWorkspace=sam_incident_wksp,
-                ParentWorkspace=sam_corrected,
-                OutputWorkspace=sam_placzek,
-                L1=19.5,
-                L2=alignAndFocusArgs['L2'],
-                Polar=alignAndFocusArgs['Polar'])
-
-            ConvertToHistogram(
-                InputWorkspace=sam_placzek,
-                OutputWorkspace=sam_placzek)
+        # One fit of the monitors summed over all the sample runs
+        sam_incident_wksp = 'sam_incident_wksp'
+        sam_inelastic_opts = sample['InelasticCorrection']
+        fitted_incident_spectrum(
+            sam_incident_wksp,
+            settings['sam_scans'],
+            FitSpectrumWith=sam_inelastic_opts['FitSpectrumWith'],
+            BinningForFit=sam_inelastic_opts['LambdaBinningForFit'],
+            BinningForCalc=sam_inelastic_opts['LambdaBinningForCalc'],
+            cache=settings['incident_cache'],
+            warm_starts=settings['warm_starts'],
+            instrument=settings['instr'],
+            moderator=sam_inelastic_opts.get('Moderator'))
+
+        sam_placzek = 'sam_placzek'
+        SetSample(
+            InputWorkspace=sam_incident_wksp,
+            Material={
+                'ChemicalFormula': str(sam_material),
+                'SampleMassDensity': str(settings['sam_mass_density'])})
+        CalculatePlaczekSelfScattering(
+            IncidentWorkspace=sam_incident_wksp,
+            ParentWorkspace=sam_corrected,
+            OutputWorkspace=sam_placzek,
+            L1=19.5,
+            L2=alignAndFocusArgs['L2'],
+            Polar=alignAndFocusArgs['Polar'])
+
+        ConvertToHistogram(
+            InputWorkspace=sam_placzek,
+            OutputWorkspace=sam_placzek)
 
         # Save before rebin in Q
         for wksp in [sam_placzek, sam_corrected]:
@@ -1306,16 +2077,10 @@ def TotalScatteringReduction(config=None):
             Rebin(
                 InputWorkspace=wksp,
                 OutputWorkspace=wksp,
-                Params=binning,
+                Params=settings['binning'],
                 PreserveEvents=True)
 
-        save_banks(
-            InputWorkspace=sam_placzek,
-            Filename=nexus_filename,
-            Title="sample_placzek",
-            OutputDir=OutputDir,
-            GroupingWorkspace=grp_wksp,
-            Binning=binning)
+        save_diagnostics(settings, sam_placzek, "sample_placzek")
 
         # Save after rebin in Q
         for wksp in [sam_placzek, sam_corrected]:
@@ -1339,21 +2104,45 @@ def TotalScatteringReduction(config=None):
                 EMode='Elastic')
 
         sample_title += '_placzek_corrected'
-        save_banks(
-            InputWorkspace=sam_corrected,
-            Filename=nexus_filename,
-            Title=sample_title,
-            OutputDir=OutputDir,
-            GroupingWorkspace=grp_wksp,
-            Binning=binning)
 
-    # STEP 7: Output spectrum
+    return {'sam_inelastic_corrected': sam_corrected,
+            'sam_inelastic_corrected_title': sample_title}
+
+
+def normalize_to_sofq(InputWorkspace, OutputWorkspace):
+    """ S(Q) from the differential cross section per atom of the sample,
+    S(Q) = (dsigma/dOmega - <b^2>) / <b>^2 + 1
+
+    :param InputWorkspace: Differential cross section in barn/sr per atom,
+                           with the sample material set
+    :type InputWorkspace: str
+    :param OutputWorkspace: Name of the S(Q) workspace
+    :type OutputWorkspace: str
+    """
+    material = mtd[InputWorkspace].sample().getMaterial()
+    # Scattering lengths are in fm, the cross section in barn
+    # (1 barn = 100 fm^2)
+    bcoh_avg_sqrd = material.cohScatterLength() ** 2 / 100.
+    btot_sqrd_avg = material.totalScatterLengthSqrd() / 100.
+    if bcoh_avg_sqrd == 0.:
+        msg = "S(Q) is undefined for {}, its average coherent scattering " \
+              "length is zero"
+        raise RuntimeError(msg.format(material.name()))
+    mtd[OutputWorkspace] = (1. / bcoh_avg_sqrd) * mtd[InputWorkspace] \
+        - btot_sqrd_avg / bcoh_avg_sqrd + 1.
+
+
+def output_spectrum(settings, sam_inelastic_corrected, van_normalization):
+    sam_corrected = sam_inelastic_corrected
+    van_corrected = van_normalization
+    title = settings['title']
+    OutputDir = settings['OutputDir']
 
     # TODO Since we already went from Event -> 2D workspace, can't use this
     # anymore
     print('sam:', mtd[sam_corrected].id())
     print('van:', mtd[van_corrected].id())
-    if alignAndFocusArgs['PreserveEvents']:
+    if settings['alignAndFocusArgs']['PreserveEvents']:
         CompressEvents(
             InputWorkspace=sam_corrected,
             OutputWorkspace=sam_corrected)
@@ -1367,53 +2156,24 @@ def TotalScatteringReduction(config=None):
     material = mtd[sam_corrected].sample().getMaterial()
     if material.name() is None or len(material.name().strip()) == 0:
         raise RuntimeError('Sample material was not set')
+    sq_banks_wksp = 'SQ_banks_wksp'
+    normalize_to_sofq(sam_corrected, sq_banks_wksp)
     bcoh_avg_sqrd = material.cohScatterLength() * material.cohScatterLength()
     btot_sqrd_avg = material.totalScatterLengthSqrd()
     laue_monotonic_diffuse_scat = btot_sqrd_avg / bcoh_avg_sqrd
-    sq_banks_wksp = 'SQ_banks_wksp'
-    CloneWorkspace(InputWorkspace=sam_corrected, OutputWorkspace=sq_banks_wksp)
-
-    # TODO: Add the following when implemented
-    '''
-    SQ_banks = (1. / bcoh_avg_sqrd) * \
-        mtd[sq_banks_wksp] - laue_monotonic_diffuse_scat + 1.
-    '''
 
     # Save S(Q) and F(Q) to diagnostics NeXus file
-    save_banks(
-        InputWorkspace=fq_banks_wksp,
-        Filename=nexus_filename,
-        Title="FQ_banks",
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
-
-    save_banks(
-        InputWorkspace=sq_banks_wksp,
-        Filename=nexus_filename,
-        Title="SQ_banks",
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
+    save_diagnostics(settings, fq_banks_wksp, "FQ_banks", Level='key')
+    save_diagnostics(settings, sq_banks_wksp, "SQ_banks", Level='key')
 
     # Output a main S(Q) and F(Q) file
     fq_filename = title + '_fofq_banks_corrected.nxs'
-    save_banks(
-        InputWorkspace=fq_banks_wksp,
-        Filename=fq_filename,
-        Title="FQ_banks",
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
+    save_diagnostics(settings, fq_banks_wksp, "FQ_banks", Filename=fq_filename,
+                     Level='none')
 
     sq_filename = title + '_sofq_banks_corrected.nxs'
-    save_banks(
-        InputWorkspace=sq_banks_wksp,
-        Filename=sq_filename,
-        Title="SQ_banks",
-        OutputDir=OutputDir,
-        GroupingWorkspace=grp_wksp,
-        Binning=binning)
+    save_diagnostics(settings, sq_banks_wksp, "SQ_banks", Filename=sq_filename,
+                     Level='none')
 
     # Print log information
     print("<b>^2:", bcoh_avg_sqrd)
@@ -1463,4 +2223,90 @@ def TotalScatteringReduction(config=None):
         Format="SLOG",
         ExtendedHeader=True)
 
-    return mtd[sam_corrected]
+    return {'result': sam_corrected, 'sq_banks': sq_banks_wksp}
+
+
+def merge_banks(settings, sq_banks, qmin, qmax):
+    """ Merge the S(Q) of the `"SumBanks"` banks, each cropped to its Q
+    range from the characterizations, into the total S(Q), written to
+    `<Title>_sofq_merged.nxs` and `<Title>_sofq_merged.dat`
+
+    :param settings: Settings from `configure_reduction`
+    :type settings: dict
+    :param sq_banks: S(Q) bank-by-bank
+    :type sq_banks: str
+    :param qmin: Lower Q limit of each bank, None for no limit
+    :type qmin: list
+    :param qmax: Upper Q limit of each bank, None for no limit
+    :type qmax: list
+
+    :return: The merged S(Q) workspace name
+    :rtype: dict
+    """
+    title = settings['title']
+    sq_merged_wksp = 'SQ_merged_wksp'
+    source = sq_banks
+    if not mtd[sq_banks].isCommonBins():
+        source = Rebin(InputWorkspace=sq_banks,
+                       OutputWorkspace='__sq_banks_rebinned',
+                       Params=settings['binning'])
+    merge_workspace(source, sq_merged_wksp, qmin=qmin, qmax=qmax,
+                    sum_banks=settings['sum_banks'])
+    if source is not sq_banks:
+        DeleteWorkspace(source)
+
+    save_diagnostics(settings, sq_merged_wksp, "SQ_merged", Level='key',
+                     Rebin=False)
+    save_diagnostics(settings, sq_merged_wksp, "SQ_merged",
+                     Filename=title + '_sofq_merged.nxs', Level='none',
+                     Rebin=False)
+    header = ['S(Q) merged from banks {}'.format(settings['sum_banks']),
+              'Qmin: {} Qmax: {}'.format(qmin, qmax)]
+    sq_filename = os.path.join(os.path.abspath(settings['OutputDir']),
+                               title + '_sofq_merged.dat')
+    save_file(sq_merged_wksp, sq_filename, header=header)
+    return {'sq_merged': sq_merged_wksp}
+
+
+def transform_to_gofr(settings, sq_banks, sq_merged):
+    """ Fourier transform S(Q) of every bank and the merged S(Q) to G(r),
+    written to `<Title>_gofr_banks` and `<Title>_gofr` (`.nxs` and `.dat`)
+
+    :param settings: Settings from `configure_reduction`
+    :type settings: dict
+    :param sq_banks: S(Q) bank-by-bank
+    :type sq_banks: str
+    :param sq_merged: Merged S(Q)
+    :type sq_merged: str
+
+    :return: The G(r) workspace names
+    :rtype: dict
+    """
+    title = settings['title']
+    options = settings['fourier_transform']
+    OutputDir = os.path.abspath(settings['OutputDir'])
+
+    # The merged S(Q) is transformed over the Q range of all the banks
+    merged_options = dict(options)
+    for key, limit in [('qmin', min), ('qmax', max)]:
+        if np.ndim(options[key]):
+            merged_options[key] = limit(options[key])
+
+    outputs = dict()
+    for output, source, name, basename, transform_options in [
+            ('gofr_banks', sq_banks, 'GofR_banks', '_gofr_banks', options),
+            ('gofr_merged', sq_merged, 'GofR_merged', '_gofr',
+             merged_options)]:
+        wksp = name + '_wksp'
+        transform_workspace(source, wksp, **transform_options)
+        save_diagnostics(settings, wksp, name,
+                         Filename=title + basename + '.nxs', Level='none',
+                         Rebin=False)
+        header = ['G(r) = 2/pi * int Q [S(Q) - 1] sin(Q r) dQ',
+                  'Qmin: {} Qmax: {} Lorch: {}'.format(
+                      transform_options['qmin'], transform_options['qmax'],
+                      transform_options['lorch'])]
+        save_file(wksp, os.path.join(OutputDir, title + basename + '.dat'),
+                  header=header)
+        outputs[output] = wksp
+    return outputs
@@ -0,0 +1,51 @@
+from __future__ import (absolute_import, division, print_function)
+
+from total_scattering.reduction.stage_cache import StageCache
+
+
+def library_dir(config):
+    """ Get the directory of the prepared vanadium library from the JSON
+    input (`"VanadiumLibrary": "/path/to/library"`)
+
+    :param config: JSON input for reduction
+    :type config: dict
+
+    :return: The directory, or None if the library is not used
+    :rtype: str or None
+    """
+    return config.get('VanadiumLibrary', None) or None
+
+
+def describe_vanadium(settings):
+    """ Short description of a prepared vanadium for listing the library
+
+    :param settings: Settings from `configure_reduction`
+    :type settings: dict
+
+    :return: Instrument, vanadium runs and background runs
+    :rtype: str
+    """
+    description = "{} vanadium {}".format(
+        settings['instr'], settings['van_scans'])
+    if settings['van_bg_scans']:
+        description += " background {}".format(settings['van_bg_scans'])
+    return description
+
+
+class VanadiumLibrary(StageCache):
+    """ Persistent store of prepared vanadium workspaces
+
+    Entries hold the output of "STEP 2.0: Prepare vanadium" (`van_corrected`)
+    with the number of vanadium atoms and the matched vanadium background
+    (for the diagnostics), keyed like the stage cache by the vanadium and
+    vanadium background runs, calibration, grouping and vanadium options.
+    Unlike the stage cache, entries are only removed when
+    pruned explicitly, so a vanadium can be kept for a whole cycle.
+
+    :param library_dir: Directory of the library
+    :type library_dir: str
+    """
+    subdir = 'vanadium'
+
+    def __init__(self, library_dir):
+        super(VanadiumLibrary, self).__init__(library_dir)